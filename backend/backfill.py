@@ -0,0 +1,167 @@
+"""
+One-off data backfills for existing documents.
+
+Run from the backend directory with the same environment as the server:
+
+    python backfill.py media
+    python backfill.py event_geo
+    python backfill.py deal_offers
+    python backfill.py appointment_times
+    python backfill.py order_updated_at
+"""
+
+import asyncio
+import sys
+from datetime import datetime, timezone
+
+from fastapi import HTTPException
+
+from server import (
+    db, logger, offload_image, offload_images, event_geo_point, parse_appointment_window, MEDIA_URL_PREFIX
+)
+
+
+def is_inline(value):
+    return bool(value) and not value.startswith((MEDIA_URL_PREFIX, "http://", "https://"))
+
+
+async def backfill_media():
+    """Move inline base64 images on products, events and users into the media store"""
+    moved = 0
+
+    async for product in db.products.find({"image": {"$nin": [None, ""]}}, {"_id": 0, "product_id": 1, "image": 1}):
+        if is_inline(product["image"]):
+            await db.products.update_one(
+                {"product_id": product["product_id"]},
+                {"$set": {"image": await offload_image(product["image"])}}
+            )
+            moved += 1
+
+    async for event in db.promoter_events.find({"images.0": {"$exists": True}}, {"_id": 0, "event_id": 1, "images": 1}):
+        if any(is_inline(image) for image in event["images"]):
+            await db.promoter_events.update_one(
+                {"event_id": event["event_id"]},
+                {"$set": {"images": await offload_images(event["images"])}}
+            )
+            moved += 1
+
+    async for user in db.users.find({"picture": {"$nin": [None, ""]}}, {"_id": 0, "user_id": 1, "picture": 1}):
+        if is_inline(user["picture"]):
+            await db.users.update_one(
+                {"user_id": user["user_id"]},
+                {"$set": {"picture": await offload_image(user["picture"])}}
+            )
+            moved += 1
+
+    logger.info(f"Media backfill moved images out of {moved} documents")
+
+
+async def backfill_event_geo():
+    """Derive the GeoJSON `geo` point used by /events/nearby from each event's location"""
+    updated = skipped = 0
+
+    async for event in db.promoter_events.find(
+        {"geo": {"$exists": False}, "location": {"$ne": None}},
+        {"_id": 0, "event_id": 1, "location": 1}
+    ):
+        try:
+            geo = event_geo_point(event["location"])
+        except HTTPException:
+            geo = None
+        if geo is None:
+            skipped += 1
+            continue
+        await db.promoter_events.update_one({"event_id": event["event_id"]}, {"$set": {"geo": geo}})
+        updated += 1
+
+    logger.info(f"Event geo backfill updated {updated} events, skipped {skipped} without usable coordinates")
+
+
+async def backfill_deal_offers():
+    """Move embedded deal offer arrays into the deal_offers collection"""
+    moved = 0
+
+    async for deal in db.deals.find({"offers": {"$exists": True}}, {"_id": 0, "deal_id": 1, "offers": 1, "created_at": 1}):
+        offers = []
+        for index, offer in enumerate(deal["offers"] or []):
+            timestamp = offer.get("timestamp")
+            if isinstance(timestamp, str):
+                timestamp = datetime.fromisoformat(timestamp)
+            offers.append({
+                # Stable ids so a re-run after a partial failure replaces rather than duplicates
+                "offer_id": f"offer_{deal['deal_id']}_{index}",
+                "deal_id": deal["deal_id"],
+                "from": offer.get("from"),
+                "price": offer.get("price"),
+                "type": offer.get("type"),
+                "scheduled_date": offer.get("scheduled_date"),
+                "scheduled_time": offer.get("scheduled_time"),
+                "notes": offer.get("notes"),
+                "timestamp": timestamp or deal.get("created_at") or datetime.now(timezone.utc)
+            })
+
+        if offers:
+            await db.deal_offers.delete_many({"offer_id": {"$in": [o["offer_id"] for o in offers]}})
+            await db.deal_offers.insert_many(offers)
+
+        # Offers sent since the deploy are already in deal_offers, so summarise from there
+        update = {
+            "$unset": {"offers": ""},
+            "$set": {"offer_count": await db.deal_offers.count_documents({"deal_id": deal["deal_id"]})}
+        }
+        latest = await db.deal_offers.find(
+            {"deal_id": deal["deal_id"]},
+            {"_id": 0, "offer_id": 1, "from": 1, "price": 1, "type": 1, "timestamp": 1}
+        ).sort([("timestamp", -1), ("offer_id", -1)]).to_list(1)
+        if latest:
+            update["$set"]["last_offer"] = latest[0]
+        await db.deals.update_one({"deal_id": deal["deal_id"]}, update)
+        moved += len(offers)
+
+    logger.info(f"Deal offer backfill moved {moved} offers")
+
+
+async def backfill_appointment_times():
+    """Derive start/end datetimes from the scheduled_date/scheduled_time strings"""
+    updated = skipped = 0
+
+    async for apt in db.appointments.find(
+        {"start": {"$exists": False}},
+        {"_id": 0, "appointment_id": 1, "scheduled_date": 1, "scheduled_time": 1}
+    ):
+        try:
+            window = parse_appointment_window(apt.get("scheduled_date") or "", apt.get("scheduled_time"), 60)
+        except HTTPException:
+            logger.warning(f"Skipping appointment {apt['appointment_id']}: unparseable schedule")
+            skipped += 1
+            continue
+        await db.appointments.update_one({"appointment_id": apt["appointment_id"]}, {"$set": window})
+        updated += 1
+
+    logger.info(f"Appointment time backfill updated {updated} appointments, skipped {skipped}")
+
+
+async def backfill_order_updated_at():
+    """Give orders written before vendor order sync an updated_at, so `since` cursors can reach them"""
+    result = await db.shop_orders.update_many(
+        {"updated_at": {"$exists": False}},
+        [{"$set": {"updated_at": {"$ifNull": ["$created_at", datetime.now(timezone.utc)]}}}]
+    )
+    logger.info(f"Order updated_at backfill updated {result.modified_count} orders")
+
+
+BACKFILLS = {
+    "media": backfill_media,
+    "event_geo": backfill_event_geo,
+    "deal_offers": backfill_deal_offers,
+    "appointment_times": backfill_appointment_times,
+    "order_updated_at": backfill_order_updated_at,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BACKFILLS)
+    unknown = [n for n in names if n not in BACKFILLS]
+    if unknown:
+        sys.exit(f"Unknown backfill(s): {', '.join(unknown)}. Available: {', '.join(BACKFILLS)}")
+    for name in names:
+        asyncio.run(BACKFILLS[name]())
@@ -0,0 +1,468 @@
+"""
+Deterministic synthetic data for tests, benchmarks and local demos.
+
+Every document is derived from (seed, kind, index), so the same seed and
+base_time always produce the same data, and related documents agree with each
+other without being held in memory: wish 17's room, messages and assigned
+agent can be regenerated on their own. Writes go through batched insert_many.
+
+    python datagen.py --db-name quickwish_dev --scale small --drop
+    python datagen.py --scale full --cities bengaluru,mumbai --seed 7
+
+Like imaging.py, this module imports nothing from server.py, so it can be used
+without a configured database (e.g. from tests with mongomock).
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# name -> (lat, lng, spread in degrees, ~1 sd)
+CITIES = {
+    "bengaluru": (12.9716, 77.5946, 0.07),
+    "mumbai": (19.0760, 72.8777, 0.06),
+    "delhi": (28.6139, 77.2090, 0.09),
+    "hyderabad": (17.3850, 78.4867, 0.07),
+    "chennai": (13.0827, 80.2707, 0.06),
+}
+
+SCALES = {
+    "tiny": {"customers": 20, "agents": 10, "vendors": 5, "orders": 40, "wishes": 30, "rooms": 10, "messages": 60},
+    "small": {"customers": 2000, "agents": 500, "vendors": 100, "orders": 5000, "wishes": 2000, "rooms": 1000, "messages": 20000},
+    "medium": {"customers": 20000, "agents": 2000, "vendors": 500, "orders": 30000, "wishes": 10000, "rooms": 5000, "messages": 200000},
+    "full": {"customers": 50000, "agents": 10000, "vendors": 2000, "orders": 100000, "wishes": 40000, "rooms": 20000, "messages": 1000000},
+}
+
+BATCH_SIZE = 5000
+
+FIRST_NAMES = ["Aarav", "Priya", "Rahul", "Anita", "Vikram", "Sneha", "Arjun", "Kavya", "Rohan", "Meera",
+               "Karan", "Divya", "Aditya", "Pooja", "Sanjay", "Neha", "Imran", "Fatima", "Joseph", "Lakshmi"]
+LAST_NAMES = ["Sharma", "Verma", "Patel", "Reddy", "Iyer", "Nair", "Khan", "Singh", "Gupta", "Das",
+              "Rao", "Menon", "Joshi", "Kulkarni", "Fernandes"]
+
+AGENT_SERVICES = ["delivery", "courier", "rides", "errands"]
+AGENT_SKILLS = ["cleaning", "plumbing", "electrician", "cooking", "carpentry", "painting", "photography"]
+VEHICLES = ["motorbike", "scooter", "car"]
+SHOP_TYPES = ["grocery", "restaurant", "pharmacy", "bakery", "electronics"]
+
+# wish_type -> (title, remuneration range)
+WISH_TYPES = {
+    "delivery": ("Pick up groceries from local market", (60, 200)),
+    "food_delivery": ("Bring dinner from a restaurant", (50, 150)),
+    "medicine_delivery": ("Urgent medicine from pharmacy", (60, 150)),
+    "courier": ("Drop a parcel across town", (80, 300)),
+    "document_delivery": ("Deliver signed documents", (80, 250)),
+    "errands": ("Pay electricity bill at office", (50, 150)),
+    "ride_request": ("Need ride to airport", (300, 900)),
+    "cleaning": ("Deep cleaning for 2BHK apartment", (800, 2500)),
+    "plumbing": ("Fix leaking tap and water heater", (400, 1500)),
+}
+
+# (status, weight); agent-assigned from "picked_up" onwards
+ORDER_STATUSES = [("pending", 5), ("confirmed", 10), ("preparing", 10), ("ready", 10),
+                  ("picked_up", 10), ("on_the_way", 10), ("delivered", 40), ("cancelled", 5)]
+ORDER_ASSIGNED = {"picked_up", "on_the_way", "delivered"}
+ORDER_FLOW = ["pending", "confirmed", "preparing", "ready", "picked_up", "on_the_way", "delivered"]
+
+WISH_STATUSES = [("pending", 40), ("accepted", 25), ("in_progress", 10), ("completed", 20), ("cancelled", 5)]
+WISH_WITH_AGENT = {"accepted", "in_progress", "completed"}
+
+CHAT_LINES = [
+    "Hi! Are you available for this?",
+    "Yes, I can help with this.",
+    "What time works for you?",
+    "Can you come tomorrow at 10 AM?",
+    "Confirmed, see you then.",
+    "I'm on my way.",
+    "Reached the location.",
+    "Thanks, that was quick!",
+]
+
+
+def session_token(user_id: str) -> str:
+    """Session token the generator issues for a user (use as a Bearer token)"""
+    return f"token_{user_id}"
+
+
+def weighted(rng: random.Random, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights=weights)[0]
+
+
+class DataGenerator:
+    """Coherent synthetic documents, each a pure function of (seed, kind, index)"""
+
+    def __init__(self, seed: int = 42, counts: Optional[Dict[str, int]] = None,
+                 cities: Iterable[str] = ("bengaluru",), base_time: Optional[datetime] = None,
+                 prefix: str = "gen", days: int = 30):
+        unknown = [c for c in cities if c not in CITIES]
+        if unknown:
+            raise ValueError(f"Unknown cities: {', '.join(unknown)}")
+        self.seed = seed
+        self.counts = {**SCALES["tiny"], **(counts or {})}
+        self.cities = [CITIES[c] for c in cities]
+        self.base_time = base_time or datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        self.prefix = prefix
+        self.days = days
+
+    # ----- ids -----
+
+    def customer_id(self, i: int) -> str:
+        return f"{self.prefix}_customer_{i}"
+
+    def agent_id(self, i: int) -> str:
+        return f"{self.prefix}_agent_{i}"
+
+    def vendor_id(self, i: int) -> str:
+        return f"{self.prefix}_vendor_{i}"
+
+    def order_id(self, i: int) -> str:
+        return f"{self.prefix}_order_{i}"
+
+    def wish_id(self, i: int) -> str:
+        return f"{self.prefix}_wish_{i}"
+
+    def room_id(self, i: int) -> str:
+        return f"{self.prefix}_room_{i}"
+
+    # ----- helpers -----
+
+    def rng(self, kind: str, i: int) -> random.Random:
+        return random.Random(f"{self.seed}:{kind}:{i}")
+
+    def point(self, rng: random.Random, city=None) -> dict:
+        lat, lng, spread = city or rng.choice(self.cities)
+        return {"lat": round(rng.gauss(lat, spread), 6), "lng": round(rng.gauss(lng, spread), 6)}
+
+    def past(self, rng: random.Random) -> datetime:
+        return self.base_time - timedelta(seconds=rng.randrange(self.days * 86400))
+
+    def name(self, rng: random.Random) -> str:
+        return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+    # ----- users -----
+
+    def customer(self, i: int) -> dict:
+        rng = self.rng("customer", i)
+        home = self.point(rng)
+        return {
+            "user_id": self.customer_id(i),
+            "name": self.name(rng),
+            "phone": f"+9180{i:08d}",
+            "email": f"customer{i}@example.com",
+            "picture": None,
+            "addresses": [{"label": "Home", "address": f"{rng.randrange(1, 300)}, Block {rng.choice('ABCDEF')}", **home}],
+            "partner_type": None,
+            "created_at": self.past(rng),
+        }
+
+    def agent(self, i: int) -> dict:
+        rng = self.rng("agent", i)
+        skilled = rng.random() < 0.2
+        doc = {
+            "user_id": self.agent_id(i),
+            "name": self.name(rng),
+            "phone": f"+9190{i:08d}",
+            "picture": None,
+            "partner_type": "agent",
+            "partner_status": weighted(rng, [("available", 50), ("busy", 20), ("offline", 30)]),
+            "partner_rating": round(rng.uniform(3.8, 5.0), 1),
+            "partner_total_tasks": rng.randrange(0, 500),
+            "agent_type": "skilled" if skilled else "mobile",
+            "agent_services": [] if skilled else rng.sample(AGENT_SERVICES, rng.randint(1, len(AGENT_SERVICES))),
+            "agent_skills": rng.sample(AGENT_SKILLS, rng.randint(1, 3)) if skilled else [],
+            "agent_vehicle": None if skilled else rng.choice(VEHICLES),
+            "agent_rating": round(rng.uniform(3.8, 5.0), 1),
+            "current_location": self.point(rng),
+            "created_at": self.past(rng),
+        }
+        doc["location_updated_at"] = self.base_time - timedelta(seconds=rng.randrange(600))
+        return doc
+
+    def vendor(self, i: int) -> dict:
+        rng = self.rng("vendor", i)
+        shop_type = rng.choice(SHOP_TYPES)
+        return {
+            "user_id": self.vendor_id(i),
+            "name": self.name(rng),
+            "phone": f"+9170{i:08d}",
+            "partner_type": "vendor",
+            "partner_status": "available",
+            "vendor_shop_name": f"{rng.choice(LAST_NAMES)} {shop_type.title()}",
+            "vendor_shop_type": shop_type,
+            "vendor_shop_address": f"Shop {rng.randrange(1, 99)}, Main Road",
+            "vendor_shop_location": self.point(rng),
+            "vendor_can_deliver": rng.random() < 0.3,
+            "vendor_is_verified": rng.random() < 0.8,
+            "created_at": self.past(rng),
+        }
+
+    def user_ids(self) -> Iterator[str]:
+        for i in range(self.counts["customers"]):
+            yield self.customer_id(i)
+        for i in range(self.counts["agents"]):
+            yield self.agent_id(i)
+        for i in range(self.counts["vendors"]):
+            yield self.vendor_id(i)
+
+    def users(self) -> Iterator[dict]:
+        for i in range(self.counts["customers"]):
+            yield self.customer(i)
+        for i in range(self.counts["agents"]):
+            yield self.agent(i)
+        for i in range(self.counts["vendors"]):
+            yield self.vendor(i)
+
+    def sessions(self) -> Iterator[dict]:
+        for user_id in self.user_ids():
+            yield {
+                "user_id": user_id,
+                "session_token": session_token(user_id),
+                "expires_at": self.base_time + timedelta(days=30),
+                "created_at": self.base_time,
+            }
+
+    def partner_locations(self) -> Iterator[dict]:
+        for i in range(self.counts["agents"]):
+            agent = self.agent(i)
+            yield {
+                "user_id": agent["user_id"],
+                "latitude": agent["current_location"]["lat"],
+                "longitude": agent["current_location"]["lng"],
+                "timestamp": agent["location_updated_at"].timestamp(),
+                "is_online": agent["partner_status"] != "offline",
+                "updated_at": agent["location_updated_at"],
+            }
+
+    # ----- orders -----
+
+    def order(self, i: int, status: Optional[str] = None, customer_id: Optional[str] = None) -> dict:
+        rng = self.rng("order", i)
+        vendor_index = rng.randrange(self.counts["vendors"])
+        vendor = self.vendor(vendor_index)
+        customer_index = rng.randrange(self.counts["customers"])
+        address = self.customer(customer_index)["addresses"][0]
+        status = status or weighted(rng, ORDER_STATUSES)
+        created_at = self.past(rng)
+        agent_index = rng.randrange(self.counts["agents"]) if status in ORDER_ASSIGNED else None
+
+        items = [
+            {"name": f"Item {rng.randrange(1, 500)}", "quantity": rng.randint(1, 4), "price": rng.randrange(20, 400)}
+            for _ in range(rng.randint(1, 5))
+        ]
+        steps = ORDER_FLOW[:ORDER_FLOW.index(status) + 1] if status in ORDER_FLOW else ["pending", status]
+        history = [
+            {"status": step, "timestamp": (created_at + timedelta(minutes=5 * n)).isoformat(), "message": f"Order {step}"}
+            for n, step in enumerate(steps)
+        ]
+        return {
+            "order_id": self.order_id(i),
+            "user_id": customer_id or self.customer_id(customer_index),
+            "vendor_id": vendor["user_id"],
+            "vendor_name": vendor["vendor_shop_name"],
+            "vendor_address": vendor["vendor_shop_address"],
+            "items": items,
+            "total_amount": sum(item["price"] * item["quantity"] for item in items),
+            "delivery_address": {"address": address["address"], "lat": address["lat"], "lng": address["lng"]},
+            "delivery_type": "agent_delivery",
+            "delivery_fee": rng.choice([20, 30, 40, 50]),
+            "assigned_agent_id": self.agent_id(agent_index) if agent_index is not None else None,
+            "status": status,
+            "status_history": history,
+            "payment_status": "paid",
+            "created_at": created_at,
+            "updated_at": created_at + timedelta(minutes=5 * (len(steps) - 1)),
+        }
+
+    def orders(self) -> Iterator[dict]:
+        for i in range(self.counts["orders"]):
+            yield self.order(i)
+
+    def earnings(self) -> Iterator[dict]:
+        """One earning per delivered order, credited to its agent"""
+        for i in range(self.counts["orders"]):
+            order = self.order(i)
+            if order["status"] != "delivered":
+                continue
+            yield {
+                "earning_id": f"{self.prefix}_earn_{i}",
+                "partner_id": order["assigned_agent_id"],
+                "order_id": order["order_id"],
+                "amount": order["delivery_fee"],
+                "type": "delivery",
+                "description": f"Delivery from {order['vendor_name']}",
+                "created_at": order["updated_at"],
+            }
+
+    # ----- wishes and chat -----
+
+    def wish(self, i: int, status: Optional[str] = None, user_id: Optional[str] = None) -> dict:
+        rng = self.rng("wish", i)
+        wish_type = rng.choice(list(WISH_TYPES))
+        title, (low, high) = WISH_TYPES[wish_type]
+        status = status or weighted(rng, WISH_STATUSES)
+        agent_index = rng.randrange(self.counts["agents"])
+        customer_index = rng.randrange(self.counts["customers"])
+        return {
+            "wish_id": self.wish_id(i),
+            "user_id": user_id or self.customer_id(customer_index),
+            "wish_type": wish_type,
+            "title": title,
+            "description": f"Description for {title.lower()}",
+            "location": {"address": f"Location {i}", **self.point(rng)},
+            "radius_km": rng.choice([2.0, 5.0, 10.0]),
+            "remuneration": rng.randrange(low, high),
+            "is_immediate": rng.random() < 0.7,
+            "status": status,
+            "accepted_by": self.agent_id(agent_index) if status in WISH_WITH_AGENT else None,
+            "linked_order_id": None,
+            "created_at": self.past(rng),
+        }
+
+    def room_wishes(self) -> Iterator[dict]:
+        """The wishes that have chat rooms: the first `rooms` wishes with an agent"""
+        found = 0
+        for i in range(self.counts["wishes"]):
+            if found >= self.counts["rooms"]:
+                return
+            wish = self.wish(i)
+            if wish["accepted_by"]:
+                yield wish
+                found += 1
+
+    def wishes(self) -> Iterator[dict]:
+        for i in range(self.counts["wishes"]):
+            yield self.wish(i)
+
+    def chat_rooms(self) -> Iterator[dict]:
+        for n, wish in enumerate(self.room_wishes()):
+            yield {
+                "room_id": self.room_id(n),
+                "wish_id": wish["wish_id"],
+                "wisher_id": wish["user_id"],
+                "partner_id": wish["accepted_by"],
+                "wish_title": wish["title"],
+                "status": "active" if wish["status"] != "completed" else "completed",
+                "created_at": wish["created_at"],
+            }
+
+    def messages(self) -> Iterator[dict]:
+        """`messages` spread evenly over the rooms, alternating wisher and partner"""
+        rooms = list(self.chat_rooms())
+        if not rooms:
+            return
+        per_room, extra = divmod(self.counts["messages"], len(rooms))
+        for n, room in enumerate(rooms):
+            rng = self.rng("messages", n)
+            sent_at = room["created_at"]
+            for k in range(per_room + (1 if n < extra else 0)):
+                wisher_turn = k % 2 == 0
+                sent_at += timedelta(seconds=rng.randrange(10, 900))
+                yield {
+                    "message_id": f"{self.prefix}_msg_{n}_{k}",
+                    "room_id": room["room_id"],
+                    "sender_id": room["wisher_id"] if wisher_turn else room["partner_id"],
+                    "sender_type": "wisher" if wisher_turn else "partner",
+                    "content": rng.choice(CHAT_LINES),
+                    "created_at": sent_at,
+                }
+
+    def collections(self) -> Dict[str, Iterator[dict]]:
+        """Every generated collection, as lazy document streams"""
+        return {
+            "users": self.users(),
+            "user_sessions": self.sessions(),
+            "partner_locations": self.partner_locations(),
+            "shop_orders": self.orders(),
+            "earnings": self.earnings(),
+            "wishes": self.wishes(),
+            "chat_rooms": self.chat_rooms(),
+            "messages": self.messages(),
+        }
+
+
+def batched(docs: Iterable[dict], size: int = BATCH_SIZE) -> Iterator[List[dict]]:
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_sync(db, streams: Dict[str, Iterable[dict]], batch_size: int = BATCH_SIZE, log=print) -> Dict[str, int]:
+    """Insert streams into a pymongo (or mongomock) database with batched insert_many"""
+    written = {}
+    for name, docs in streams.items():
+        started = time.perf_counter()
+        written[name] = 0
+        for batch in batched(docs, batch_size):
+            db[name].insert_many(batch, ordered=False)
+            written[name] += len(batch)
+        if log:
+            log(f"  {name}: {written[name]} documents in {time.perf_counter() - started:.1f}s")
+    return written
+
+
+async def write(db, streams: Dict[str, Iterable[dict]], batch_size: int = BATCH_SIZE) -> Dict[str, int]:
+    """Insert streams into a Motor (or mongomock-motor) database with batched insert_many"""
+    written = {}
+    for name, docs in streams.items():
+        written[name] = 0
+        for batch in batched(docs, batch_size):
+            await db[name].insert_many(batch, ordered=False)
+            written[name] += len(batch)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default=os.environ.get("DB_NAME", "quickwish_dev"))
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--cities", default="bengaluru", help=f"Comma-separated, from: {', '.join(CITIES)}")
+    parser.add_argument("--prefix", default="gen", help="Prefix for every generated id")
+    parser.add_argument("--base-time", help="ISO timestamp generated data is relative to (default: this hour)")
+    parser.add_argument("--collections", help="Comma-separated subset of collections to write")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--drop", action="store_true", help="Drop the target collections first")
+    for key in SCALES["tiny"]:
+        parser.add_argument(f"--{key}", type=int, help=f"Override the scale's {key} count")
+    args = parser.parse_args()
+
+    from pymongo import MongoClient
+
+    counts = {**SCALES[args.scale], **{k: getattr(args, k) for k in SCALES["tiny"] if getattr(args, k) is not None}}
+    generator = DataGenerator(
+        seed=args.seed,
+        counts=counts,
+        cities=[c.strip() for c in args.cities.split(",") if c.strip()],
+        base_time=datetime.fromisoformat(args.base_time) if args.base_time else None,
+        prefix=args.prefix,
+    )
+    streams = generator.collections()
+    if args.collections:
+        wanted = [c.strip() for c in args.collections.split(",")]
+        unknown = [c for c in wanted if c not in streams]
+        if unknown:
+            sys.exit(f"Unknown collection(s): {', '.join(unknown)}. Available: {', '.join(streams)}")
+        streams = {name: streams[name] for name in wanted}
+
+    db = MongoClient(args.mongo_url)[args.db_name]
+    if args.drop:
+        for name in streams:
+            db.drop_collection(name)
+    print(f"Generating {args.scale} data into {args.db_name} (seed {args.seed})")
+    write_sync(db, streams, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+In-process spatial index of online partners.
+
+Partners are bucketed into fixed lat/lng grid cells (~1.1km at the default
+0.01°). Coordinates live in parallel array('d') columns addressed by a slot
+number, freed slots are reused, and each cell holds the slots inside it. Radius
+and k-nearest queries only visit cells that can contain a hit, so they take
+microseconds for tens of thousands of partners instead of a Mongo round trip.
+
+The index belongs to one process and is best effort: server.py feeds it from
+location and status updates and rebuilds it periodically from
+partner_locations. Anything chosen from it should be confirmed against Mongo
+before it is acted on.
+"""
+
+import heapq
+import math
+from array import array
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG_LAT = 111.32
+
+# attrs -> whether the partner qualifies
+Predicate = Callable[[dict], bool]
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class PartnerIndex:
+    """Grid-bucketed points with per-partner attributes (status, agent type, ...)"""
+
+    def __init__(self, cell_deg: float = 0.01):
+        self.cell_deg = cell_deg
+        self.lats = array("d")
+        self.lngs = array("d")
+        self.ids: List[Optional[str]] = []
+        self.attrs: List[Optional[dict]] = []
+        self.cells: List[Optional[Tuple[int, int]]] = []
+        self.slots: Dict[str, int] = {}
+        self.free: List[int] = []
+        self.buckets: Dict[Tuple[int, int], List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __contains__(self, partner_id: str) -> bool:
+        return partner_id in self.slots
+
+    def cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    # ----- writes -----
+
+    def upsert(self, partner_id: str, lat: float, lng: float, **attrs):
+        """Add or move a partner; attrs are merged into what is already stored"""
+        cell = self.cell(lat, lng)
+        slot = self.slots.get(partner_id)
+        if slot is None:
+            if self.free:
+                slot = self.free.pop()
+                self.lats[slot], self.lngs[slot] = lat, lng
+                self.ids[slot], self.attrs[slot], self.cells[slot] = partner_id, dict(attrs), cell
+            else:
+                slot = len(self.ids)
+                self.lats.append(lat)
+                self.lngs.append(lng)
+                self.ids.append(partner_id)
+                self.attrs.append(dict(attrs))
+                self.cells.append(cell)
+            self.slots[partner_id] = slot
+            self.buckets.setdefault(cell, []).append(slot)
+            return
+        if self.cells[slot] != cell:
+            self.unbucket(slot)
+            self.cells[slot] = cell
+            self.buckets.setdefault(cell, []).append(slot)
+        self.lats[slot], self.lngs[slot] = lat, lng
+        self.attrs[slot].update(attrs)
+
+    def update(self, partner_id: str, **attrs) -> bool:
+        """Change attributes of an indexed partner; False if it is not indexed"""
+        slot = self.slots.get(partner_id)
+        if slot is None:
+            return False
+        self.attrs[slot].update(attrs)
+        return True
+
+    def remove(self, partner_id: str):
+        slot = self.slots.pop(partner_id, None)
+        if slot is None:
+            return
+        self.unbucket(slot)
+        self.ids[slot] = self.attrs[slot] = self.cells[slot] = None
+        self.free.append(slot)
+
+    def unbucket(self, slot: int):
+        bucket = self.buckets[self.cells[slot]]
+        bucket.remove(slot)
+        if not bucket:
+            del self.buckets[self.cells[slot]]
+
+    def rebuild(self, entries: Iterable[Tuple[str, float, float, dict]], keep: Optional[Predicate] = None):
+        """Replace the contents with entries, keeping current partners whose attrs satisfy keep"""
+        kept = []
+        if keep:
+            kept = [
+                (partner_id, self.lats[slot], self.lngs[slot], self.attrs[slot])
+                for partner_id, slot in self.slots.items() if keep(self.attrs[slot])
+            ]
+        self.__init__(self.cell_deg)
+        for partner_id, lat, lng, attrs in entries:
+            self.upsert(partner_id, lat, lng, **attrs)
+        # Updates that raced the rebuild win over the snapshot it was built from
+        for partner_id, lat, lng, attrs in kept:
+            self.upsert(partner_id, lat, lng, **attrs)
+
+    # ----- reads -----
+
+    def get(self, partner_id: str) -> Optional[dict]:
+        slot = self.slots.get(partner_id)
+        if slot is None:
+            return None
+        return {"lat": self.lats[slot], "lng": self.lngs[slot], **self.attrs[slot]}
+
+    def position(self, partner_id: str) -> Optional[Tuple[float, float]]:
+        slot = self.slots.get(partner_id)
+        if slot is None:
+            return None
+        return self.lats[slot], self.lngs[slot]
+
+    def scan(self, cells: Iterable[Tuple[int, int]], lat: float, lng: float, where: Optional[Predicate]):
+        for cell in cells:
+            for slot in self.buckets.get(cell, ()):
+                if where is None or where(self.attrs[slot]):
+                    yield haversine_km(lat, lng, self.lats[slot], self.lngs[slot]), self.ids[slot]
+
+    def cell_span(self, lat: float, radius_km: float) -> Tuple[int, int]:
+        """How many cells a radius covers north-south and east-west of a point"""
+        dlat = radius_km / KM_PER_DEG_LAT
+        widest = max(math.cos(math.radians(min(abs(lat) + dlat, 89.0))), 0.01)
+        dlng = radius_km / (KM_PER_DEG_LAT * widest)
+        return math.ceil(dlat / self.cell_deg), math.ceil(dlng / self.cell_deg)
+
+    def radius(self, lat: float, lng: float, radius_km: float, where: Optional[Predicate] = None) -> List[Tuple[float, str]]:
+        """(distance_km, partner_id) within radius_km, nearest first"""
+        span_lat, span_lng = self.cell_span(lat, radius_km)
+        center = self.cell(lat, lng)
+        if (2 * span_lat + 1) * (2 * span_lng + 1) > len(self.buckets):
+            # Cheaper to walk the occupied cells than to probe the empty ones
+            cells = [c for c in self.buckets if abs(c[0] - center[0]) <= span_lat and abs(c[1] - center[1]) <= span_lng]
+        else:
+            cells = [
+                (i, j)
+                for i in range(center[0] - span_lat, center[0] + span_lat + 1)
+                for j in range(center[1] - span_lng, center[1] + span_lng + 1)
+            ]
+        return sorted(hit for hit in self.scan(cells, lat, lng, where) if hit[0] <= radius_km)
+
+    def nearest(self, lat: float, lng: float, k: int = 1, max_km: Optional[float] = None,
+                where: Optional[Predicate] = None) -> List[Tuple[float, str]]:
+        """Up to k (distance_km, partner_id), nearest first, searching outward ring by ring"""
+        if not self.slots or k <= 0:
+            return []
+        center = self.cell(lat, lng)
+        # Smallest distance a cell r rings out can be from the query point
+        ring_km = self.cell_deg * KM_PER_DEG_LAT * max(math.cos(math.radians(min(abs(lat) + 1, 89.0))), 0.01)
+        max_ring = math.ceil(max_km / ring_km) + 1 if max_km is not None else None
+        best: List[Tuple[float, str]] = []  # max-heap via negated distance
+        ring = 0
+        while True:
+            if (2 * ring + 1) ** 2 > 4 * len(self.buckets):
+                # The rings now cover more cells than are occupied; finish with a full scan
+                best = []
+                self.offer(best, self.scan(list(self.buckets), lat, lng, where), k, max_km)
+                break
+            if ring == 0:
+                cells = [center]
+            else:
+                top, bottom = center[0] - ring, center[0] + ring
+                cells = [(top, center[1] + j) for j in range(-ring, ring + 1)]
+                cells += [(bottom, center[1] + j) for j in range(-ring, ring + 1)]
+                cells += [(center[0] + i, center[1] - ring) for i in range(-ring + 1, ring)]
+                cells += [(center[0] + i, center[1] + ring) for i in range(-ring + 1, ring)]
+            self.offer(best, self.scan(cells, lat, lng, where), k, max_km)
+            # Every unvisited partner is at least ring * ring_km away
+            if len(best) == k and -best[0][0] <= ring * ring_km:
+                break
+            if max_ring is not None and ring >= max_ring:
+                break
+            ring += 1
+        return sorted((-neg, partner_id) for neg, partner_id in best)
+
+    @staticmethod
+    def offer(best: list, hits, k: int, max_km: Optional[float]):
+        for distance, partner_id in hits:
+            if max_km is not None and distance > max_km:
+                continue
+            if len(best) < k:
+                heapq.heappush(best, (-distance, partner_id))
+            elif distance < -best[0][0]:
+                heapq.heapreplace(best, (-distance, partner_id))
@@ -0,0 +1,88 @@
+"""
+Image decoding and resizing that runs in worker processes.
+
+This module deliberately imports nothing from server.py so spawned workers
+start quickly and never touch the database client.
+"""
+
+import base64
+import binascii
+import hashlib
+from io import BytesIO
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+PIL_CONTENT_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "GIF": "image/gif",
+    "WEBP": "image/webp",
+}
+
+# A few bytes of header can claim billions of pixels; Pillow refuses those up front
+IMAGE_TOO_LARGE = (413, "Image dimensions too large")
+
+
+def decode_upload(value: str, max_bytes: int) -> dict:
+    """Decode a base64 string or data URI and verify it is a supported image.
+
+    Returns {"data", "content_type", "digest"} or {"error": (status_code, detail)}.
+    Errors are returned rather than raised so they pickle cleanly across processes.
+    """
+    if value.startswith("data:"):
+        _, _, value = value.partition(",")
+    try:
+        data = base64.b64decode(value)
+    except (binascii.Error, ValueError):
+        return {"error": (400, "Image must be base64 encoded")}
+    if len(data) > max_bytes:
+        return {"error": (413, f"Image exceeds {max_bytes // (1024 * 1024)} MB")}
+
+    try:
+        with Image.open(BytesIO(data)) as image:
+            image_format = image.format
+            image.verify()
+    except Image.DecompressionBombError:
+        return {"error": IMAGE_TOO_LARGE}
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        return {"error": (400, "Unsupported or corrupt image")}
+
+    content_type = PIL_CONTENT_TYPES.get(image_format)
+    if not content_type:
+        return {"error": (400, "Unsupported image format")}
+
+    return {"data": data, "content_type": content_type, "digest": hashlib.sha256(data).hexdigest()}
+
+
+def render_variant(data: bytes, size: int, image_format: str) -> dict:
+    """Resize an image to fit in a size x size box and encode it as WebP or JPEG.
+
+    Returns {"data"} or {"error": (status_code, detail)}, like decode_upload.
+    """
+    try:
+        return {"data": resize(data, size, image_format)}
+    except Image.DecompressionBombError:
+        return {"error": IMAGE_TOO_LARGE}
+
+
+def resize(data: bytes, size: int, image_format: str) -> bytes:
+    with Image.open(BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image_format == "jpeg":
+            if image.mode in ("RGBA", "LA", "P"):
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                rgba = image.convert("RGBA")
+                background.paste(rgba, mask=rgba.getchannel("A"))
+                image = background
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+
+        image.thumbnail((size, size), Image.LANCZOS)
+        output = BytesIO()
+        if image_format == "webp":
+            image.save(output, "WEBP", quality=80, method=4)
+        else:
+            image.save(output, "JPEG", quality=82, optimize=True, progressive=True)
+        return output.getvalue()
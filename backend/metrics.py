@@ -0,0 +1,252 @@
+"""
+Per-route request and MongoDB instrumentation, exported in Prometheus text format.
+
+MetricsMiddleware times each HTTP request and labels it with the matched route
+template (e.g. /api/orders/{order_id}). CommandListener is registered on the
+Mongo client and attributes every command to the request that issued it through
+a ContextVar; Motor runs pymongo calls in threads with a copy of the caller's
+context, so the listener sees the same RequestStats object as the middleware.
+"""
+
+import contextvars
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger("metrics")
+
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "500"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+RESPONSE_BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Commands issued outside a request (startup, background jobs) are filed under this route
+BACKGROUND_ROUTE = "background"
+
+
+class RequestStats:
+    """Mongo activity for one request; written from Motor's worker threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = 0
+        # (collection, command) -> [count, seconds]
+        self.by_collection: Dict[Tuple[str, str], List[float]] = {}
+        # pymongo request_id -> (collection, command), until the command finishes
+        self.in_flight: Dict[int, Tuple[str, str]] = {}
+
+    def record(self, collection: str, command: str, seconds: float):
+        with self.lock:
+            self.commands += 1
+            entry = self.by_collection.setdefault((collection, command), [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def breakdown(self) -> str:
+        parts = sorted(self.by_collection.items(), key=lambda item: -item[1][1])
+        return ", ".join(
+            f"{collection}.{command} x{int(count)} ({seconds * 1000:.0f}ms)"
+            for (collection, command), (count, seconds) in parts
+        )
+
+
+current_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar(
+    "current_request_stats", default=None
+)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += 1
+        self.sum += value
+
+
+class Registry:
+    """Label-keyed counters and histograms guarded by one lock"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[str, Dict[tuple, float]] = {}
+        self.histograms: Dict[str, Dict[tuple, Histogram]] = {}
+        self.buckets: Dict[str, Tuple[float, ...]] = {}
+        self.help: Dict[str, Tuple[str, str, Tuple[str, ...]]] = {}
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...]):
+        self.help[name] = ("counter", help_text, labels)
+        self.counters[name] = {}
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...], buckets: Tuple[float, ...]):
+        self.help[name] = ("histogram", help_text, labels)
+        self.histograms[name] = {}
+        self.buckets[name] = buckets
+
+    def inc(self, name: str, labels: tuple, amount: float = 1):
+        with self.lock:
+            series = self.counters[name]
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name: str, labels: tuple, value: float):
+        with self.lock:
+            series = self.histograms[name]
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram(self.buckets[name])
+            histogram.observe(value)
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name, (kind, help_text, label_names) in self.help.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for labels, value in self.counters[name].items():
+                        lines.append(f"{name}{format_labels(label_names, labels)} {format_value(value)}")
+                    continue
+                for labels, histogram in self.histograms[name].items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        le = format_labels(label_names + ("le",), labels + (format_value(bound),))
+                        lines.append(f"{name}_bucket{le} {cumulative}")
+                    le = format_labels(label_names + ("le",), labels + ("+Inf",))
+                    lines.append(f"{name}_bucket{le} {histogram.total}")
+                    lines.append(f"{name}_sum{format_labels(label_names, labels)} {format_value(histogram.sum)}")
+                    lines.append(f"{name}_count{format_labels(label_names, labels)} {histogram.total}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(names: Tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        for value in values
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+registry = Registry()
+registry.counter("http_requests_total", "HTTP requests by route and status code", ("method", "route", "status"))
+registry.histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"), LATENCY_BUCKETS)
+registry.histogram("http_response_size_bytes", "HTTP response body size", ("method", "route"), RESPONSE_BYTES_BUCKETS)
+registry.histogram("http_request_mongo_commands", "MongoDB commands issued per request", ("method", "route"), QUERY_COUNT_BUCKETS)
+registry.counter("mongo_commands_total", "MongoDB commands by route, collection and command", ("route", "collection", "command"))
+registry.counter("mongo_command_seconds_total", "Time spent in MongoDB commands", ("route", "collection", "command"))
+registry.counter("mongo_command_failures_total", "Failed MongoDB commands", ("collection", "command"))
+
+
+class CommandListener(monitoring.CommandListener):
+    """Attributes Mongo commands to the current request (pass via event_listeners=)"""
+
+    def __init__(self):
+        # Commands issued outside any request: request_id -> (collection, command)
+        self.background = RequestStats()
+
+    def stats(self) -> RequestStats:
+        return current_request_stats.get() or self.background
+
+    def started(self, event):
+        value = event.command.get(event.command_name)
+        # getMore carries the cursor id under its own name and the collection separately
+        collection = value if isinstance(value, str) else event.command.get("collection", "")
+        stats = self.stats()
+        with stats.lock:
+            stats.in_flight[event.request_id] = (collection, event.command_name)
+
+    def finish(self, event) -> Tuple[str, str]:
+        stats = self.stats()
+        with stats.lock:
+            collection, command = stats.in_flight.pop(event.request_id, ("", event.command_name))
+        seconds = event.duration_micros / 1e6
+        if stats is self.background:
+            registry.inc("mongo_commands_total", (BACKGROUND_ROUTE, collection, command))
+            registry.inc("mongo_command_seconds_total", (BACKGROUND_ROUTE, collection, command), seconds)
+        else:
+            stats.record(collection, command, seconds)
+        return collection, command
+
+    def succeeded(self, event):
+        self.finish(event)
+
+    def failed(self, event):
+        registry.inc("mongo_command_failures_total", self.finish(event))
+
+
+command_listener = CommandListener()
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware (no BaseHTTPMiddleware, so streaming and websockets are untouched)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        status = 500
+        body_bytes = 0
+
+        async def send_wrapper(message):
+            nonlocal status, body_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                body_bytes += len(message.get("body", b""))
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request_stats.reset(token)
+            self.record(scope, status, elapsed, body_bytes, stats)
+
+    def record(self, scope, status: int, elapsed: float, body_bytes: int, stats: RequestStats):
+        route = scope.get("route")
+        # Unmatched paths share one label so random URLs cannot blow up cardinality
+        template = getattr(route, "path", None) or "unmatched"
+        method = scope["method"]
+
+        registry.inc("http_requests_total", (method, template, str(status)))
+        registry.observe("http_request_duration_seconds", (method, template), elapsed)
+        registry.observe("http_response_size_bytes", (method, template), body_bytes)
+        registry.observe("http_request_mongo_commands", (method, template), stats.commands)
+        for (collection, command), (count, seconds) in stats.by_collection.items():
+            registry.inc("mongo_commands_total", (template, collection, command), count)
+            registry.inc("mongo_command_seconds_total", (template, collection, command), seconds)
+
+        if elapsed * 1000 >= SLOW_REQUEST_MS:
+            logger.warning(
+                f"Slow request {method} {template} -> {status} in {elapsed * 1000:.0f}ms, "
+                f"{stats.commands} mongo commands: {stats.breakdown() or 'none'}"
+            )
+
+
+def render_metrics() -> str:
+    return registry.render()
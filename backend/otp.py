@@ -0,0 +1,236 @@
+"""
+One-time passcodes and the rate limits around them.
+
+Codes are stored salted and hashed, expire on their own and allow a fixed
+number of guesses. Sending and verifying are throttled with token buckets
+(per phone and per client IP). The state lives in a store shared by all
+workers:
+
+- MongoOTPStore: TTL collections; every check is a single atomic update
+- RedisOTPStore: any redis.asyncio compatible client (hashes + a Lua bucket)
+- MemoryOTPStore: the same semantics in one process, for local runs and tests
+
+Like trail.py, nothing here imports server.py.
+"""
+
+import hashlib
+import hmac
+import math
+import secrets
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from pymongo import ReturnDocument
+
+CODE_LENGTH = 6
+
+
+def now() -> float:
+    """Current time for codes and buckets (one place to move the clock in tests)"""
+    return time.time()
+
+
+def utcnow() -> datetime:
+    return datetime.fromtimestamp(now(), timezone.utc)
+
+
+def generate_code() -> str:
+    return "".join(secrets.choice("0123456789") for _ in range(CODE_LENGTH))
+
+
+def hash_code(code: str, salt: str) -> str:
+    return hmac.new(salt.encode(), code.encode(), hashlib.sha256).hexdigest()
+
+
+def new_record(code: str) -> dict:
+    salt = secrets.token_hex(16)
+    return {"salt": salt, "code_hash": hash_code(code, salt), "attempts": 0}
+
+
+def code_matches(record: dict, code: str) -> bool:
+    return hmac.compare_digest(hash_code(code, record["salt"]), record["code_hash"])
+
+
+def refill_seconds(capacity: int, per_second: float) -> float:
+    """How long an empty bucket takes to fill; idle buckets can be dropped after that"""
+    return capacity / per_second
+
+
+def retry_after(tokens: float, per_second: float) -> int:
+    return max(1, math.ceil((1 - tokens) / per_second))
+
+
+class MongoOTPStore:
+    """Codes in otp_codes, buckets in rate_limits; both expire through TTL indexes on expire_at"""
+
+    def __init__(self, db):
+        self.codes = db.otp_codes
+        self.limits = db.rate_limits
+
+    async def save(self, phone: str, record: dict, ttl: float):
+        current = utcnow()
+        await self.codes.replace_one(
+            {"phone": phone},
+            {"phone": phone, **record, "created_at": current, "expire_at": current + timedelta(seconds=ttl)},
+            upsert=True
+        )
+
+    async def claim_attempt(self, phone: str, max_attempts: int) -> Tuple[Optional[dict], str]:
+        """Count a guess against the live code: (record, "ok") or (None, "missing" | "exhausted")"""
+        current = utcnow()
+        record = await self.codes.find_one_and_update(
+            {"phone": phone, "expire_at": {"$gt": current}, "attempts": {"$lt": max_attempts}},
+            {"$inc": {"attempts": 1}},
+            projection={"_id": 0, "salt": 1, "code_hash": 1}
+        )
+        if record:
+            return record, "ok"
+        # The TTL monitor only runs once a minute, so expired codes can still be there
+        live = await self.codes.find_one({"phone": phone, "expire_at": {"$gt": current}}, {"_id": 1})
+        return None, "exhausted" if live else "missing"
+
+    async def consume(self, phone: str, record: dict) -> bool:
+        """Delete the code a guess matched; False if a concurrent request already used it"""
+        result = await self.codes.delete_one({"phone": phone, "code_hash": record["code_hash"]})
+        return result.deleted_count == 1
+
+    async def take(self, key: str, capacity: int, per_second: float) -> Tuple[bool, int]:
+        """Take a token from the bucket: (allowed, seconds until the next token)"""
+        current = utcnow()
+        refilled = {"$min": [capacity, {"$add": [
+            {"$ifNull": ["$tokens", capacity]},
+            {"$multiply": [{"$subtract": [current, {"$ifNull": ["$at", current]}]}, per_second / 1000]}
+        ]}]}
+        bucket = await self.limits.find_one_and_update(
+            {"key": key},
+            [
+                {"$set": {"tokens": refilled, "at": current}},
+                {"$set": {
+                    "allowed": {"$gte": ["$tokens", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    "expire_at": current + timedelta(seconds=refill_seconds(capacity, per_second))
+                }}
+            ],
+            projection={"_id": 0, "allowed": 1, "tokens": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return bucket["allowed"], 0 if bucket["allowed"] else retry_after(bucket["tokens"], per_second)
+
+
+# KEYS[1] bucket; ARGV capacity, tokens per ms, now (ms), ttl (ms) -> {allowed, ms until next token}
+TAKE_SCRIPT = """
+local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(bucket[1]) or capacity
+local at = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - at) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+return {allowed, math.ceil((1 - tokens) / rate)}
+"""
+
+
+class RedisOTPStore:
+    """Codes as hashes under otp:code:<phone>, buckets under otp:bucket:<key>"""
+
+    def __init__(self, client, prefix: str = "otp:"):
+        self.client = client
+        self.prefix = prefix
+        self.take_script = client.register_script(TAKE_SCRIPT)
+
+    def code_key(self, phone: str) -> str:
+        return f"{self.prefix}code:{phone}"
+
+    async def save(self, phone: str, record: dict, ttl: float):
+        key = self.code_key(phone)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping=record)
+            pipe.pexpire(key, int(ttl * 1000))
+            await pipe.execute()
+
+    async def claim_attempt(self, phone: str, max_attempts: int) -> Tuple[Optional[dict], str]:
+        key = self.code_key(phone)
+        # HINCRBY on a missing key would create it without an expiry, so check first
+        if not await self.client.exists(key):
+            return None, "missing"
+        attempts = await self.client.hincrby(key, "attempts", 1)
+        if attempts > max_attempts:
+            return None, "exhausted"
+        record = await self.client.hgetall(key)
+        if "code_hash" not in record and b"code_hash" not in record:
+            # Expired between the calls; drop what HINCRBY recreated
+            await self.client.delete(key)
+            return None, "missing"
+        return {k.decode() if isinstance(k, bytes) else k: v.decode() if isinstance(v, bytes) else v
+                for k, v in record.items()}, "ok"
+
+    async def consume(self, phone: str, record: dict) -> bool:
+        return await self.client.delete(self.code_key(phone)) == 1
+
+    async def take(self, key: str, capacity: int, per_second: float) -> Tuple[bool, int]:
+        ttl_ms = int(refill_seconds(capacity, per_second) * 1000)
+        allowed, wait_ms = await self.take_script(
+            keys=[f"{self.prefix}bucket:{key}"],
+            args=[capacity, per_second / 1000, int(now() * 1000), ttl_ms]
+        )
+        return bool(allowed), 0 if allowed else max(1, math.ceil(int(wait_ms) / 1000))
+
+
+class MemoryOTPStore:
+    """Single-process stand-in with the same semantics; expired entries are swept as it writes"""
+
+    SWEEP_EVERY = 1000
+
+    def __init__(self):
+        self.codes = {}  # phone -> (expires, record)
+        self.buckets = {}  # key -> (expires, tokens, at)
+        self.writes = 0
+
+    def sweep(self, current: float):
+        self.writes += 1
+        if self.writes % self.SWEEP_EVERY:
+            return
+        for store in (self.codes, self.buckets):
+            for key in [key for key, entry in store.items() if entry[0] <= current]:
+                del store[key]
+
+    async def save(self, phone: str, record: dict, ttl: float):
+        current = now()
+        self.sweep(current)
+        self.codes[phone] = (current + ttl, dict(record))
+
+    async def claim_attempt(self, phone: str, max_attempts: int) -> Tuple[Optional[dict], str]:
+        entry = self.codes.get(phone)
+        if not entry or entry[0] <= now():
+            return None, "missing"
+        record = entry[1]
+        if record["attempts"] >= max_attempts:
+            return None, "exhausted"
+        record["attempts"] += 1
+        return dict(record), "ok"
+
+    async def consume(self, phone: str, record: dict) -> bool:
+        entry = self.codes.get(phone)
+        if not entry or entry[1]["code_hash"] != record["code_hash"]:
+            return False
+        del self.codes[phone]
+        return True
+
+    async def take(self, key: str, capacity: int, per_second: float) -> Tuple[bool, int]:
+        current = now()
+        self.sweep(current)
+        _, tokens, at = self.buckets.get(key, (None, capacity, current))
+        tokens = min(capacity, tokens + (current - at) * per_second)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[key] = (current + refill_seconds(capacity, per_second), tokens, current)
+        return allowed, 0 if allowed else retry_after(tokens, per_second)
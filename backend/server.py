@@ -1,28 +1,55 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, Cookie, WebSocket, WebSocketDisconnect
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from gridfs.errors import NoFile
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Dict, Any
+from collections import OrderedDict
 import uuid
 from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
 import httpx
 import json
 import asyncio
+import hashlib
+import time
+import csv
+import codecs
+import math
+import random
+import base64
+import re
+import ipaddress
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import datagen
+import geoindex
+import imaging
+import metrics
+import otp
+import trail
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# The listener attributes every Mongo command to the request that issued it (see metrics.py)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[metrics.command_listener])
 db = client[os.environ['DB_NAME']]
 
-# Create the main app
-app = FastAPI()
+# Create the main app. ORJSONResponse encodes datetimes natively; list endpoints on hot
+# paths return it directly, which also skips FastAPI's jsonable_encoder pass.
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -66,6 +93,7 @@ class User(BaseModel):
     agent_has_vehicle: bool = False  # for skilled genies who have vehicle for commuting
     agent_rating: float = 5.0  # agent rating
     agent_total_deliveries: int = 0  # total deliveries completed
+    current_location: Optional[dict] = None  # {lat, lng}, last reported via PUT /partner/location
     
     # Vendor-specific fields
     vendor_shop_name: Optional[str] = None
@@ -173,7 +201,7 @@ class Product(BaseModel):
     description: Optional[str] = None
     price: float
     category: str
-    image: Optional[str] = None  # base64
+    image: Optional[str] = None  # media URL (uploaded as base64)
     in_stock: bool = True
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -189,7 +217,7 @@ class PromoterEvent(BaseModel):
     price: float
     total_slots: int
     booked_slots: int = 0
-    images: List[str] = []  # base64 images
+    images: List[str] = []  # media URLs (uploaded as base64)
     status: str = "active"  # active, completed, cancelled
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -206,7 +234,10 @@ async def get_current_user(request: Request, session_token: Optional[str] = Cook
     
     if not token:
         return None
-    
+    return await user_from_session_token(token)
+
+async def user_from_session_token(token: str) -> Optional[User]:
+    """Resolve a live session token to its user (also used by websockets)"""
     session = await db.user_sessions.find_one({"session_token": token}, {"_id": 0})
     if not session:
         return None
@@ -258,10 +289,170 @@ async def require_promoter(request: Request, session_token: Optional[str] = Cook
         raise HTTPException(status_code=403, detail="Promoter access required")
     return user
 
+# ===================== IN-PROCESS CACHES =====================
+
+class LocalCache:
+    """Small in-process LRU cache with optional per-entry TTL (seconds)"""
+    
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (expires_at or None, value)
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+    
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+    
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def invalidate(self, key):
+        self._data.pop(key, None)
+    
+    def clear(self):
+        self._data.clear()
+
+# user_id -> the public profile fields lists and rooms are decorated with.
+# Short TTL: ratings move on their own, profile edits invalidate explicitly.
+USER_PROFILE_PROJECTION = {"_id": 0, "user_id": 1, "name": 1, "picture": 1, "phone": 1, "partner_rating": 1}
+user_profile_cache = LocalCache(maxsize=20000, ttl=30)
+
+async def get_user_profiles(user_ids: List[str]) -> Dict[str, dict]:
+    """Resolve user profiles from the cache, fetching any misses in one query"""
+    profiles = {}
+    missing = []
+    for user_id in set(filter(None, user_ids)):
+        profile = user_profile_cache.get(user_id)
+        if profile is None:
+            missing.append(user_id)
+        elif profile:
+            profiles[user_id] = profile
+    if missing:
+        users = await db.users.find(
+            {"user_id": {"$in": missing}},
+            USER_PROFILE_PROJECTION
+        ).to_list(len(missing))
+        for user in users:
+            profiles[user["user_id"]] = user
+            user_profile_cache.set(user["user_id"], user)
+        # Remember unknown ids too, so a dangling reference is not re-queried every poll
+        for user_id in set(missing) - profiles.keys():
+            user_profile_cache.set(user_id, {})
+    return profiles
+
+async def get_user_profile(user_id: Optional[str]) -> Optional[dict]:
+    return (await get_user_profiles([user_id])).get(user_id)
+
+def payload_digest(payload) -> str:
+    """Stable content hash of a JSON-serializable payload (used for ETags)"""
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Check an If-None-Match header against an ETag"""
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [c.strip() for c in header.split(",")]
+    # If-None-Match uses weak comparison, so ignore any W/ prefix
+    return any(c[2:] == etag if c.startswith("W/") else c == etag for c in candidates)
+
+def set_pagination_headers(response: Response, total: int, page: int, limit: int):
+    """Expose paging metadata as headers so list bodies stay unchanged"""
+    response.headers["X-Total-Count"] = str(total)
+    response.headers["X-Page"] = str(page)
+    response.headers["X-Page-Size"] = str(limit)
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in km"""
+    R = 6371  # Earth's radius in km
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
+    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
 # ===================== AUTH ENDPOINTS =====================
 
-# In-memory OTP storage (for demo purposes)
-otp_storage = {}
+OTP_TTL_SECONDS = int(os.environ.get("OTP_TTL_SECONDS", "300"))
+OTP_MAX_ATTEMPTS = int(os.environ.get("OTP_MAX_ATTEMPTS", "5"))
+# Fixed code for demos and tests; set OTP_MOCK_CODE= (empty) to issue random codes
+OTP_MOCK_CODE = os.environ.get("OTP_MOCK_CODE", "123456")
+# Token buckets as (burst, tokens per second)
+OTP_SEND_PHONE_LIMIT = (3, 1 / 60)
+OTP_SEND_IP_LIMIT = (10, 1 / 30)
+OTP_VERIFY_IP_LIMIT = (30, 1 / 5)
+
+def make_otp_store():
+    """OTP_STORE selects the backend: mongo (default), redis (REDIS_URL) or memory (single process)"""
+    kind = os.environ.get("OTP_STORE", "mongo")
+    if kind == "redis":
+        import redis.asyncio
+        return otp.RedisOTPStore(redis.asyncio.from_url(os.environ["REDIS_URL"]))
+    if kind == "memory":
+        return otp.MemoryOTPStore()
+    return otp.MongoOTPStore(db)
+
+otp_store = make_otp_store()
+
+# Proxies (IPs or CIDRs, comma separated) whose X-Forwarded-For is believed
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(value.strip(), strict=False)
+    for value in os.environ.get("TRUSTED_PROXIES", "").split(",") if value.strip()
+]
+DEFAULT_PHONE_COUNTRY_CODE = os.environ.get("DEFAULT_PHONE_COUNTRY_CODE", "91")
+
+def is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+def client_ip(request: Request) -> str:
+    """The caller's address, looking through X-Forwarded-For only as far as trusted proxies go"""
+    host = request.client.host if request.client else "unknown"
+    if not is_trusted_proxy(host):
+        # Anyone can send the header; only a proxy we run gets to vouch for it
+        return host
+    # Each proxy appends the address it saw, so walk back from the right
+    for hop in reversed(request.headers.get("x-forwarded-for", "").split(",")):
+        hop = hop.strip()
+        if not hop:
+            continue
+        host = hop
+        if not is_trusted_proxy(hop):
+            break
+    return host
+
+def normalize_phone(phone: str) -> str:
+    """One spelling per number (+<country><number>) so formatting does not dodge rate limits"""
+    digits = re.sub(r"\D", "", phone)
+    if phone.strip().startswith("00"):
+        digits = digits[2:]
+    elif not phone.strip().startswith("+"):
+        digits = digits.lstrip("0")
+        if len(digits) == 10:
+            digits = DEFAULT_PHONE_COUNTRY_CODE + digits
+    return f"+{digits}"
+
+async def enforce_rate_limit(key: str, limit: tuple, detail: str):
+    allowed, wait = await otp_store.take(key, *limit)
+    if not allowed:
+        raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(wait)})
 
 class SendOTPRequest(BaseModel):
     phone: str
@@ -271,43 +462,44 @@ class VerifyOTPRequest(BaseModel):
     otp: str
 
 @api_router.post("/auth/send-otp")
-async def send_otp(data: SendOTPRequest):
-    """Send OTP to phone number (mock implementation)"""
+async def send_otp(data: SendOTPRequest, request: Request):
+    """Send OTP to phone number (SMS delivery is mocked)"""
     phone = data.phone.strip()
     if len(phone) < 10:
         raise HTTPException(status_code=400, detail="Invalid phone number")
     
-    # Mock OTP - always 123456 for testing
-    otp = "123456"
-    otp_storage[phone] = {
-        "otp": otp,
-        "expires_at": datetime.now(timezone.utc) + timedelta(minutes=5)
-    }
+    await enforce_rate_limit(f"send:ip:{client_ip(request)}", OTP_SEND_IP_LIMIT, "Too many OTP requests, please try again later")
+    await enforce_rate_limit(f"send:phone:{normalize_phone(phone)}", OTP_SEND_PHONE_LIMIT, "Too many OTP requests for this number, please try again later")
     
-    logger.info(f"OTP for {phone}: {otp}")
-    return {"message": "OTP sent successfully", "debug_otp": otp}  # Remove debug_otp in production
+    code = OTP_MOCK_CODE or otp.generate_code()
+    await otp_store.save(phone, otp.new_record(code), OTP_TTL_SECONDS)
+    
+    if OTP_MOCK_CODE:
+        logger.info(f"OTP for {phone}: {code}")
+        return {"message": "OTP sent successfully", "debug_otp": code}
+    return {"message": "OTP sent successfully"}
 
 @api_router.post("/auth/verify-otp")
-async def verify_otp(data: VerifyOTPRequest, response: Response):
+async def verify_otp(data: VerifyOTPRequest, request: Request, response: Response):
     """Verify OTP and create session"""
     phone = data.phone.strip()
-    otp = data.otp.strip()
+    code = data.otp.strip()
+    
+    await enforce_rate_limit(f"verify:ip:{client_ip(request)}", OTP_VERIFY_IP_LIMIT, "Too many attempts, please try again later")
     
-    # Check stored OTP
-    stored = otp_storage.get(phone)
+    # Every guess counts against the code, right or wrong
+    stored, state = await otp_store.claim_attempt(phone, OTP_MAX_ATTEMPTS)
+    if state == "exhausted":
+        raise HTTPException(status_code=429, detail="Too many incorrect attempts. Please request a new OTP.")
     if not stored:
         raise HTTPException(status_code=400, detail="OTP expired or not found. Please request a new OTP.")
     
-    if stored["expires_at"] < datetime.now(timezone.utc):
-        del otp_storage[phone]
-        raise HTTPException(status_code=400, detail="OTP expired. Please request a new OTP.")
-    
-    # Mock OTP verification - accept "123456" always
-    if otp != "123456" and otp != stored["otp"]:
+    if not otp.code_matches(stored, code):
         raise HTTPException(status_code=400, detail="Invalid OTP")
     
-    # Clear used OTP
-    del otp_storage[phone]
+    # Single use: a concurrent request with the same code loses here
+    if not await otp_store.consume(phone, stored):
+        raise HTTPException(status_code=400, detail="OTP expired or not found. Please request a new OTP.")
     
     # Check if user exists
     existing_user = await db.users.find_one({"phone": phone}, {"_id": 0})
@@ -411,7 +603,7 @@ async def create_session(request: Request, response: Response):
             "user_id": user_id,
             "email": session_data.email,
             "name": session_data.name,
-            "picture": session_data.picture,
+            "picture": await offload_image(session_data.picture),
             "phone": None,
             "date_of_birth": None,
             "address": None,
@@ -488,6 +680,7 @@ async def update_profile(data: ProfileUpdate, current_user: User = Depends(requi
             {"user_id": current_user.user_id},
             {"$set": update_fields}
         )
+        user_profile_cache.invalidate(current_user.user_id)
     
     user_doc = await db.users.find_one({"user_id": current_user.user_id}, {"_id": 0})
     return {"user": user_doc}
@@ -569,6 +762,7 @@ async def register_as_agent(data: AgentRegistration, current_user: User = Depend
         {"user_id": current_user.user_id},
         {"$set": update_data}
     )
+    user_profile_cache.invalidate(current_user.user_id)
     
     updated_user = await db.users.find_one({"user_id": current_user.user_id}, {"_id": 0})
     return {"message": "Registered as agent successfully", "user": updated_user}
@@ -593,6 +787,7 @@ async def register_as_vendor(data: VendorRegistration, current_user: User = Depe
             "vendor_categories": data.categories,
         }}
     )
+    user_profile_cache.invalidate(current_user.user_id)
     
     updated_user = await db.users.find_one({"user_id": current_user.user_id}, {"_id": 0})
     return {"message": "Registered as vendor successfully", "user": updated_user}
@@ -614,10 +809,300 @@ async def register_as_promoter(data: PromoterRegistration, current_user: User =
             "promoter_description": data.description,
         }}
     )
+    user_profile_cache.invalidate(current_user.user_id)
     
     updated_user = await db.users.find_one({"user_id": current_user.user_id}, {"_id": 0})
     return {"message": "Registered as promoter successfully", "user": updated_user}
 
+# ===================== PARTNER SPATIAL INDEX =====================
+
+# Online agents by location, kept in memory for matching and proximity queries.
+# Fed by location/status updates and rebuilt from partner_locations periodically,
+# which also drops partners that stopped reporting and picks up updates that
+# reached other worker processes.
+partner_index = geoindex.PartnerIndex()
+PARTNER_INDEX_RECONCILE_INTERVAL = 60  # seconds
+PARTNER_LOCATION_STALE = timedelta(minutes=10)
+GENIE_MATCH_RADIUS_KM = 15
+PARTNER_INDEX_USER_PROJECTION = {"_id": 0, "user_id": 1, "partner_type": 1, "partner_status": 1, "agent_type": 1, "agent_services": 1}
+
+def partner_index_attrs(user: dict) -> dict:
+    return {
+        "status": user.get("partner_status") or "offline",
+        "agent_type": user.get("agent_type"),
+        "services": tuple(user.get("agent_services") or ()),
+        "seen": time.monotonic(),
+    }
+
+def index_partner_location(user: User, lat: float, lng: float, is_online: bool):
+    if user.partner_type != "agent" or not is_online or user.partner_status == "offline":
+        partner_index.remove(user.user_id)
+        return
+    partner_index.upsert(user.user_id, lat, lng, **partner_index_attrs({
+        "partner_status": user.partner_status,
+        "agent_type": user.agent_type,
+        "agent_services": user.agent_services,
+    }))
+
+def index_partner_status(user_id: str, status: str):
+    if status == "offline":
+        partner_index.remove(user_id)
+    else:
+        partner_index.update(user_id, status=status, seen=time.monotonic())
+
+async def reconcile_partner_index():
+    """Rebuild the index from recent online locations in partner_locations"""
+    started = time.monotonic()
+    cutoff = datetime.now(timezone.utc) - PARTNER_LOCATION_STALE
+    locations = await db.partner_locations.find(
+        {"is_online": True, "updated_at": {"$gte": cutoff}},
+        {"_id": 0, "user_id": 1, "latitude": 1, "longitude": 1}
+    ).to_list(None)
+    user_ids = [location["user_id"] for location in locations]
+    users = await db.users.find(
+        {"user_id": {"$in": user_ids}, "partner_type": "agent", "partner_status": {"$ne": "offline"}},
+        PARTNER_INDEX_USER_PROJECTION
+    ).to_list(None)
+    attrs = {user["user_id"]: partner_index_attrs(user) for user in users}
+    partner_index.rebuild(
+        (
+            (location["user_id"], location["latitude"], location["longitude"], attrs[location["user_id"]])
+            for location in locations if location["user_id"] in attrs
+        ),
+        keep=lambda a: a["seen"] >= started
+    )
+
+def location_coords(location: Optional[dict]) -> Optional[tuple]:
+    """(lat, lng) from a {lat, lng} or {latitude, longitude} dict"""
+    if not location:
+        return None
+    lat = location.get("lat", location.get("latitude"))
+    lng = location.get("lng", location.get("longitude"))
+    if lat is None or lng is None:
+        return None
+    return float(lat), float(lng)
+
+def is_available_mobile_genie(attrs: dict) -> bool:
+    return attrs["status"] == "available" and attrs["agent_type"] == "mobile"
+
+async def find_genie_for_wish(wish: dict, exclude: Optional[str] = None) -> Optional[dict]:
+    """Nearest available mobile genie to the wish, or any available one if none is indexed nearby"""
+    coords = location_coords(wish.get("pickup_location")) or location_coords(wish.get("dropoff_location"))
+    if coords:
+        nearest = partner_index.nearest(*coords, k=5, max_km=GENIE_MATCH_RADIUS_KM, where=is_available_mobile_genie)
+        candidate_ids = [partner_id for _, partner_id in nearest if partner_id != exclude]
+        if candidate_ids:
+            # The index can lag by a status update, so confirm against the database
+            genies = await db.users.find({
+                "user_id": {"$in": candidate_ids},
+                "partner_status": "available"
+            }).to_list(len(candidate_ids))
+            by_id = {genie["user_id"]: genie for genie in genies}
+            for partner_id in candidate_ids:
+                if partner_id in by_id:
+                    return by_id[partner_id]
+    
+    query = {
+        "partner_type": "agent",
+        "agent_type": "mobile",
+        "partner_status": "available"
+    }
+    if exclude:
+        query["user_id"] = {"$ne": exclude}
+    return await db.users.find_one(query)
+
+@api_router.get("/partners/nearby")
+async def get_nearby_partners(
+    lat: float,
+    lng: float,
+    radius_km: float = 5,
+    limit: int = 20,
+    service: Optional[str] = None,
+    current_user: User = Depends(require_auth)
+):
+    """Available agents near a point, nearest first (for dispatch and maps)"""
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    radius_km = min(max(radius_km, 0.1), GENIE_MATCH_RADIUS_KM)
+    limit = min(max(limit, 1), 100)
+    
+    def qualifies(attrs):
+        return attrs["status"] == "available" and (service is None or service in attrs["services"])
+    
+    nearest = partner_index.nearest(lat, lng, k=limit, max_km=radius_km, where=qualifies)
+    profiles = await get_user_profiles([partner_id for _, partner_id in nearest])
+    partners = []
+    for distance_km, partner_id in nearest:
+        entry = partner_index.get(partner_id)
+        profile = profiles.get(partner_id) or {}
+        partners.append({
+            "user_id": partner_id,
+            "name": profile.get("name"),
+            "picture": profile.get("picture"),
+            "rating": profile.get("partner_rating"),
+            "agent_type": entry["agent_type"] if entry else None,
+            "lat": entry["lat"] if entry else None,
+            "lng": entry["lng"] if entry else None,
+            "distance_km": round(distance_km, 2),
+        })
+    return partners
+
+# ===================== LOCATION TRAILS =====================
+
+# Route history per partner. Pings are buffered in process and flushed as a
+# simplified, packed chunk (see trail.py) onto one bucket document per partner
+# and hour: {partner_id, bucket, chunks: [bytes], points, raw_points, start, end, expire_at}
+TRAIL_FLUSH_POINTS = 120
+TRAIL_FLUSH_SECONDS = 60
+TRAIL_SIMPLIFY_METERS = float(os.environ.get("TRAIL_SIMPLIFY_METERS", "8"))
+TRAIL_RETENTION = timedelta(days=int(os.environ.get("TRAIL_RETENTION_DAYS", "90")))
+TRAIL_MAX_RANGE = timedelta(days=2)
+
+# partner_id -> (monotonic time of the first buffered ping, [(unix seconds, lat, lng)])
+trail_buffers: Dict[str, tuple] = {}
+
+def trail_bucket(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp - timestamp % 3600, tz=timezone.utc)
+
+def record_trail_point(partner_id: str, lat: float, lng: float, at: datetime) -> bool:
+    """Buffer a ping; True when the partner's buffer is due to be flushed"""
+    started, points = trail_buffers.setdefault(partner_id, (time.monotonic(), []))
+    points.append((at.timestamp(), lat, lng))
+    return len(points) >= TRAIL_FLUSH_POINTS or time.monotonic() - started >= TRAIL_FLUSH_SECONDS
+
+async def flush_trail(partner_id: str):
+    started, points = trail_buffers.pop(partner_id, (None, None))
+    if not points:
+        return
+    points.sort()
+    by_bucket: Dict[datetime, list] = {}
+    for point in points:
+        by_bucket.setdefault(trail_bucket(point[0]), []).append(point)
+    
+    writes, raw_by_write = [], []
+    for bucket, raw in by_bucket.items():
+        raw_by_write.append(raw)
+        kept = trail.douglas_peucker(raw, TRAIL_SIMPLIFY_METERS)
+        writes.append(UpdateOne(
+            {"partner_id": partner_id, "bucket": bucket},
+            {
+                "$push": {"chunks": trail.pack(kept)},
+                "$inc": {"points": len(kept), "raw_points": len(raw)},
+                "$min": {"start": datetime.fromtimestamp(raw[0][0], tz=timezone.utc)},
+                "$max": {"end": datetime.fromtimestamp(raw[-1][0], tz=timezone.utc)},
+                "$setOnInsert": {"expire_at": bucket + TRAIL_RETENTION}
+            },
+            upsert=True
+        ))
+    try:
+        await db.location_trails.bulk_write(writes, ordered=False)
+    except Exception as e:
+        # Put the unwritten buckets' points back, ahead of any pinged meanwhile, so the next flush retries them
+        if isinstance(e, BulkWriteError):
+            failed = {w["index"] for w in e.details.get("writeErrors", [])}
+            points = [point for index, raw in enumerate(raw_by_write) if index in failed for point in raw]
+        if points:
+            _, newer = trail_buffers.pop(partner_id, (None, []))
+            # While the database stays down keep only the latest pings, not an ever-growing backlog
+            trail_buffers[partner_id] = (started, (points + newer)[-TRAIL_FLUSH_POINTS * 10:])
+        logger.error(f"Trail flush failed for {partner_id} ({len(points)} points kept for retry): {e}")
+
+async def flush_stale_trails(max_age: float = TRAIL_FLUSH_SECONDS):
+    now = time.monotonic()
+    due = [partner_id for partner_id, (started, _) in trail_buffers.items() if now - started >= max_age]
+    for partner_id in due:
+        await flush_trail(partner_id)
+
+async def load_trail(partner_id: str, start: datetime, end: datetime) -> List[tuple]:
+    """Trail points for a partner in [start, end], including this process's unflushed pings"""
+    buckets = await db.location_trails.find(
+        {"partner_id": partner_id, "bucket": {"$gte": trail_bucket(start.timestamp()), "$lte": end}},
+        {"_id": 0, "chunks": 1}
+    ).sort("bucket", 1).to_list(None)
+    points = [point for bucket in buckets for chunk in bucket["chunks"] for point in trail.unpack(chunk)]
+    # Round-trip the buffer so unflushed points have the same precision as stored ones
+    points.extend(trail.unpack(trail.pack(sorted(trail_buffers.get(partner_id, (None, []))[1]))))
+    start_ts, end_ts = start.timestamp(), end.timestamp()
+    return sorted(set(p for p in points if start_ts <= p[0] <= end_ts))
+
+def trail_response(partner_id: str, start: datetime, end: datetime, points: List[tuple]) -> ORJSONResponse:
+    return ORJSONResponse({
+        "partner_id": partner_id,
+        "start": start,
+        "end": end,
+        "points": [
+            {"t": datetime.fromtimestamp(t, tz=timezone.utc), "lat": lat, "lng": lng}
+            for t, lat, lng in points
+        ],
+    })
+
+def as_utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+@api_router.get("/partners/{partner_id}/trail")
+async def get_partner_trail(
+    partner_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: User = Depends(require_partner)
+):
+    """A partner's own route between start and end (default: the last hour), simplified to ~8m"""
+    if partner_id != current_user.user_id:
+        raise HTTPException(status_code=403, detail="Not your trail")
+    end = as_utc(end) if end else datetime.now(timezone.utc)
+    start = as_utc(start) if start else end - timedelta(hours=1)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if end - start > TRAIL_MAX_RANGE:
+        raise HTTPException(status_code=400, detail=f"Range is limited to {TRAIL_MAX_RANGE.days} days")
+    
+    return trail_response(partner_id, start, end, await load_trail(partner_id, start, end))
+
+@api_router.get("/orders/{order_id}/trail")
+async def get_order_trail(order_id: str, current_user: User = Depends(require_auth)):
+    """The assigned agent's route from assignment until the order was closed (or now)"""
+    order = await db.shop_orders.find_one(
+        {"order_id": order_id},
+        {"_id": 0, "user_id": 1, "vendor_id": 1, "assigned_agent_id": 1, "agent_assigned_at": 1,
+         "status": 1, "created_at": 1, "updated_at": 1}
+    )
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if current_user.user_id not in (order.get("user_id"), order.get("vendor_id"), order.get("assigned_agent_id")):
+        raise HTTPException(status_code=403, detail="Not your order")
+    agent_id = order.get("assigned_agent_id")
+    if not agent_id:
+        return {"partner_id": None, "start": None, "end": None, "points": []}
+    
+    start = as_utc(order.get("agent_assigned_at") or order["created_at"])
+    closed = order.get("status") in ORDER_TERMINAL_STATUSES and order.get("updated_at")
+    end = as_utc(order["updated_at"]) if closed else datetime.now(timezone.utc)
+    return trail_response(agent_id, start, end, await load_trail(agent_id, start, min(end, start + TRAIL_MAX_RANGE)))
+
+@api_router.get("/orders/{order_id}/location")
+async def get_order_location(order_id: str, current_user: User = Depends(require_auth)):
+    """Latest position of the agent delivering the order"""
+    parties = await get_order_parties(order_id, current_user.user_id)
+    if not parties:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if not is_order_party(parties, current_user.user_id):
+        raise HTTPException(status_code=403, detail="Not your order")
+    return {"order_id": order_id, "location": await latest_agent_location(order_id, parties)}
+
+async def latest_agent_location(order_id: str, parties: dict) -> Optional[dict]:
+    agent_id = parties.get("assigned_agent_id")
+    if not agent_id:
+        return None
+    location = await db.partner_locations.find_one(
+        {"user_id": agent_id},
+        {"_id": 0, "latitude": 1, "longitude": 1, "heading": 1, "speed": 1, "timestamp": 1, "updated_at": 1}
+    )
+    if location:
+        return agent_location_message(order_id, location)
+    # Orders tracked before locations moved off the order document
+    legacy = await db.shop_orders.find_one({"order_id": order_id}, {"_id": 0, "agent_location": 1})
+    return (legacy or {}).get("agent_location")
+
 @api_router.put("/partner/status")
 async def update_partner_status(data: PartnerStatusUpdate, current_user: User = Depends(require_partner)):
     """Update partner's availability status"""
@@ -628,6 +1113,7 @@ async def update_partner_status(data: PartnerStatusUpdate, current_user: User =
         {"user_id": current_user.user_id},
         {"$set": {"partner_status": data.status}}
     )
+    index_partner_status(current_user.user_id, data.status)
     return {"message": f"Status updated to {data.status}"}
 
 
@@ -641,38 +1127,60 @@ class LocationUpdate(BaseModel):
     is_online: bool
 
 
-@api_router.put("/partner/location")
-async def update_partner_location(data: LocationUpdate, current_user: User = Depends(require_partner)):
-    """Update partner's current GPS location"""
+async def record_partner_location(user: User, lat: float, lng: float, is_online: bool = True, **fields) -> dict:
+    """Write a position fix to the live location store.
+    
+    That is the latest fix in partner_locations, the user's current_location, the
+    spatial index and the trail, plus a push to customers tracking orders this
+    partner is delivering. Every location source goes through here.
+    """
+    now = datetime.now(timezone.utc)
     location_data = {
-        "user_id": current_user.user_id,
-        "latitude": data.latitude,
-        "longitude": data.longitude,
-        "accuracy": data.accuracy,
-        "heading": data.heading,
-        "speed": data.speed,
-        "timestamp": data.timestamp,
-        "is_online": data.is_online,
-        "updated_at": datetime.now(timezone.utc)
+        "user_id": user.user_id,
+        "latitude": lat,
+        "longitude": lng,
+        "accuracy": fields.get("accuracy"),
+        "heading": fields.get("heading"),
+        "speed": fields.get("speed"),
+        "timestamp": fields.get("timestamp", now.timestamp()),
+        "is_online": is_online,
+        "updated_at": now
     }
     
-    # Upsert location in partner_locations collection
-    await db.partner_locations.update_one(
-        {"user_id": current_user.user_id},
-        {"$set": location_data},
-        upsert=True
+    await asyncio.gather(
+        db.partner_locations.update_one(
+            {"user_id": user.user_id},
+            {"$set": location_data},
+            upsert=True
+        ),
+        # Also update the user's current location for quick access
+        db.users.update_one(
+            {"user_id": user.user_id},
+            {"$set": {
+                "current_location": {"lat": lat, "lng": lng},
+                "location_updated_at": now
+            }}
+        )
     )
     
-    # Also update the user's current location for quick access
-    await db.users.update_one(
-        {"user_id": current_user.user_id},
-        {"$set": {
-            "current_location": {
-                "lat": data.latitude,
-                "lng": data.longitude
-            },
-            "location_updated_at": datetime.now(timezone.utc)
-        }}
+    index_partner_location(user, lat, lng, is_online)
+    if record_trail_point(user.user_id, lat, lng, now):
+        await flush_trail(user.user_id)
+    broadcast_agent_location(user.user_id, location_data)
+    return location_data
+
+@api_router.put("/partner/location")
+async def update_partner_location(data: LocationUpdate, current_user: User = Depends(require_partner)):
+    """Update partner's current GPS location"""
+    location_data = await record_partner_location(
+        current_user,
+        data.latitude,
+        data.longitude,
+        data.is_online,
+        accuracy=data.accuracy,
+        heading=data.heading,
+        speed=data.speed,
+        timestamp=data.timestamp
     )
     
     logger.info(f"📍 Location updated for {current_user.user_id}: ({data.latitude}, {data.longitude}) - {'ONLINE' if data.is_online else 'OFFLINE'}")
@@ -739,15 +1247,125 @@ async def get_partner_stats(current_user: User = Depends(require_partner)):
         "status": current_user.partner_status
     }
 
+# ===================== ORDER STATE MACHINE =====================
+
+# status -> statuses it may move to
+ORDER_TRANSITIONS = {
+    "pending": {"confirmed", "cancelled"},
+    "confirmed": {"preparing", "ready", "picked_up", "cancelled"},
+    "preparing": {"ready", "picked_up", "cancelled"},
+    "ready": {"picked_up", "out_for_delivery", "delivered", "cancelled"},
+    "picked_up": {"on_the_way", "nearby", "delivered"},
+    "on_the_way": {"nearby", "delivered"},
+    "nearby": {"delivered"},
+    "out_for_delivery": {"delivered"},
+    "delivered": set(),
+    "cancelled": set(),
+}
+
+# statuses each actor is allowed to set
+ORDER_ACTOR_STATUSES = {
+    "agent": {"picked_up", "on_the_way", "nearby", "delivered"},
+    "vendor": {"confirmed", "preparing", "ready", "out_for_delivery", "delivered", "cancelled"},
+}
+
+ORDER_TERMINAL_STATUSES = {"delivered", "cancelled"}
+
+# Only the most recent entries are kept on the order document
+ORDER_STATUS_HISTORY_LIMIT = 20
+
+def validate_order_transition(from_status: str, to_status: str, actor: str):
+    if to_status not in ORDER_ACTOR_STATUSES.get(actor, set()):
+        raise HTTPException(status_code=400, detail="Invalid status")
+    if to_status != from_status and to_status not in ORDER_TRANSITIONS.get(from_status, set()):
+        raise HTTPException(status_code=400, detail=f"Cannot change order from {from_status} to {to_status}")
+
+# order_id -> who may follow it; read on every live location update
+order_parties_cache = LocalCache(maxsize=20000, ttl=30)
+
+async def get_order_parties(order_id: str, user_id: Optional[str] = None) -> Optional[dict]:
+    """user_id, vendor_id and assigned_agent_id of an order (None if it does not exist).
+    
+    Transitions only invalidate the cache in their own worker, so when `user_id`
+    is given and the cached parties leave that user out (say an agent who just
+    accepted on another worker), the order is read again before saying no.
+    """
+    parties = order_parties_cache.get(order_id)
+    if parties is not None and user_id and not is_order_party(parties, user_id):
+        parties = None
+    if parties is None:
+        parties = await db.shop_orders.find_one(
+            {"order_id": order_id},
+            {"_id": 0, "user_id": 1, "vendor_id": 1, "assigned_agent_id": 1, "status": 1}
+        )
+        if not parties:
+            return None
+        order_parties_cache.set(order_id, parties)
+    return parties
+
+def is_order_party(parties: dict, user_id: str) -> bool:
+    return user_id in (parties.get("user_id"), parties.get("vendor_id"), parties.get("assigned_agent_id"))
+
+async def apply_order_transition(
+    order: dict,
+    to_status: str,
+    actor: str,
+    message: str,
+    history_status: Optional[str] = None,
+    guard: Optional[dict] = None,
+    extra_set: Optional[dict] = None,
+    conflict_detail: str = "Order was updated by someone else, please refresh"
+):
+    """Validate and apply an order status change in a single conditional update.
+    
+    The update only matches while the order is still in the status it was read in
+    (plus any `guard` conditions), so concurrent changes fail with 409 instead of
+    overwriting each other. Side actions (assignment etc.) pass the current status
+    with a `history_status` to record history and `extra_set` fields only.
+    """
+    from_status = order.get("status")
+    if from_status in ORDER_TERMINAL_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Order is already {from_status}")
+    if history_status is None or to_status != from_status:
+        validate_order_transition(from_status, to_status, actor)
+    
+    now = datetime.now(timezone.utc)
+    history_entry = {
+        "status": history_status or to_status,
+        "timestamp": now.isoformat(),
+        "message": message
+    }
+    result = await db.shop_orders.update_one(
+        {"order_id": order["order_id"], "status": from_status, **(guard or {})},
+        {
+            "$set": {"status": to_status, "updated_at": now, **(extra_set or {})},
+            "$push": {"status_history": {"$each": [history_entry], "$slice": -ORDER_STATUS_HISTORY_LIMIT}}
+        }
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=409, detail=conflict_detail)
+    order_parties_cache.invalidate(order["order_id"])
+    if to_status in ORDER_TERMINAL_STATUSES:
+        unwatch_order(order["order_id"], order.get("assigned_agent_id"))
+    order_channels.publish({
+        "type": "order_status",
+        "order_id": order["order_id"],
+        "status": to_status,
+        "history": history_entry
+    }, order["order_id"])
+
 # ===================== AGENT ENDPOINTS =====================
 
+# Confirmed by the vendor and not yet out of the shop
+AGENT_ACCEPTABLE_STATUSES = ("confirmed", "preparing", "ready")
+
 @api_router.get("/agent/available-orders")
 async def get_available_orders(current_user: User = Depends(require_agent)):
     """Get orders available for pickup by agents"""
     orders = await db.shop_orders.find({
         "delivery_type": "agent_delivery",
         "assigned_agent_id": None,
-        "status": {"$in": ["confirmed", "preparing", "ready"]}
+        "status": {"$in": list(AGENT_ACCEPTABLE_STATUSES)}
     }, {"_id": 0}).sort("created_at", -1).to_list(50)
     
     return orders
@@ -763,27 +1381,31 @@ async def accept_order(order_id: str, current_user: User = Depends(require_agent
     if order.get("assigned_agent_id"):
         raise HTTPException(status_code=400, detail="Order already assigned")
     
-    await db.shop_orders.update_one(
-        {"order_id": order_id},
-        {"$set": {
+    if order.get("delivery_type") != "agent_delivery" or order.get("status") not in AGENT_ACCEPTABLE_STATUSES:
+        raise HTTPException(status_code=400, detail="Order is not available for agent pickup")
+    
+    await apply_order_transition(
+        order,
+        "picked_up" if order["status"] == "ready" else order["status"],
+        actor="agent",
+        message=f"Agent {current_user.name} accepted the order",
+        history_status="agent_assigned",
+        guard={"assigned_agent_id": None, "delivery_type": "agent_delivery"},
+        extra_set={
             "assigned_agent_id": current_user.user_id,
             "agent_name": current_user.name,
             "agent_phone": current_user.phone,
-            "status": "picked_up" if order["status"] == "ready" else order["status"]
+            "agent_assigned_at": datetime.now(timezone.utc)
         },
-        "$push": {
-            "status_history": {
-                "status": "agent_assigned",
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-                "message": f"Agent {current_user.name} accepted the order"
-            }
-        }}
+        conflict_detail="Order already assigned"
     )
+    watch_order(order_id, current_user.user_id)
     
     await db.users.update_one(
         {"user_id": current_user.user_id},
         {"$set": {"partner_status": "busy"}}
     )
+    index_partner_status(current_user.user_id, "busy")
     
     return {"message": "Order accepted successfully"}
 
@@ -812,10 +1434,6 @@ class OrderStatusUpdate(BaseModel):
 @api_router.put("/agent/orders/{order_id}/status")
 async def update_order_status(order_id: str, data: OrderStatusUpdate, current_user: User = Depends(require_agent)):
     """Update order delivery status"""
-    valid_statuses = ["picked_up", "on_the_way", "nearby", "delivered"]
-    if data.status not in valid_statuses:
-        raise HTTPException(status_code=400, detail="Invalid status")
-    
     order = await db.shop_orders.find_one({"order_id": order_id}, {"_id": 0})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
@@ -823,23 +1441,16 @@ async def update_order_status(order_id: str, data: OrderStatusUpdate, current_us
     if order.get("assigned_agent_id") != current_user.user_id:
         raise HTTPException(status_code=403, detail="Not your order")
     
-    update_data = {"status": data.status}
-    if data.location:
-        update_data["agent_location"] = data.location
-    
-    await db.shop_orders.update_one(
-        {"order_id": order_id},
-        {
-            "$set": update_data,
-            "$push": {
-                "status_history": {
-                    "status": data.status,
-                    "timestamp": datetime.now(timezone.utc).isoformat(),
-                    "message": f"Order {data.status.replace('_', ' ')}"
-                }
-            }
-        }
+    await apply_order_transition(
+        order,
+        data.status,
+        actor="agent",
+        message=f"Order {data.status.replace('_', ' ')}",
+        guard={"assigned_agent_id": current_user.user_id}
     )
+    coords = location_coords(data.location)
+    if coords:
+        await record_partner_location(current_user, *coords)
     
     if data.status == "delivered":
         earning = {
@@ -863,6 +1474,7 @@ async def update_order_status(order_id: str, data: OrderStatusUpdate, current_us
                 "$set": {"partner_status": "available"}
             }
         )
+        index_partner_status(current_user.user_id, "available")
     
     return {"message": f"Order status updated to {data.status}"}
 
@@ -872,47 +1484,105 @@ class LocationUpdate(BaseModel):
 
 @api_router.put("/agent/orders/{order_id}/location")
 async def update_delivery_location(order_id: str, data: LocationUpdate, current_user: User = Depends(require_agent)):
-    """Update agent's live location during delivery"""
-    await db.shop_orders.update_one(
-        {"order_id": order_id, "assigned_agent_id": current_user.user_id},
-        {"$set": {
-            "agent_location": {
-                "lat": data.lat,
-                "lng": data.lng,
-                "timestamp": datetime.now(timezone.utc).isoformat()
-            }
-        }}
-    )
+    """Update agent's live location during delivery.
+    
+    The fix goes to the live location store like any other partner ping; the order
+    itself is not written, customers read it through assigned_agent_id.
+    """
+    parties = await get_order_parties(order_id, current_user.user_id)
+    if not parties or parties.get("assigned_agent_id") != current_user.user_id:
+        raise HTTPException(status_code=404, detail="Order not found")
+    await record_partner_location(current_user, data.lat, data.lng)
     return {"message": "Location updated"}
 
 # ===================== AGENT WISH MANAGEMENT =====================
 
-@api_router.get("/agent/available-wishes")
-async def get_available_wishes(current_user: User = Depends(require_agent)):
-    """Get pending wishes available for agents"""
-    # Filter wishes based on agent services
-    wish_types = []
-    if "delivery" in current_user.agent_services:
-        wish_types.extend(["delivery", "food_delivery", "grocery_delivery", "medicine_delivery"])
-    if "courier" in current_user.agent_services:
-        wish_types.extend(["courier", "document_delivery"])
-    if "rides" in current_user.agent_services:
-        wish_types.extend(["ride_request", "airport_transfer"])
-    if "errands" in current_user.agent_services:
-        wish_types.extend(["errands", "bill_payment", "pickup"])
-    
+# Agent service -> the wish types it can fulfil
+WISH_TYPES_BY_SERVICE = {
+    "delivery": ("delivery", "food_delivery", "grocery_delivery", "medicine_delivery"),
+    "courier": ("courier", "document_delivery"),
+    "rides": ("ride_request", "airport_transfer"),
+    "errands": ("errands", "bill_payment", "pickup"),
+}
+AVAILABLE_WISHES_LIMIT = 50
+# Candidates read per feed; most are then dropped by the distance check
+AVAILABLE_WISHES_SCAN = 500
+AVAILABLE_WISHES_CELL_DEG = 0.02  # ~2km
+# A wish is never shown further away than this, whatever its radius_km
+WISH_MAX_RADIUS_KM = 25
+WISH_DEFAULT_RADIUS_KM = 5
+
+# (wish types, grid cell) -> pending wishes around the cell, newest first.
+# Agents with the same services in the same area share one query. Per worker;
+# the short TTL is what keeps taken wishes from lingering on other workers.
+available_wishes_cache = LocalCache(maxsize=4096, ttl=5)
+
+def wish_types_for_services(services: List[str]) -> tuple:
+    return tuple(sorted({t for service in services for t in WISH_TYPES_BY_SERVICE.get(service, ())}))
+
+async def load_available_wishes(wish_types: tuple, cell: Optional[tuple]) -> List[dict]:
     query = {
         "status": "pending",
         "accepted_by": None,
         "linked_order_id": None
     }
     if wish_types:
-        query["wish_type"] = {"$in": wish_types}
+        query["wish_type"] = {"$in": list(wish_types)}
+    if cell is not None:
+        # Bounding box of everything within WISH_MAX_RADIUS_KM of the cell
+        lat_min = cell[0] * AVAILABLE_WISHES_CELL_DEG
+        lat_max = lat_min + AVAILABLE_WISHES_CELL_DEG
+        lng_min = cell[1] * AVAILABLE_WISHES_CELL_DEG
+        lng_max = lng_min + AVAILABLE_WISHES_CELL_DEG
+        pad_lat = WISH_MAX_RADIUS_KM / 111.0
+        widest = max(math.cos(math.radians(min(max(abs(lat_min), abs(lat_max)) + pad_lat, 89))), 0.01)
+        pad_lng = WISH_MAX_RADIUS_KM / (111.0 * widest)
+        query["location.lat"] = {"$gte": lat_min - pad_lat, "$lte": lat_max + pad_lat}
+        query["location.lng"] = {"$gte": lng_min - pad_lng, "$lte": lng_max + pad_lng}
+    return await db.wishes.find(query, {"_id": 0}).sort("created_at", -1).to_list(AVAILABLE_WISHES_SCAN)
+
+@api_router.get("/agent/available-wishes")
+async def get_available_wishes(
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    current_user: User = Depends(require_agent)
+):
+    """Get pending wishes available for agents.
     
-    wishes = await db.wishes.find(query, {"_id": 0}).sort("created_at", -1).to_list(50)
+    Distance is measured from lat/lng, or else the agent's last reported location,
+    and each wish is only offered within its own radius_km. Without any location
+    the feed is not filtered by distance.
+    """
+    if lat is None or lng is None:
+        lat, lng = partner_index.position(current_user.user_id) or location_coords(current_user.current_location) or (None, None)
+    cell = None
+    if lat is not None and lng is not None:
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise HTTPException(status_code=400, detail="Invalid coordinates")
+        cell = (math.floor(lat / AVAILABLE_WISHES_CELL_DEG), math.floor(lng / AVAILABLE_WISHES_CELL_DEG))
+    
+    cache_key = (wish_types_for_services(current_user.agent_services), cell)
+    candidates = available_wishes_cache.get(cache_key)
+    if candidates is None:
+        candidates = await load_available_wishes(*cache_key)
+        available_wishes_cache.set(cache_key, candidates)
     
+    wishes = []
+    for candidate in candidates:
+        wish = dict(candidate)
+        if cell is not None:
+            location = wish.get("location") or {}
+            distance_km = haversine_km(lat, lng, location["lat"], location["lng"])
+            if distance_km > min(wish.get("radius_km") or WISH_DEFAULT_RADIUS_KM, WISH_MAX_RADIUS_KM):
+                continue
+            wish["distance_km"] = round(distance_km, 2)
+        wishes.append(wish)
+        if len(wishes) >= AVAILABLE_WISHES_LIMIT:
+            break
+    
+    wishers = await get_user_profiles([wish["user_id"] for wish in wishes])
     for wish in wishes:
-        wisher = await db.users.find_one({"user_id": wish["user_id"]}, {"_id": 0, "name": 1, "picture": 1})
+        wisher = wishers.get(wish["user_id"])
         if wisher:
             wish["wisher_name"] = wisher.get("name")
             wish["wisher_picture"] = wisher.get("picture")
@@ -956,6 +1626,7 @@ async def agent_accept_wish(wish_id: str, current_user: User = Depends(require_a
         {"wish_id": wish_id},
         {"$set": {"status": "negotiating", "accepted_by": current_user.user_id}}
     )
+    available_wishes_cache.clear()
     
     return {"message": "Wish accepted, chat room created", "room_id": room_id}
 
@@ -967,8 +1638,9 @@ async def get_agent_wishes(current_user: User = Depends(require_agent)):
         {"_id": 0}
     ).sort("created_at", -1).to_list(100)
     
+    wishers = await get_user_profiles([wish["user_id"] for wish in wishes])
     for wish in wishes:
-        wisher = await db.users.find_one({"user_id": wish["user_id"]}, {"_id": 0, "name": 1, "picture": 1, "phone": 1})
+        wisher = wishers.get(wish["user_id"])
         if wisher:
             wish["wisher_name"] = wisher.get("name")
             wish["wisher_picture"] = wisher.get("picture")
@@ -1029,6 +1701,60 @@ class ProductCreate(BaseModel):
     category: str
     image: Optional[str] = None  # base64
 
+# vendor_id -> {"products": [...], "total": count, "version": content hash}. Edits invalidate only
+# the worker that handled them, so the TTL bounds how stale other workers get.
+catalog_cache = LocalCache(maxsize=2048, ttl=15)
+# Products kept in the cached catalog; pages past this are read from Mongo directly
+CATALOG_MAX_PRODUCTS = 5000
+CATALOG_SORT = [("created_at", -1), ("product_id", 1)]
+
+async def load_vendor_catalog(vendor_id: str) -> dict:
+    """Get a vendor's catalog (newest CATALOG_MAX_PRODUCTS), reading Mongo only on a cache miss.
+    
+    "total" is the vendor's real product count, which is larger than the cached
+    list for vendors over the cap.
+    """
+    catalog = catalog_cache.get(vendor_id)
+    if catalog is None:
+        products = await db.products.find(
+            {"vendor_id": vendor_id},
+            {"_id": 0}
+        ).sort(CATALOG_SORT).to_list(CATALOG_MAX_PRODUCTS + 1)
+        total = len(products)
+        if total > CATALOG_MAX_PRODUCTS:
+            products = products[:CATALOG_MAX_PRODUCTS]
+            total = await db.products.count_documents({"vendor_id": vendor_id})
+        catalog = {"products": products, "total": total, "version": payload_digest([products, total])}
+        catalog_cache.set(vendor_id, catalog)
+    return catalog
+
+async def catalog_page_response(vendor_id: str, request: Request, response: Response, page: int, limit: int):
+    """Serve one page of a vendor catalog with ETag / If-None-Match support"""
+    page = max(page, 1)
+    limit = min(max(limit, 1), 500)
+    catalog = await load_vendor_catalog(vendor_id)
+    start = (page - 1) * limit
+    
+    if start + limit <= len(catalog["products"]) or catalog["total"] <= len(catalog["products"]):
+        # The catalog version plus the paging window fully determine the body
+        products = catalog["products"][start:start + limit]
+        etag = f'"{catalog["version"]}-{page}-{limit}"'
+    else:
+        # Past the cached window of a very large catalog
+        products = await db.products.find(
+            {"vendor_id": vendor_id},
+            {"_id": 0}
+        ).sort(CATALOG_SORT).skip(start).limit(limit).to_list(limit)
+        etag = f'"{payload_digest([products, catalog["total"]])}-{page}-{limit}"'
+    
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    response.headers.update(headers)
+    set_pagination_headers(response, catalog["total"], page, limit)
+    return products
+
 @api_router.post("/vendor/products")
 async def create_product(data: ProductCreate, current_user: User = Depends(require_vendor)):
     """Create a new product"""
@@ -1039,21 +1765,36 @@ async def create_product(data: ProductCreate, current_user: User = Depends(requi
         "description": data.description,
         "price": data.price,
         "category": data.category,
-        "image": data.image,
+        "image": await offload_image(data.image),
         "in_stock": True,
         "created_at": datetime.now(timezone.utc)
     }
     await db.products.insert_one(product)
+    catalog_cache.invalidate(current_user.user_id)
     return {"message": "Product created", "product_id": product["product_id"]}
 
 @api_router.get("/vendor/products")
-async def get_vendor_products(current_user: User = Depends(require_vendor)):
+async def get_vendor_products(
+    request: Request,
+    response: Response,
+    page: int = 1,
+    limit: int = 200,
+    current_user: User = Depends(require_vendor)
+):
     """Get vendor's products"""
-    products = await db.products.find(
-        {"vendor_id": current_user.user_id},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(200)
-    return products
+    return await catalog_page_response(current_user.user_id, request, response, page, limit)
+
+@api_router.get("/vendors/{vendor_id}/products")
+async def get_vendor_catalog(
+    vendor_id: str,
+    request: Request,
+    response: Response,
+    page: int = 1,
+    limit: int = 50,
+    current_user: User = Depends(require_auth)
+):
+    """Browse a vendor's catalog (customers and agents)"""
+    return await catalog_page_response(vendor_id, request, response, page, limit)
 
 @api_router.put("/vendor/products/{product_id}")
 async def update_product(product_id: str, data: ProductCreate, current_user: User = Depends(require_vendor)):
@@ -1065,49 +1806,103 @@ async def update_product(product_id: str, data: ProductCreate, current_user: Use
             "description": data.description,
             "price": data.price,
             "category": data.category,
-            "image": data.image
+            "image": await offload_image(data.image)
         }}
     )
+    catalog_cache.invalidate(current_user.user_id)
     return {"message": "Product updated"}
 
 @api_router.delete("/vendor/products/{product_id}")
 async def delete_product(product_id: str, current_user: User = Depends(require_vendor)):
     """Delete a product"""
     await db.products.delete_one({"product_id": product_id, "vendor_id": current_user.user_id})
+    catalog_cache.invalidate(current_user.user_id)
     return {"message": "Product deleted"}
 
+# Changes newer than this are held back one poll so a write that commits late
+# (its updated_at is older than one already synced) is never skipped
+ORDER_SYNC_LAG = timedelta(seconds=1)
+ORDER_SYNC_MAX_CHANGES = 500
+
+def encode_sync_cursor(updated_at: datetime, order_id: str) -> str:
+    raw = f"{updated_at.isoformat()}|{order_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_sync_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        updated_at, order_id = raw.split("|", 1)
+        return datetime.fromisoformat(updated_at), order_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid sync cursor")
+
 @api_router.get("/vendor/orders")
-async def get_vendor_orders(current_user: User = Depends(require_vendor)):
-    """Get orders for vendor's shop"""
+async def get_vendor_orders(
+    response: Response,
+    since: Optional[str] = None,
+    limit: int = ORDER_SYNC_MAX_CHANGES,
+    current_user: User = Depends(require_vendor)
+):
+    """Get orders for vendor's shop.
+    
+    Without `since` this returns the latest orders. With the X-Sync-Cursor value
+    from a previous response it returns only orders changed after that cursor.
+    """
+    vendor_id = current_user.user_id
+    horizon = datetime.now(timezone.utc) - ORDER_SYNC_LAG
+    
+    if since:
+        updated_at, order_id = decode_sync_cursor(since)
+        limit = min(max(limit, 1), ORDER_SYNC_MAX_CHANGES)
+        orders = await db.shop_orders.find(
+            {
+                "vendor_id": vendor_id,
+                "updated_at": {"$lt": horizon},
+                "$or": [
+                    {"updated_at": {"$gt": updated_at}},
+                    {"updated_at": updated_at, "order_id": {"$gt": order_id}}
+                ]
+            },
+            {"_id": 0}
+        ).sort([("updated_at", 1), ("order_id", 1)]).to_list(limit + 1)
+        
+        has_more = len(orders) > limit
+        orders = orders[:limit]
+        cursor = encode_sync_cursor(orders[-1]["updated_at"], orders[-1]["order_id"]) if orders else since
+        response.headers["X-Sync-Cursor"] = cursor
+        response.headers["X-Sync-Has-More"] = "true" if has_more else "false"
+        return orders
+    
     orders = await db.shop_orders.find(
-        {"vendor_id": current_user.user_id},
+        {"vendor_id": vendor_id},
         {"_id": 0}
     ).sort("created_at", -1).to_list(100)
+    
+    latest = await db.shop_orders.find_one(
+        {"vendor_id": vendor_id, "updated_at": {"$lt": horizon}},
+        {"_id": 0, "updated_at": 1, "order_id": 1},
+        sort=[("updated_at", -1), ("order_id", -1)]
+    )
+    if latest:
+        cursor = encode_sync_cursor(latest["updated_at"], latest["order_id"])
+    else:
+        cursor = encode_sync_cursor(datetime(1970, 1, 1), "")
+    response.headers["X-Sync-Cursor"] = cursor
+    response.headers["X-Sync-Has-More"] = "false"
     return orders
 
 @api_router.put("/vendor/orders/{order_id}/status")
 async def update_vendor_order_status(order_id: str, data: OrderStatusUpdate, current_user: User = Depends(require_vendor)):
     """Update order status as vendor"""
-    valid_statuses = ["confirmed", "preparing", "ready", "out_for_delivery", "delivered", "cancelled"]
-    if data.status not in valid_statuses:
-        raise HTTPException(status_code=400, detail="Invalid status")
-    
     order = await db.shop_orders.find_one({"order_id": order_id, "vendor_id": current_user.user_id}, {"_id": 0})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    await db.shop_orders.update_one(
-        {"order_id": order_id},
-        {
-            "$set": {"status": data.status},
-            "$push": {
-                "status_history": {
-                    "status": data.status,
-                    "timestamp": datetime.now(timezone.utc).isoformat(),
-                    "message": f"Vendor updated status to {data.status}"
-                }
-            }
-        }
+    await apply_order_transition(
+        order,
+        data.status,
+        actor="vendor",
+        message=f"Vendor updated status to {data.status}"
     )
     
     if data.status == "delivered":
@@ -1142,13 +1937,407 @@ async def assign_agent_to_order(order_id: str, current_user: User = Depends(requ
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    await db.shop_orders.update_one(
-        {"order_id": order_id},
-        {"$set": {"delivery_type": "agent_delivery", "assigned_agent_id": None}}
+    await apply_order_transition(
+        order,
+        order["status"],
+        actor="vendor",
+        message="Vendor requested agent delivery",
+        history_status="awaiting_agent",
+        extra_set={"delivery_type": "agent_delivery", "assigned_agent_id": None}
     )
     
     return {"message": "Order marked for agent delivery"}
 
+# ===================== VENDOR BULK PRODUCT IMPORT =====================
+
+BULK_IMPORT_MAX_ROWS = 10000
+BULK_WRITE_BATCH_SIZE = 500
+
+async def iter_csv_rows(stream):
+    """Yield dict rows from a streamed CSV body (first line is the header)"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    header = None
+    pending = ""
+    buffer = ""
+    
+    def parse_record(record: str):
+        nonlocal header
+        values = next(csv.reader([record]), [])
+        if not any(v.strip() for v in values):
+            return None
+        if header is None:
+            header = [h.strip() for h in values]
+            return None
+        return {k: (v if v != "" else None) for k, v in zip(header, values)}
+    
+    async for chunk in stream:
+        buffer += decoder.decode(chunk)
+        lines = buffer.split("\n")
+        buffer = lines.pop()
+        for line in lines:
+            pending += line + "\n"
+            # A quoted field may span lines; wait until quotes are balanced
+            if pending.count('"') % 2:
+                continue
+            row = parse_record(pending.rstrip("\r\n"))
+            pending = ""
+            if row is not None:
+                yield row
+    
+    pending += buffer + decoder.decode(b"", final=True)
+    if pending.strip():
+        row = parse_record(pending.rstrip("\r\n"))
+        if row is not None:
+            yield row
+
+async def iter_json_array(stream):
+    """Yield elements of a streamed top-level JSON array one at a time"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    json_decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    
+    async for chunk in stream:
+        buffer += decoder.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buffer) and (buffer[pos].isspace() or (started and buffer[pos] == ",")):
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise HTTPException(status_code=400, detail="Expected a JSON array of products")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                item, pos = json_decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Element is incomplete, wait for the next chunk
+                break
+            yield item
+        buffer = buffer[pos:]
+    
+    raise HTTPException(status_code=400, detail="Malformed or truncated JSON array")
+
+def format_validation_error(error: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" for e in error.errors()]
+
+async def queue_rows(pending_rows: List[tuple], batch: List[tuple], vendor_id: str, now: datetime):
+    """Turn validated rows into write operations.
+    
+    product_id references are checked in one query so unknown ids are reported instead of inserted.
+    """
+    if not pending_rows:
+        return
+    referenced = [pid for _, _, pid in pending_rows if pid]
+    owned = set()
+    if referenced:
+        docs = await db.products.find(
+            {"vendor_id": vendor_id, "product_id": {"$in": referenced}},
+            {"_id": 0, "product_id": 1}
+        ).to_list(len(referenced))
+        owned = {d["product_id"] for d in docs}
+    
+    for result, product, product_id in pending_rows:
+        try:
+            image = await offload_image(product.image)
+        except HTTPException as e:
+            result.update({"status": "error", "errors": [f"image: {e.detail}"]})
+            continue
+        fields = {
+            "name": product.name,
+            "description": product.description,
+            "price": product.price,
+            "category": product.category,
+            "image": image,
+        }
+        if product_id:
+            if product_id not in owned:
+                result.update({"status": "error", "errors": ["product_id not found"]})
+                continue
+            result["product_id"] = product_id
+            new_id = None
+            op = UpdateOne({"vendor_id": vendor_id, "product_id": product_id}, {"$set": fields})
+        else:
+            new_id = f"prod_{uuid.uuid4().hex[:12]}"
+            op = UpdateOne(
+                {"vendor_id": vendor_id, "name": product.name},
+                {
+                    "$set": fields,
+                    "$setOnInsert": {"product_id": new_id, "in_stock": True, "created_at": now}
+                },
+                upsert=True
+            )
+        batch.append((result, op, new_id))
+    pending_rows.clear()
+
+@api_router.post("/vendor/products/bulk")
+async def bulk_import_products(request: Request, current_user: User = Depends(require_vendor)):
+    """Create or update many products from a CSV file or JSON array.
+    
+    Rows with a product_id update that product; other rows are upserted by name.
+    Rows are written in batches while the upload streams in, so an upload that
+    turns out too long or malformed after a batch was written still reports the
+    rows that were written (with the error status), rather than failing blind.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in ("text/csv", "application/csv"):
+        rows = iter_csv_rows(request.stream())
+    elif content_type == "application/json":
+        rows = iter_json_array(request.stream())
+    else:
+        raise HTTPException(status_code=415, detail="Upload products as text/csv or an application/json array")
+    
+    vendor_id = current_user.user_id
+    now = datetime.now(timezone.utc)
+    results: List[dict] = []
+    seen_names: Dict[str, int] = {}
+    batch: List[tuple] = []  # (result, UpdateOne, id assigned if the row inserts)
+    
+    async def flush():
+        if not batch:
+            return
+        ops = [op for _, op, _ in batch]
+        upserted = {}
+        failed = {}
+        try:
+            write_result = await db.products.bulk_write(ops, ordered=False)
+            upserted = write_result.upserted_ids
+        except BulkWriteError as e:
+            upserted = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
+            failed = {w["index"]: w.get("errmsg", "Write failed") for w in e.details.get("writeErrors", [])}
+        for index, (result, _, new_id) in enumerate(batch):
+            if index in failed:
+                result.update({"status": "error", "errors": [failed[index]], "product_id": None})
+            elif index in upserted:
+                result.update({"status": "created", "product_id": new_id})
+            else:
+                result["status"] = "updated"
+        batch.clear()
+    
+    pending_rows: List[tuple] = []  # validated rows waiting for the next write batch
+    aborted: Optional[HTTPException] = None
+    
+    try:
+        try:
+            async for raw in rows:
+                row_number = len(results) + 1
+                if row_number > BULK_IMPORT_MAX_ROWS:
+                    raise HTTPException(status_code=413, detail=f"Import is limited to {BULK_IMPORT_MAX_ROWS} rows")
+                result = {"row": row_number, "status": "pending", "product_id": None}
+                results.append(result)
+                
+                if not isinstance(raw, dict):
+                    result.update({"status": "error", "errors": ["Row must be an object"]})
+                    continue
+                try:
+                    product = ProductCreate(**raw)
+                except ValidationError as e:
+                    result.update({"status": "error", "errors": format_validation_error(e)})
+                    continue
+                
+                name_key = product.name.strip().lower()
+                if name_key in seen_names:
+                    result.update({"status": "error", "errors": [f"Duplicate product name (row {seen_names[name_key]})"]})
+                    continue
+                seen_names[name_key] = row_number
+                
+                result["name"] = product.name
+                pending_rows.append((result, product, raw.get("product_id")))
+                if len(pending_rows) >= BULK_WRITE_BATCH_SIZE:
+                    await queue_rows(pending_rows, batch, vendor_id, now)
+                    await flush()
+        except HTTPException as e:
+            if not any(r["status"] in ("created", "updated") for r in results):
+                raise
+            aborted = e
+            for result, _, _ in pending_rows:
+                result.update({"status": "skipped", "errors": [f"Not imported: {e.detail}"]})
+            pending_rows.clear()
+        
+        await queue_rows(pending_rows, batch, vendor_id, now)
+        await flush()
+    finally:
+        # Whatever was written is visible from here on, even if the import failed
+        catalog_cache.invalidate(vendor_id)
+    
+    # Resolve ids for rows that updated an existing product by name
+    unresolved = [r for r in results if r["status"] == "updated" and not r["product_id"]]
+    if unresolved:
+        existing = await db.products.find(
+            {"vendor_id": vendor_id, "name": {"$in": [r["name"] for r in unresolved]}},
+            {"_id": 0, "product_id": 1, "name": 1}
+        ).to_list(len(unresolved))
+        ids_by_name = {p["name"]: p["product_id"] for p in existing}
+        for r in unresolved:
+            r["product_id"] = ids_by_name.get(r["name"])
+    
+    counts = {"created": 0, "updated": 0, "error": 0, "skipped": 0}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    
+    logger.info(f"📦 Bulk import for {vendor_id}: {counts}")
+    
+    summary = {
+        "message": "Import processed",
+        "total": len(results),
+        "created": counts["created"],
+        "updated": counts["updated"],
+        "failed": counts["error"],
+        "skipped": counts["skipped"],
+        "results": results
+    }
+    if aborted:
+        return ORJSONResponse(
+            status_code=aborted.status_code,
+            content={**summary, "message": "Import stopped part way", "detail": aborted.detail}
+        )
+    return summary
+
+# ===================== PRODUCT SEARCH =====================
+
+PRODUCT_SEARCH_PROJECTION = {
+    "_id": 0, "product_id": 1, "vendor_id": 1, "name": 1, "description": 1,
+    "price": 1, "category": 1, "image": 1, "in_stock": 1
+}
+PRICE_FACET_BOUNDARIES = [0, 50, 100, 250, 500, 1000, 5000]
+
+# Vendor shop locations change rarely, so keep a short-lived snapshot for radius scoping
+vendor_locations_cache = LocalCache(maxsize=1, ttl=60)
+
+async def get_vendor_locations() -> List[dict]:
+    vendors = vendor_locations_cache.get("all")
+    if vendors is None:
+        docs = await db.users.find(
+            {"partner_type": "vendor", "vendor_shop_location": {"$ne": None}},
+            {"_id": 0, "user_id": 1, "vendor_shop_name": 1, "vendor_shop_location": 1}
+        ).to_list(None)
+        vendors = []
+        for doc in docs:
+            loc = doc.get("vendor_shop_location") or {}
+            lat = loc.get("lat", loc.get("latitude"))
+            lng = loc.get("lng", loc.get("longitude"))
+            if lat is not None and lng is not None:
+                vendors.append({"vendor_id": doc["user_id"], "name": doc.get("vendor_shop_name"), "lat": lat, "lng": lng})
+        vendor_locations_cache.set("all", vendors)
+    return vendors
+
+async def nearby_vendor_ids(lat: float, lng: float, radius_km: float) -> List[str]:
+    vendors = await get_vendor_locations()
+    return [v["vendor_id"] for v in vendors if haversine_km(lat, lng, v["lat"], v["lng"]) <= radius_km]
+
+async def search_products(
+    q: Optional[str] = None,
+    vendor_ids: Optional[List[str]] = None,
+    category: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    in_stock_only: bool = True,
+    limit: int = 20
+) -> dict:
+    """Text search over products with category and price facets.
+    
+    Each facet ignores its own filter so clients can show counts for the other options.
+    """
+    base_match: dict = {}
+    if q and q.strip():
+        base_match["$text"] = {"$search": q.strip()}
+    if vendor_ids is not None:
+        base_match["vendor_id"] = {"$in": vendor_ids}
+    if in_stock_only:
+        base_match["in_stock"] = True
+    
+    category_match = {"category": category} if category else {}
+    price_match: dict = {}
+    if min_price is not None:
+        price_match.setdefault("price", {})["$gte"] = min_price
+    if max_price is not None:
+        price_match.setdefault("price", {})["$lte"] = max_price
+    
+    pipeline: List[dict] = [{"$match": base_match}]
+    if "$text" in base_match:
+        sort = {"score": -1, "price": 1}
+        pipeline.append({"$addFields": {"score": {"$meta": "textScore"}}})
+    else:
+        sort = {"created_at": -1}
+    
+    pipeline.append({"$facet": {
+        "results": [
+            {"$match": {**category_match, **price_match}},
+            {"$sort": sort},
+            {"$limit": limit},
+            {"$project": {**PRODUCT_SEARCH_PROJECTION, **({"score": 1} if "$text" in base_match else {})}}
+        ],
+        "total": [
+            {"$match": {**category_match, **price_match}},
+            {"$count": "count"}
+        ],
+        "categories": [
+            {"$match": price_match},
+            {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}}
+        ],
+        "price_ranges": [
+            {"$match": category_match},
+            {"$bucket": {
+                "groupBy": "$price",
+                "boundaries": PRICE_FACET_BOUNDARIES,
+                # Keyed by its lower bound like the others, so every bucket _id is a number
+                "default": PRICE_FACET_BOUNDARIES[-1],
+                "output": {"count": {"$sum": 1}}
+            }}
+        ]
+    }})
+    
+    facets = (await db.products.aggregate(pipeline).to_list(1) or [{}])[0]
+    total = facets.get("total") or [{"count": 0}]
+    return {
+        "results": facets.get("results", []),
+        "total": total[0]["count"],
+        "facets": {
+            "categories": [{"category": c["_id"], "count": c["count"]} for c in facets.get("categories", [])],
+            "price_ranges": [price_range(b["_id"], b["count"]) for b in facets.get("price_ranges", [])]
+        }
+    }
+
+def price_range(low: float, count: int) -> dict:
+    """A price facet bucket with both bounds and a display label ("50-100", "5000+")"""
+    index = PRICE_FACET_BOUNDARIES.index(low)
+    high = PRICE_FACET_BOUNDARIES[index + 1] if index + 1 < len(PRICE_FACET_BOUNDARIES) else None
+    return {
+        "label": f"{low}-{high}" if high is not None else f"{low}+",
+        "min": low,
+        "max": high,
+        "count": count
+    }
+
+@api_router.get("/products/search")
+async def search_products_endpoint(
+    q: Optional[str] = None,
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    radius_km: float = 5.0,
+    category: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    in_stock_only: bool = True,
+    limit: int = 20,
+    current_user: User = Depends(require_auth)
+):
+    """Search products, optionally scoped to vendors within radius_km of (lat, lng)"""
+    limit = min(max(limit, 1), 100)
+    vendor_ids = None
+    if lat is not None and lng is not None:
+        vendor_ids = await nearby_vendor_ids(lat, lng, radius_km)
+        if not vendor_ids:
+            return {"results": [], "total": 0, "facets": {"categories": [], "price_ranges": []}}
+    
+    return await search_products(q, vendor_ids, category, min_price, max_price, in_stock_only, limit)
+
 # ===================== PROMOTER ENDPOINTS =====================
 
 class EventCreate(BaseModel):
@@ -1172,14 +2361,16 @@ async def create_event(data: EventCreate, current_user: User = Depends(require_p
         "description": data.description,
         "date": data.date,
         "location": data.location,
+        "geo": event_geo_point(data.location),
         "price": data.price,
         "total_slots": data.total_slots,
         "booked_slots": 0,
-        "images": data.images,
+        "images": await offload_images(data.images),
         "status": "active",
         "created_at": datetime.now(timezone.utc)
     }
     await db.promoter_events.insert_one(event)
+    nearby_events_cache.clear()
     return {"message": "Event created", "event_id": event["event_id"]}
 
 @api_router.get("/promoter/events")
@@ -1194,6 +2385,18 @@ async def get_promoter_events(current_user: User = Depends(require_promoter)):
 @api_router.put("/promoter/events/{event_id}")
 async def update_event(event_id: str, data: EventCreate, current_user: User = Depends(require_promoter)):
     """Update an event"""
+    event = await db.promoter_events.find_one(
+        {"event_id": event_id, "promoter_id": current_user.user_id},
+        {"_id": 0, "title": 1, "total_slots": 1, "slot_shards": 1}
+    )
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    
+    # Sharded events hold capacity in their shards; resize those first
+    slot_delta = data.total_slots - event.get("total_slots", 0)
+    if event.get("slot_shards") and slot_delta:
+        await resize_slot_shards(event_id, slot_delta)
+    
     await db.promoter_events.update_one(
         {"event_id": event_id, "promoter_id": current_user.user_id},
         {"$set": {
@@ -1202,13 +2405,34 @@ async def update_event(event_id: str, data: EventCreate, current_user: User = De
             "description": data.description,
             "date": data.date,
             "location": data.location,
+            "geo": event_geo_point(data.location),
             "price": data.price,
             "total_slots": data.total_slots,
-            "images": data.images
+            "images": await offload_images(data.images)
         }}
     )
+    nearby_events_cache.clear()
+    
+    if data.title != event.get("title"):
+        event_title_cache.invalidate(event_id)
+        # Bookings carry a copy of the title for listing
+        await db.event_bookings.update_many({"event_id": event_id}, {"$set": {"event_title": data.title}})
     return {"message": "Event updated"}
 
+async def resize_slot_shards(event_id: str, slot_delta: int):
+    """Spread a total_slots change over the shards; a shrink may only remove free slots"""
+    if slot_delta < 0:
+        if await take_from_shards(event_id, -slot_delta, field="capacity") is None:
+            raise HTTPException(status_code=409, detail="Cannot reduce slots below what is already booked or held")
+        return
+    shard_docs = await db.event_slot_shards.find({"event_id": event_id}, {"_id": 0, "shard": 1}).to_list(EVENT_MAX_SLOT_SHARDS)
+    count = len(shard_docs)
+    parts = [
+        {"shard": doc["shard"], "slots": slot_delta // count + (1 if i < slot_delta % count else 0)}
+        for i, doc in enumerate(shard_docs)
+    ]
+    await give_shard_room(event_id, [part for part in parts if part["slots"]], field="capacity")
+
 @api_router.delete("/promoter/events/{event_id}")
 async def delete_event(event_id: str, current_user: User = Depends(require_promoter)):
     """Delete/cancel an event"""
@@ -1216,24 +2440,538 @@ async def delete_event(event_id: str, current_user: User = Depends(require_promo
         {"event_id": event_id, "promoter_id": current_user.user_id},
         {"$set": {"status": "cancelled"}}
     )
+    nearby_events_cache.clear()
     return {"message": "Event cancelled"}
 
+# event_id -> title, for bookings written before titles were stored on them. Edits
+# invalidate only the worker that handled them, so the TTL bounds how stale other workers get.
+event_title_cache = LocalCache(maxsize=10000, ttl=300)
+
+async def get_event_titles(event_ids: List[str]) -> Dict[str, Optional[str]]:
+    """Resolve event titles from the cache, fetching any misses in one query"""
+    titles = {}
+    missing = []
+    for event_id in set(event_ids):
+        title = event_title_cache.get(event_id)
+        if title is None:
+            missing.append(event_id)
+        else:
+            titles[event_id] = title
+    if missing:
+        events = await db.promoter_events.find(
+            {"event_id": {"$in": missing}},
+            {"_id": 0, "event_id": 1, "title": 1}
+        ).to_list(len(missing))
+        for event in events:
+            titles[event["event_id"]] = event.get("title")
+            event_title_cache.set(event["event_id"], event.get("title"))
+    return titles
+
 @api_router.get("/promoter/bookings")
-async def get_promoter_bookings(current_user: User = Depends(require_promoter)):
+async def get_promoter_bookings(
+    response: Response,
+    event_id: Optional[str] = None,
+    page: int = 1,
+    limit: int = 200,
+    current_user: User = Depends(require_promoter)
+):
     """Get bookings for promoter's events"""
+    page = max(page, 1)
+    limit = min(max(limit, 1), 200)
+    query = {"promoter_id": current_user.user_id}
+    if event_id:
+        query["event_id"] = event_id
+    
     bookings = await db.event_bookings.find(
-        {"promoter_id": current_user.user_id},
+        query,
         {"_id": 0}
-    ).sort("created_at", -1).to_list(200)
-    
-    # Enrich with event details
-    for booking in bookings:
-        event = await db.promoter_events.find_one({"event_id": booking["event_id"]}, {"_id": 0, "title": 1})
-        if event:
-            booking["event_title"] = event.get("title")
+    ).sort("created_at", -1).skip((page - 1) * limit).to_list(limit)
+    total = await db.event_bookings.count_documents(query)
+    set_pagination_headers(response, total, page, limit)
+    
+    # Enrich older bookings that predate the stored event_title
+    untitled = [b["event_id"] for b in bookings if not b.get("event_title")]
+    if untitled:
+        titles = await get_event_titles(untitled)
+        for booking in bookings:
+            if not booking.get("event_title") and titles.get(booking["event_id"]):
+                booking["event_title"] = titles[booking["event_id"]]
     
     return bookings
 
+@api_router.get("/promoter/bookings/summary")
+async def get_promoter_bookings_summary(current_user: User = Depends(require_promoter)):
+    """Per-event booking counts, booked slots and revenue"""
+    stats = await db.event_bookings.aggregate([
+        {"$match": {"promoter_id": current_user.user_id}},
+        {"$group": {
+            "_id": "$event_id",
+            "bookings": {"$sum": 1},
+            "slots": {"$sum": {"$ifNull": ["$slots", 1]}},
+            "amount": {"$sum": {"$ifNull": ["$amount", 0]}},
+            "last_booking_at": {"$max": "$created_at"}
+        }},
+        {"$sort": {"last_booking_at": -1}}
+    ]).to_list(None)
+    
+    titles = await get_event_titles([s["_id"] for s in stats])
+    events = [
+        {
+            "event_id": s["_id"],
+            "event_title": titles.get(s["_id"]),
+            "bookings": s["bookings"],
+            "slots": s["slots"],
+            "amount": s["amount"],
+            "last_booking_at": s["last_booking_at"]
+        }
+        for s in stats
+    ]
+    return {
+        "events": events,
+        "total_bookings": sum(e["bookings"] for e in events),
+        "total_amount": sum(e["amount"] for e in events)
+    }
+
+# ===================== EVENT DISCOVERY =====================
+
+NEARBY_EVENTS_CELL_DEG = 0.01  # ~1.1km grid used to share cached results between nearby callers
+NEARBY_EVENTS_MAX_RADIUS_KM = 100
+NEARBY_EVENTS_MAX_CANDIDATES = 500
+
+# (cell, radius, date window) -> candidate events around the cell centre
+nearby_events_cache = LocalCache(maxsize=2048, ttl=60)
+
+def event_geo_point(location: Optional[dict]) -> Optional[dict]:
+    """GeoJSON point for an event's {lat, lng} location, or None if it has no coordinates"""
+    if not location:
+        return None
+    lat = location.get("lat", location.get("latitude"))
+    lng = location.get("lng", location.get("longitude"))
+    if lat is None or lng is None:
+        return None
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Event location lat/lng must be numbers")
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise HTTPException(status_code=400, detail="Event location is out of range")
+    return {"type": "Point", "coordinates": [lng, lat]}
+
+async def load_nearby_events(lat: float, lng: float, radius_km: float, date_from: Optional[datetime], date_to: Optional[datetime]) -> List[dict]:
+    """Active events within radius_km of a point and inside the date window, nearest first"""
+    date_query = {"$gte": date_from or datetime.now(timezone.utc)}
+    if date_to:
+        date_query["$lte"] = date_to
+    return await db.promoter_events.aggregate([
+        {"$geoNear": {
+            "near": {"type": "Point", "coordinates": [lng, lat]},
+            "key": "geo",
+            "distanceField": "distance_m",
+            "maxDistance": radius_km * 1000,
+            "spherical": True,
+            "query": {"status": "active", "date": date_query}
+        }},
+        {"$limit": NEARBY_EVENTS_MAX_CANDIDATES},
+        {"$project": {"_id": 0, "geo": 0, "distance_m": 0}}
+    ]).to_list(NEARBY_EVENTS_MAX_CANDIDATES)
+
+@api_router.get("/events/nearby")
+async def get_nearby_events(
+    lat: float,
+    lng: float,
+    radius_km: float = 25,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    limit: int = 50,
+    current_user: User = Depends(require_auth)
+):
+    """Active events near a point within a date window, sorted by distance then date.
+    
+    Results are computed per ~1km grid cell and cached briefly, so callers in the
+    same area share one query. Slot counts in the response may lag by up to a minute;
+    use /events/{event_id}/availability before booking.
+    """
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise HTTPException(status_code=400, detail="Invalid coordinates")
+    radius_km = min(max(radius_km, 0.1), NEARBY_EVENTS_MAX_RADIUS_KM)
+    limit = min(max(limit, 1), 100)
+    if date_from and date_to and date_to < date_from:
+        raise HTTPException(status_code=400, detail="date_to must be after date_from")
+    
+    # Snap to the grid cell centre and widen the radius to cover the whole cell
+    cell = (math.floor(lat / NEARBY_EVENTS_CELL_DEG), math.floor(lng / NEARBY_EVENTS_CELL_DEG))
+    center_lat = (cell[0] + 0.5) * NEARBY_EVENTS_CELL_DEG
+    center_lng = (cell[1] + 0.5) * NEARBY_EVENTS_CELL_DEG
+    margin_km = haversine_km(center_lat, center_lng, center_lat + NEARBY_EVENTS_CELL_DEG / 2, center_lng + NEARBY_EVENTS_CELL_DEG / 2)
+    
+    cache_key = (cell, radius_km, date_from, date_to)
+    candidates = nearby_events_cache.get(cache_key)
+    if candidates is None:
+        candidates = await load_nearby_events(center_lat, center_lng, radius_km + margin_km, date_from, date_to)
+        nearby_events_cache.set(cache_key, candidates)
+    
+    # Cached sets are reused for up to a minute, so drop events that have since started
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    results = []
+    for event in candidates:
+        coords = event_geo_point(event.get("location"))["coordinates"]
+        distance_km = haversine_km(lat, lng, coords[1], coords[0])
+        if distance_km > radius_km:
+            continue
+        if date_from is None and event.get("date") and event["date"].replace(tzinfo=None) < now:
+            continue
+        results.append({**event, "distance_km": round(distance_km, 2)})
+    
+    results.sort(key=lambda e: (e["distance_km"], e["date"]))
+    return results[:limit]
+
+# ===================== EVENT SLOT BOOKING =====================
+
+EVENT_HOLD_TTL = timedelta(minutes=10)
+EVENT_HOLD_SWEEP_INTERVAL = 30  # seconds
+EVENT_MAX_SLOTS_PER_BOOKING = 20
+EVENT_MAX_SLOT_SHARDS = 64
+
+class SlotRequest(BaseModel):
+    slots: int = 1
+
+class ShardCounterRequest(BaseModel):
+    shards: int = 8
+
+async def take_shard_room(event_id: str, shard: int, slots: int, field: str) -> bool:
+    """Use up `slots` of one shard's free room, by booking them or (field="capacity") removing them"""
+    result = await db.event_slot_shards.update_one(
+        {
+            "event_id": event_id,
+            "shard": shard,
+            "$expr": {"$lte": [{"$add": ["$booked", slots]}, "$capacity"]}
+        },
+        {"$inc": {field: slots if field == "booked" else -slots}}
+    )
+    return bool(result.modified_count)
+
+async def give_shard_room(event_id: str, allocation: List[dict], field: str):
+    for part in allocation:
+        await db.event_slot_shards.update_one(
+            {"event_id": event_id, "shard": part["shard"]},
+            {"$inc": {field: -part["slots"] if field == "booked" else part["slots"]}}
+        )
+
+async def take_from_shards(event_id: str, slots: int, field: str = "booked") -> Optional[List[dict]]:
+    """Take `slots` of free room from an event's shards.
+    
+    One shard that fits the whole request is preferred (tried in random order);
+    otherwise the request is split across shards, largest free room first. Returns
+    the [{shard, slots}] taken, or None with nothing taken when the room is not there.
+    """
+    shard_docs = await db.event_slot_shards.find(
+        {"event_id": event_id},
+        {"_id": 0, "shard": 1, "capacity": 1, "booked": 1}
+    ).to_list(EVENT_MAX_SLOT_SHARDS)
+    random.shuffle(shard_docs)
+    for doc in shard_docs:
+        if doc["capacity"] - doc["booked"] >= slots and await take_shard_room(event_id, doc["shard"], slots, field):
+            return [{"shard": doc["shard"], "slots": slots}]
+    
+    # The snapshot may be stale, so each part is still a conditional update
+    allocation = []
+    remaining = slots
+    for doc in sorted(shard_docs, key=lambda d: d["booked"] - d["capacity"]):
+        part = min(doc["capacity"] - doc["booked"], remaining)
+        if part <= 0:
+            break
+        if await take_shard_room(event_id, doc["shard"], part, field):
+            allocation.append({"shard": doc["shard"], "slots": part})
+            remaining -= part
+        if not remaining:
+            return allocation
+    await give_shard_room(event_id, allocation, field)
+    return None
+
+async def reserve_event_slots(event: dict, slots: int) -> Optional[List[dict]]:
+    """Atomically take `slots` from an event's remaining capacity.
+    
+    Returns the [{shard, slots}] used (None for an unsharded event). Raises 409
+    when the event does not have enough free slots.
+    """
+    event_id = event["event_id"]
+    if event.get("slot_shards"):
+        allocation = await take_from_shards(event_id, slots)
+        if allocation is not None:
+            return allocation
+    else:
+        # One conditional $inc: it only matches while booked + slots fits in total
+        result = await db.promoter_events.update_one(
+            {
+                "event_id": event_id,
+                "status": "active",
+                "slot_shards": None,
+                "$expr": {"$lte": [{"$add": ["$booked_slots", slots]}, "$total_slots"]}
+            },
+            {"$inc": {"booked_slots": slots}}
+        )
+        if result.modified_count:
+            return None
+    raise HTTPException(status_code=409, detail="Not enough slots available")
+
+async def release_event_slots(event_id: str, slots: int, shards: Optional[List[dict]]):
+    if shards:
+        await give_shard_room(event_id, shards, "booked")
+        return
+    result = await db.promoter_events.update_one(
+        {"event_id": event_id, "slot_shards": None},
+        {"$inc": {"booked_slots": -slots}}
+    )
+    if result.matched_count:
+        return
+    # Taken before the event was sharded: those slots are part of base_booked_slots,
+    # so move them from there into a shard where they can be booked again
+    await db.promoter_events.update_one({"event_id": event_id}, {"$inc": {"base_booked_slots": -slots}})
+    await db.event_slot_shards.update_one(
+        {"event_id": event_id, "shard": 0},
+        {"$inc": {"capacity": slots}, "$setOnInsert": {"booked": 0}},
+        upsert=True
+    )
+
+def hold_shards(hold: dict) -> Optional[List[dict]]:
+    # Holds from before multi-shard reservations recorded a single shard
+    if hold.get("shard") is not None:
+        return [{"shard": hold["shard"], "slots": hold["slots"]}]
+    return hold.get("shards")
+
+async def release_event_hold(hold: dict, status: str) -> bool:
+    """Move a hold out of 'held' and give its slots back. Only the caller that wins the status change releases."""
+    result = await db.event_holds.update_one(
+        {"hold_id": hold["hold_id"], "status": "held"},
+        {"$set": {"status": status, "released_at": datetime.now(timezone.utc)}}
+    )
+    if result.modified_count:
+        await release_event_slots(hold["event_id"], hold["slots"], hold_shards(hold))
+        return True
+    return False
+
+async def expire_event_holds(event_id: Optional[str] = None) -> int:
+    """Release holds whose TTL has passed"""
+    query = {"status": "held", "expires_at": {"$lt": datetime.now(timezone.utc)}}
+    if event_id:
+        query["event_id"] = event_id
+    expired = await db.event_holds.find(
+        query,
+        {"_id": 0, "hold_id": 1, "event_id": 1, "slots": 1, "shard": 1, "shards": 1}
+    ).to_list(500)
+    released = 0
+    for hold in expired:
+        if await release_event_hold(hold, "expired"):
+            released += 1
+    if released:
+        logger.info(f"⏳ Released {released} expired event holds")
+    return released
+
+async def sync_sharded_event_counts():
+    """Fold shard counters back into booked_slots so event listings stay accurate"""
+    totals = await db.event_slot_shards.aggregate([
+        {"$group": {"_id": "$event_id", "booked": {"$sum": "$booked"}}}
+    ]).to_list(None)
+    for total in totals:
+        await db.promoter_events.update_one(
+            {"event_id": total["_id"], "slot_shards": {"$gt": 0}},
+            [{"$set": {"booked_slots": {"$add": [{"$ifNull": ["$base_booked_slots", 0]}, total["booked"]]}}}]
+        )
+
+async def sweep_event_slots():
+    await expire_event_holds()
+    await sync_sharded_event_counts()
+
+async def get_bookable_event(event_id: str) -> dict:
+    event = await db.promoter_events.find_one(
+        {"event_id": event_id},
+        {"_id": 0, "event_id": 1, "promoter_id": 1, "title": 1, "price": 1, "status": 1,
+         "total_slots": 1, "booked_slots": 1, "slot_shards": 1}
+    )
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    if event.get("status") != "active":
+        raise HTTPException(status_code=400, detail="Event is not open for booking")
+    return event
+
+def validate_slot_count(slots: int):
+    if slots < 1 or slots > EVENT_MAX_SLOTS_PER_BOOKING:
+        raise HTTPException(status_code=400, detail=f"Book between 1 and {EVENT_MAX_SLOTS_PER_BOOKING} slots")
+
+async def reserve_with_expiry_retry(event: dict, slots: int) -> Optional[List[dict]]:
+    """Reserve slots, releasing this event's expired holds once if it looks sold out"""
+    try:
+        return await reserve_event_slots(event, slots)
+    except HTTPException:
+        if not await expire_event_holds(event["event_id"]):
+            raise
+        return await reserve_event_slots(event, slots)
+
+async def create_event_booking(event: dict, user: User, slots: int, hold_id: Optional[str] = None) -> dict:
+    booking = {
+        "booking_id": f"book_{uuid.uuid4().hex[:12]}",
+        "event_id": event["event_id"],
+        "promoter_id": event["promoter_id"],
+        "event_title": event.get("title"),
+        "user_id": user.user_id,
+        "user_name": user.name,
+        "slots": slots,
+        "amount": event.get("price", 0) * slots,
+        "status": "confirmed",
+        "hold_id": hold_id,
+        "created_at": datetime.now(timezone.utc)
+    }
+    await db.event_bookings.insert_one(booking)
+    booking.pop("_id", None)
+    return booking
+
+@api_router.post("/events/{event_id}/book")
+async def book_event(event_id: str, data: SlotRequest, current_user: User = Depends(require_auth)):
+    """Book slots on an event immediately"""
+    validate_slot_count(data.slots)
+    event = await get_bookable_event(event_id)
+    await reserve_with_expiry_retry(event, data.slots)
+    booking = await create_event_booking(event, current_user, data.slots)
+    logger.info(f"🎟️ Booking {booking['booking_id']}: {data.slots} slot(s) on {event_id}")
+    return {"message": "Booking confirmed", "booking": booking}
+
+@api_router.post("/events/{event_id}/holds")
+async def hold_event_slots(event_id: str, data: SlotRequest, current_user: User = Depends(require_auth)):
+    """Reserve slots for a limited time while the customer completes checkout"""
+    validate_slot_count(data.slots)
+    event = await get_bookable_event(event_id)
+    shards = await reserve_with_expiry_retry(event, data.slots)
+    
+    now = datetime.now(timezone.utc)
+    hold = {
+        "hold_id": f"hold_{uuid.uuid4().hex[:12]}",
+        "event_id": event_id,
+        "user_id": current_user.user_id,
+        "slots": data.slots,
+        "shards": shards,
+        "status": "held",
+        "expires_at": now + EVENT_HOLD_TTL,
+        # Finished holds are purged a day after expiry by a TTL index
+        "purge_at": now + EVENT_HOLD_TTL + timedelta(days=1),
+        "created_at": now
+    }
+    await db.event_holds.insert_one(hold)
+    return {
+        "message": "Slots held",
+        "hold_id": hold["hold_id"],
+        "slots": data.slots,
+        "expires_at": hold["expires_at"].isoformat()
+    }
+
+@api_router.post("/events/holds/{hold_id}/confirm")
+async def confirm_event_hold(hold_id: str, current_user: User = Depends(require_auth)):
+    """Turn an unexpired hold into a confirmed booking"""
+    hold = await db.event_holds.find_one({"hold_id": hold_id, "user_id": current_user.user_id}, {"_id": 0})
+    if not hold:
+        raise HTTPException(status_code=404, detail="Hold not found")
+    event = await db.promoter_events.find_one(
+        {"event_id": hold["event_id"]},
+        {"_id": 0, "event_id": 1, "promoter_id": 1, "title": 1, "price": 1, "status": 1}
+    )
+    if not event or event.get("status") == "cancelled":
+        # Nothing left to book; give the slots back rather than confirming into the void
+        await release_event_hold(hold, "released")
+        if not event:
+            raise HTTPException(status_code=404, detail="Event not found")
+        raise HTTPException(status_code=410, detail="Event has been cancelled")
+    
+    now = datetime.now(timezone.utc)
+    result = await db.event_holds.update_one(
+        {"hold_id": hold_id, "user_id": current_user.user_id, "status": "held", "expires_at": {"$gt": now}},
+        {"$set": {"status": "confirmed", "confirmed_at": now}}
+    )
+    if not result.modified_count:
+        if hold["status"] == "held":
+            # Past its expiry but not swept yet; a no-op if another request confirmed it
+            await release_event_hold(hold, "expired")
+        raise HTTPException(status_code=410, detail="Hold has expired or is no longer active")
+    
+    booking = await create_event_booking(event, current_user, hold["slots"], hold_id=hold_id)
+    return {"message": "Booking confirmed", "booking": booking}
+
+@api_router.delete("/events/holds/{hold_id}")
+async def release_hold(hold_id: str, current_user: User = Depends(require_auth)):
+    """Give up a hold before it expires"""
+    hold = await db.event_holds.find_one({"hold_id": hold_id, "user_id": current_user.user_id}, {"_id": 0})
+    if not hold:
+        raise HTTPException(status_code=404, detail="Hold not found")
+    await release_event_hold(hold, "released")
+    return {"message": "Hold released"}
+
+@api_router.get("/events/{event_id}/availability")
+async def get_event_availability(event_id: str, current_user: User = Depends(require_auth)):
+    """Get the number of free slots on an event"""
+    event = await db.promoter_events.find_one(
+        {"event_id": event_id},
+        {"_id": 0, "total_slots": 1, "booked_slots": 1, "base_booked_slots": 1, "slot_shards": 1, "status": 1}
+    )
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    
+    if event.get("slot_shards"):
+        shards = await db.event_slot_shards.find(
+            {"event_id": event_id},
+            {"_id": 0, "capacity": 1, "booked": 1}
+        ).to_list(EVENT_MAX_SLOT_SHARDS)
+        available = sum(max(s["capacity"] - s["booked"], 0) for s in shards)
+        booked = event.get("base_booked_slots", 0) + sum(s["booked"] for s in shards)
+    else:
+        booked = event.get("booked_slots", 0)
+        available = max(event.get("total_slots", 0) - booked, 0)
+    
+    return {
+        "event_id": event_id,
+        "status": event.get("status"),
+        "total_slots": event.get("total_slots", 0),
+        "booked_slots": booked,
+        "available_slots": available
+    }
+
+@api_router.post("/promoter/events/{event_id}/shard-counter")
+async def enable_sharded_slot_counter(event_id: str, data: ShardCounterRequest, current_user: User = Depends(require_promoter)):
+    """Spread an event's remaining capacity over several counter documents.
+    
+    For hot events: concurrent bookings then contend on different documents
+    instead of all serializing on the event document.
+    """
+    if data.shards < 2 or data.shards > EVENT_MAX_SLOT_SHARDS:
+        raise HTTPException(status_code=400, detail=f"shards must be between 2 and {EVENT_MAX_SLOT_SHARDS}")
+    
+    # Flip the flag first: unsharded reservations require slot_shards to be unset,
+    # so booked_slots is frozen from this point on
+    result = await db.promoter_events.update_one(
+        {"event_id": event_id, "promoter_id": current_user.user_id, "slot_shards": None},
+        {"$set": {"slot_shards": data.shards}}
+    )
+    if not result.modified_count:
+        raise HTTPException(status_code=400, detail="Event not found or already sharded")
+    
+    event = await db.promoter_events.find_one({"event_id": event_id}, {"_id": 0, "total_slots": 1, "booked_slots": 1})
+    base_booked = event.get("booked_slots", 0)
+    remaining = max(event.get("total_slots", 0) - base_booked, 0)
+    capacities = [remaining // data.shards + (1 if i < remaining % data.shards else 0) for i in range(data.shards)]
+    # Both are increments: a pre-sharding hold released meanwhile has already
+    # moved its slots from base_booked_slots into shard 0
+    await db.promoter_events.update_one(
+        {"event_id": event_id},
+        {"$inc": {"base_booked_slots": base_booked}}
+    )
+    await db.event_slot_shards.bulk_write([
+        UpdateOne(
+            {"event_id": event_id, "shard": i},
+            {"$inc": {"capacity": capacity}, "$setOnInsert": {"booked": 0}},
+            upsert=True
+        )
+        for i, capacity in enumerate(capacities)
+    ])
+    
+    return {"message": "Sharded slot counter enabled", "event_id": event_id, "shards": data.shards, "capacities": capacities}
+
 # ===================== DEAL NEGOTIATION ENDPOINTS =====================
 
 class DealOffer(BaseModel):
@@ -1249,6 +2987,49 @@ class DealResponse(BaseModel):
     counter_price: Optional[float] = None
     message: Optional[str] = None
 
+DEAL_OFFERS_PAGE_SIZE = 50
+DEAL_RECENT_OFFERS = 20
+
+# Fields returned by deal list endpoints; the offer history lives in deal_offers
+DEAL_SUMMARY_PROJECTION = {
+    "_id": 0,
+    "deal_id": 1,
+    "wish_id": 1,
+    "partner_id": 1,
+    "partner_name": 1,
+    "wisher_id": 1,
+    "initial_price": 1,
+    "current_price": 1,
+    "scheduled_date": 1,
+    "scheduled_time": 1,
+    "status": 1,
+    "room_id": 1,
+    "last_offer": 1,
+    "offer_count": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "accepted_at": 1,
+    "rejected_at": 1,
+    "started_at": 1,
+    "completed_at": 1,
+}
+
+async def record_deal_offer(deal_id: str, offer_from: str, offer_type: str, data: DealOffer) -> dict:
+    """Append an offer to the deal's history and return its summary for the deal document"""
+    offer = {
+        "offer_id": f"offer_{uuid.uuid4().hex[:12]}",
+        "deal_id": deal_id,
+        "from": offer_from,
+        "price": data.price,
+        "type": offer_type,
+        "scheduled_date": data.scheduled_date,
+        "scheduled_time": data.scheduled_time,
+        "notes": data.notes,
+        "timestamp": datetime.now(timezone.utc)
+    }
+    await db.deal_offers.insert_one(offer)
+    return {key: offer[key] for key in ("offer_id", "from", "price", "type", "timestamp")}
+
 @api_router.post("/deals/create-from-wish")
 async def create_deal_from_wish(data: DealOffer, current_user: User = Depends(require_partner)):
     """Create a new deal negotiation from a wish and create a chat room"""
@@ -1257,6 +3038,8 @@ async def create_deal_from_wish(data: DealOffer, current_user: User = Depends(re
     deal_id = f"deal_{uuid.uuid4().hex[:12]}"
     room_id = f"room_{uuid.uuid4().hex[:12]}"
     
+    last_offer = await record_deal_offer(deal_id, "partner", "initial", data)
+    
     # Create the deal document
     deal_doc = {
         "deal_id": deal_id,
@@ -1271,14 +3054,8 @@ async def create_deal_from_wish(data: DealOffer, current_user: User = Depends(re
         "notes": data.notes,
         "status": "pending",  # pending, negotiating, accepted, rejected, completed
         "room_id": room_id,
-        "offers": [
-            {
-                "from": "partner",
-                "price": data.price,
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-                "type": "initial"
-            }
-        ],
+        "last_offer": last_offer,
+        "offer_count": 1,
         "created_at": datetime.now(timezone.utc),
         "updated_at": datetime.now(timezone.utc)
     }
@@ -1331,35 +3108,74 @@ async def get_my_deals(status: Optional[str] = None, current_user: User = Depend
     if status:
         query["status"] = status
     
-    deals = await db.deals.find(query, {"_id": 0}).sort("created_at", -1).to_list(100)
-    
-    # Convert datetime objects to strings for JSON serialization
-    for deal in deals:
-        for key in ["created_at", "updated_at", "accepted_at", "rejected_at", "started_at", "completed_at"]:
-            if key in deal and deal[key]:
-                deal[key] = deal[key].isoformat() if hasattr(deal[key], 'isoformat') else str(deal[key])
-    
-    return {"deals": deals, "count": len(deals)}
+    deals = await db.deals.find(query, DEAL_SUMMARY_PROJECTION).sort("created_at", -1).to_list(100)
+    return ORJSONResponse({"deals": deals, "count": len(deals)})
 
 
 @api_router.get("/deals/{deal_id}")
 async def get_deal(deal_id: str, current_user: User = Depends(require_partner)):
-    """Get deal details"""
+    """Get deal details with the most recent offers (oldest first)"""
     deal = await db.deals.find_one(
         {"deal_id": deal_id, "partner_id": current_user.user_id},
-        {"_id": 0}
+        {"_id": 0, "offers": 0}
     )
     if not deal:
         raise HTTPException(status_code=404, detail="Deal not found")
+    
+    recent = await db.deal_offers.find(
+        {"deal_id": deal_id},
+        {"_id": 0, "deal_id": 0}
+    ).sort([("timestamp", -1), ("offer_id", -1)]).to_list(DEAL_RECENT_OFFERS)
+    deal["offers"] = list(reversed(recent))
     return deal
 
 
+@api_router.get("/deals/{deal_id}/offers")
+async def get_deal_offers(
+    deal_id: str,
+    response: Response,
+    before: Optional[str] = None,
+    limit: int = DEAL_OFFERS_PAGE_SIZE,
+    current_user: User = Depends(require_partner)
+):
+    """Page through a deal's offer history, newest first.
+    
+    Pass the X-Next-Cursor value from a previous response as `before` to fetch older offers.
+    """
+    deal = await db.deals.find_one(
+        {"deal_id": deal_id, "partner_id": current_user.user_id},
+        {"_id": 0, "deal_id": 1}
+    )
+    if not deal:
+        raise HTTPException(status_code=404, detail="Deal not found")
+    
+    limit = min(max(limit, 1), DEAL_OFFERS_PAGE_SIZE)
+    query = {"deal_id": deal_id}
+    if before:
+        before_ts, before_id = decode_sync_cursor(before)
+        query["$or"] = [
+            {"timestamp": {"$lt": before_ts}},
+            {"timestamp": before_ts, "offer_id": {"$lt": before_id}}
+        ]
+    
+    # Fetch one extra to know whether older offers remain
+    offers = await db.deal_offers.find(
+        query,
+        {"_id": 0, "deal_id": 0}
+    ).sort([("timestamp", -1), ("offer_id", -1)]).to_list(limit + 1)
+    
+    if len(offers) > limit:
+        offers = offers[:limit]
+        response.headers["X-Next-Cursor"] = encode_sync_cursor(offers[-1]["timestamp"], offers[-1]["offer_id"])
+    return {"offers": offers, "count": len(offers)}
+
+
 @api_router.post("/deals/{deal_id}/send-offer")
 async def send_deal_offer(deal_id: str, data: DealOffer, current_user: User = Depends(require_partner)):
     """Send an offer for a deal (as partner)"""
     deal = await db.deals.find_one(
         {"deal_id": deal_id, "partner_id": current_user.user_id},
-        {"_id": 0}
+        {"_id": 0, "status": 1, "room_id": 1, "offer_count": 1, "offers.type": 1}
     )
     if not deal:
         raise HTTPException(status_code=404, detail="Deal not found")
@@ -1368,27 +3184,28 @@ async def send_deal_offer(deal_id: str, data: DealOffer, current_user: User = De
         raise HTTPException(status_code=400, detail="Deal is no longer open for negotiation")
     
     # Add offer to history
-    new_offer = {
-        "from": "partner",
-        "price": data.price,
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-        "type": "counter" if len(deal.get("offers", [])) > 1 else "initial"
-    }
+    offer_count = deal.get("offer_count", len(deal.get("offers", [])))
+    last_offer = await record_deal_offer(
+        deal_id, "partner", "counter" if offer_count > 1 else "initial", data
+    )
     
-    await db.deals.update_one(
-        {"deal_id": deal_id},
-        {
-            "$set": {
-                "current_price": data.price,
-                "scheduled_date": data.scheduled_date,
-                "scheduled_time": data.scheduled_time,
-                "notes": data.notes,
-                "status": "negotiating",
-                "updated_at": datetime.now(timezone.utc)
-            },
-            "$push": {"offers": new_offer}
+    update = {
+        "$set": {
+            "current_price": data.price,
+            "scheduled_date": data.scheduled_date,
+            "scheduled_time": data.scheduled_time,
+            "notes": data.notes,
+            "status": "negotiating",
+            "last_offer": last_offer,
+            "updated_at": datetime.now(timezone.utc)
         }
-    )
+    }
+    if "offer_count" in deal:
+        update["$inc"] = {"offer_count": 1}
+    else:
+        # Deal from before offer_count existed (and not yet backfilled)
+        update["$set"]["offer_count"] = offer_count + 1
+    await db.deals.update_one({"deal_id": deal_id}, update)
     
     # Send message in chat
     offer_message = {
@@ -1408,215 +3225,159 @@ async def send_deal_offer(deal_id: str, data: DealOffer, current_user: User = De
     return {"message": "Offer sent", "deal_id": deal_id, "new_price": data.price}
 
 
-@api_router.post("/deals/{deal_id}/accept")
-async def accept_deal(deal_id: str, current_user: User = Depends(require_partner)):
-    """Partner accepts the current deal terms"""
-    deal = await db.deals.find_one(
-        {"deal_id": deal_id, "partner_id": current_user.user_id},
-        {"_id": 0}
-    )
-    if not deal:
-        raise HTTPException(status_code=404, detail="Deal not found")
-    
-    if deal["status"] not in ["pending", "negotiating"]:
-        raise HTTPException(status_code=400, detail="Deal cannot be accepted in current state")
-    
-    await db.deals.update_one(
-        {"deal_id": deal_id},
-        {
-            "$set": {
-                "status": "accepted",
-                "accepted_at": datetime.now(timezone.utc),
-                "updated_at": datetime.now(timezone.utc)
-            }
-        }
-    )
-    
-    # Update chat room status
-    await db.chat_rooms.update_one(
-        {"room_id": deal["room_id"]},
-        {"$set": {"status": "accepted"}}
-    )
-    
-    # Send confirmation message
-    confirmation_message = {
-        "message_id": f"msg_{uuid.uuid4().hex[:12]}",
-        "room_id": deal["room_id"],
-        "sender_id": current_user.user_id,
-        "sender_type": "partner",
-        "content": f"✅ Deal Accepted!\n\nI'll be there as scheduled. Looking forward to helping you!",
-        "created_at": datetime.now(timezone.utc)
-    }
-    await db.messages.insert_one(confirmation_message)
-    
-    logger.info(f"✅ Deal {deal_id} accepted by partner {current_user.user_id}")
-    
-    return {"message": "Deal accepted", "deal_id": deal_id, "status": "accepted"}
-
-
-@api_router.post("/deals/{deal_id}/reject")
-async def reject_deal(deal_id: str, current_user: User = Depends(require_partner)):
-    """Partner rejects the deal"""
-    deal = await db.deals.find_one(
-        {"deal_id": deal_id, "partner_id": current_user.user_id},
-        {"_id": 0}
-    )
-    if not deal:
-        raise HTTPException(status_code=404, detail="Deal not found")
-    
-    if deal["status"] not in ["pending", "negotiating"]:
-        raise HTTPException(status_code=400, detail="Deal cannot be rejected in current state")
-    
-    await db.deals.update_one(
-        {"deal_id": deal_id},
-        {
-            "$set": {
-                "status": "rejected",
-                "rejected_at": datetime.now(timezone.utc),
-                "updated_at": datetime.now(timezone.utc)
-            }
-        }
-    )
-    
-    # Update chat room status
-    await db.chat_rooms.update_one(
-        {"room_id": deal["room_id"]},
-        {"$set": {"status": "rejected"}}
-    )
-    
-    # Send rejection message
-    rejection_message = {
-        "message_id": f"msg_{uuid.uuid4().hex[:12]}",
-        "room_id": deal["room_id"],
-        "sender_id": current_user.user_id,
-        "sender_type": "partner",
-        "content": f"❌ I apologize, but I cannot take this job at the moment. Thank you for understanding.",
-        "created_at": datetime.now(timezone.utc)
-    }
-    await db.messages.insert_one(rejection_message)
-    
-    logger.info(f"❌ Deal {deal_id} rejected by partner {current_user.user_id}")
-    
-    return {"message": "Deal rejected", "deal_id": deal_id, "status": "rejected"}
-
-
-@api_router.post("/deals/{deal_id}/start")
-async def start_deal_job(deal_id: str, current_user: User = Depends(require_partner)):
-    """Partner starts working on the deal"""
-    deal = await db.deals.find_one(
-        {"deal_id": deal_id, "partner_id": current_user.user_id},
-        {"_id": 0}
-    )
-    if not deal:
-        raise HTTPException(status_code=404, detail="Deal not found")
-    
-    if deal["status"] != "accepted":
-        raise HTTPException(status_code=400, detail="Deal must be accepted before starting")
-    
-    await db.deals.update_one(
-        {"deal_id": deal_id},
-        {
-            "$set": {
-                "status": "in_progress",
-                "started_at": datetime.now(timezone.utc),
-                "updated_at": datetime.now(timezone.utc)
-            }
-        }
-    )
+# action -> allowed source statuses, target status, timestamp field, error detail and chat message
+DEAL_TRANSITIONS = {
+    "accept": {
+        "from": ("pending", "negotiating"),
+        "to": "accepted",
+        "timestamp_field": "accepted_at",
+        "error": "Deal cannot be accepted in current state",
+        "content": "✅ Deal Accepted!\n\nI'll be there as scheduled. Looking forward to helping you!",
+    },
+    "reject": {
+        "from": ("pending", "negotiating"),
+        "to": "rejected",
+        "timestamp_field": "rejected_at",
+        "error": "Deal cannot be rejected in current state",
+        "content": "❌ I apologize, but I cannot take this job at the moment. Thank you for understanding.",
+    },
+    "start": {
+        "from": ("accepted",),
+        "to": "in_progress",
+        "timestamp_field": "started_at",
+        "error": "Deal must be accepted before starting",
+        "content": "🚀 Job Started! I'm now working on your request.",
+    },
+    "complete": {
+        "from": ("in_progress",),
+        "to": "completed",
+        "timestamp_field": "completed_at",
+        "error": "Job must be in progress to complete",
+        "content": "🎉 Job Completed! Thank you for choosing my services. I hope you're satisfied with the work!",
+    },
+}
+
+async def apply_deal_transition(deal_id: str, action: str, current_user: User) -> dict:
+    """Move a partner's deal through one lifecycle step.
+    
+    The status change is a single guarded find_one_and_update, so concurrent clicks
+    cannot both succeed. The chat room status, system message and any side effects
+    are then written concurrently and the change is pushed to sockets in the room.
+    Returns the deal as it was before the change.
+    """
+    spec = DEAL_TRANSITIONS[action]
+    now = datetime.now(timezone.utc)
     
-    # Update chat room status
-    await db.chat_rooms.update_one(
-        {"room_id": deal["room_id"]},
-        {"$set": {"status": "in_progress"}}
+    deal = await db.deals.find_one_and_update(
+        {
+            "deal_id": deal_id,
+            "partner_id": current_user.user_id,
+            "status": {"$in": list(spec["from"])}
+        },
+        {"$set": {
+            "status": spec["to"],
+            spec["timestamp_field"]: now,
+            "updated_at": now
+        }},
+        projection={"_id": 0, "deal_id": 1, "room_id": 1, "current_price": 1, "status": 1},
+        return_document=ReturnDocument.BEFORE
     )
+    if not deal:
+        exists = await db.deals.find_one(
+            {"deal_id": deal_id, "partner_id": current_user.user_id},
+            {"_id": 0, "deal_id": 1}
+        )
+        if not exists:
+            raise HTTPException(status_code=404, detail="Deal not found")
+        raise HTTPException(status_code=400, detail=spec["error"])
     
-    # Send message
-    start_message = {
+    message = {
         "message_id": f"msg_{uuid.uuid4().hex[:12]}",
         "room_id": deal["room_id"],
         "sender_id": current_user.user_id,
         "sender_type": "partner",
-        "content": f"🚀 Job Started! I'm now working on your request.",
-        "created_at": datetime.now(timezone.utc)
+        "content": spec["content"],
+        "created_at": now
     }
-    await db.messages.insert_one(start_message)
+    writes = [
+        db.chat_rooms.update_one({"room_id": deal["room_id"]}, {"$set": {"status": spec["to"]}}),
+        db.messages.insert_one(message),
+    ]
+    if action == "complete":
+        amount = deal.get("current_price", 0)
+        writes.append(db.earnings.insert_one({
+            "earning_id": f"earn_{uuid.uuid4().hex[:12]}",
+            "partner_id": current_user.user_id,
+            "deal_id": deal_id,
+            "amount": amount,
+            "type": "service",
+            "description": f"Deal #{deal_id[-6:]} completed",
+            "created_at": now
+        }))
+        writes.append(db.users.update_one(
+            {"user_id": current_user.user_id},
+            {"$inc": {"partner_total_tasks": 1, "partner_total_earnings": amount}}
+        ))
+    # Different collections, so these cannot share one bulk_write; run them side by side instead
+    await asyncio.gather(*writes)
+    
+    # Fire and forget, like order pushes: a slow chat socket must not hold up the button
+    manager.publish({
+        "type": "new_message",
+        "message": {
+            "message_id": message["message_id"],
+            "sender_id": message["sender_id"],
+            "sender_type": message["sender_type"],
+            "content": message["content"],
+            "created_at": now.isoformat()
+        }
+    }, deal["room_id"])
+    manager.publish({
+        "type": "deal_status",
+        "deal_id": deal_id,
+        "status": spec["to"],
+        "previous_status": deal["status"],
+        "updated_at": now.isoformat()
+    }, deal["room_id"])
     
+    return deal
+
+
+@api_router.post("/deals/{deal_id}/accept")
+async def accept_deal(deal_id: str, current_user: User = Depends(require_partner)):
+    """Partner accepts the current deal terms"""
+    await apply_deal_transition(deal_id, "accept", current_user)
+    logger.info(f"✅ Deal {deal_id} accepted by partner {current_user.user_id}")
+    return {"message": "Deal accepted", "deal_id": deal_id, "status": "accepted"}
+
+
+@api_router.post("/deals/{deal_id}/reject")
+async def reject_deal(deal_id: str, current_user: User = Depends(require_partner)):
+    """Partner rejects the deal"""
+    await apply_deal_transition(deal_id, "reject", current_user)
+    logger.info(f"❌ Deal {deal_id} rejected by partner {current_user.user_id}")
+    return {"message": "Deal rejected", "deal_id": deal_id, "status": "rejected"}
+
+
+@api_router.post("/deals/{deal_id}/start")
+async def start_deal_job(deal_id: str, current_user: User = Depends(require_partner)):
+    """Partner starts working on the deal"""
+    await apply_deal_transition(deal_id, "start", current_user)
     logger.info(f"🚀 Job started for deal {deal_id}")
-    
     return {"message": "Job started", "deal_id": deal_id, "status": "in_progress"}
 
 
 @api_router.post("/deals/{deal_id}/complete")
 async def complete_deal_job(deal_id: str, current_user: User = Depends(require_partner)):
     """Partner marks the deal as completed"""
-    deal = await db.deals.find_one(
-        {"deal_id": deal_id, "partner_id": current_user.user_id},
-        {"_id": 0}
-    )
-    if not deal:
-        raise HTTPException(status_code=404, detail="Deal not found")
-    
-    if deal["status"] != "in_progress":
-        raise HTTPException(status_code=400, detail="Job must be in progress to complete")
-    
-    await db.deals.update_one(
-        {"deal_id": deal_id},
-        {
-            "$set": {
-                "status": "completed",
-                "completed_at": datetime.now(timezone.utc),
-                "updated_at": datetime.now(timezone.utc)
-            }
-        }
-    )
-    
-    # Update chat room status
-    await db.chat_rooms.update_one(
-        {"room_id": deal["room_id"]},
-        {"$set": {"status": "completed"}}
-    )
-    
-    # Record earnings
-    earning = {
-        "earning_id": f"earn_{uuid.uuid4().hex[:12]}",
-        "partner_id": current_user.user_id,
-        "deal_id": deal_id,
-        "amount": deal.get("current_price", 0),
-        "type": "service",
-        "description": f"Deal #{deal_id[-6:]} completed",
-        "created_at": datetime.now(timezone.utc)
-    }
-    await db.earnings.insert_one(earning)
-    
-    # Update partner stats
-    await db.users.update_one(
-        {"user_id": current_user.user_id},
-        {
-            "$inc": {
-                "partner_total_tasks": 1,
-                "partner_total_earnings": deal.get("current_price", 0)
-            }
-        }
-    )
-    
-    # Send completion message
-    complete_message = {
-        "message_id": f"msg_{uuid.uuid4().hex[:12]}",
-        "room_id": deal["room_id"],
-        "sender_id": current_user.user_id,
-        "sender_type": "partner",
-        "content": f"🎉 Job Completed! Thank you for choosing my services. I hope you're satisfied with the work!",
-        "created_at": datetime.now(timezone.utc)
-    }
-    await db.messages.insert_one(complete_message)
-    
-    logger.info(f"🎉 Deal {deal_id} completed, earnings: ₹{deal.get('current_price', 0)}")
-    
+    deal = await apply_deal_transition(deal_id, "complete", current_user)
+    earnings = deal.get("current_price", 0)
+    logger.info(f"🎉 Deal {deal_id} completed, earnings: ₹{earnings}")
     return {
         "message": "Job completed successfully",
         "deal_id": deal_id,
         "status": "completed",
-        "earnings": deal.get("current_price", 0)
+        "earnings": earnings
     }
 
 
@@ -1627,16 +3388,114 @@ class AppointmentCreate(BaseModel):
     wish_id: Optional[str] = None
     service_title: str
     customer_name: str
-    scheduled_date: str
-    scheduled_time: Optional[str] = None
+    scheduled_date: str  # YYYY-MM-DD, in APPOINTMENT_TZ
+    scheduled_time: Optional[str] = None  # e.g. "14:30" or "2:30 PM"; omitted for all-day
+    duration_minutes: int = 60
     location: str
     price: float
     notes: Optional[str] = None
 
+# Wall-clock dates and times from the app are interpreted in this zone; start/end are stored in UTC
+APPOINTMENT_TZ = ZoneInfo(os.environ.get("APPOINTMENT_TZ", "Asia/Kolkata"))
+APPOINTMENT_MAX_DURATION = timedelta(hours=12)
+# Longest entry of any kind: an all-day block (a local day, 25h across a DST change)
+APPOINTMENT_LONGEST_SPAN = timedelta(hours=25)
+APPOINTMENT_TIME_FORMATS = ("%H:%M", "%I:%M %p", "%I:%M%p", "%I %p", "%I%p")
+APPOINTMENT_ACTIVE_STATUSES = ["upcoming", "in_progress"]
+APPOINTMENT_CALENDAR_MAX_DAYS = 62
+
+APPOINTMENT_LIST_PROJECTION = {
+    "_id": 0,
+    "appointment_id": 1,
+    "deal_id": 1,
+    "wish_id": 1,
+    "service_title": 1,
+    "customer_name": 1,
+    "scheduled_date": 1,
+    "scheduled_time": 1,
+    "start": 1,
+    "end": 1,
+    "duration_minutes": 1,
+    "all_day": 1,
+    "location": 1,
+    "price": 1,
+    "notes": 1,
+    "status": 1,
+    "created_at": 1,
+    "updated_at": 1,
+}
+
+def parse_appointment_window(scheduled_date: str, scheduled_time: Optional[str], duration_minutes: int) -> dict:
+    """Turn the app's date/time strings into UTC start/end datetimes"""
+    try:
+        day = datetime.strptime(scheduled_date.strip(), "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="scheduled_date must be YYYY-MM-DD")
+    
+    if not scheduled_time:
+        start = datetime.combine(day, datetime.min.time(), APPOINTMENT_TZ)
+        return {
+            "start": start.astimezone(timezone.utc),
+            "end": (start + timedelta(days=1)).astimezone(timezone.utc),
+            "duration_minutes": 24 * 60,
+            "all_day": True
+        }
+    
+    if not 1 <= duration_minutes <= APPOINTMENT_MAX_DURATION.total_seconds() // 60:
+        raise HTTPException(status_code=400, detail="duration_minutes must be between 1 and 720")
+    for fmt in APPOINTMENT_TIME_FORMATS:
+        try:
+            clock = datetime.strptime(scheduled_time.strip().upper(), fmt).time()
+            break
+        except ValueError:
+            continue
+    else:
+        raise HTTPException(status_code=400, detail="scheduled_time must look like 14:30 or 2:30 PM")
+    
+    start = datetime.combine(day, clock, APPOINTMENT_TZ).astimezone(timezone.utc)
+    return {
+        "start": start,
+        "end": start + timedelta(minutes=duration_minutes),
+        "duration_minutes": duration_minutes,
+        "all_day": False
+    }
+
+async def find_appointment_conflict(partner_id: str, start: datetime, end: datetime, exclude_id: Optional[str] = None) -> Optional[dict]:
+    """First active appointment of the partner overlapping [start, end).
+    
+    All-day entries block their whole day. Nothing is longer than
+    APPOINTMENT_LONGEST_SPAN, so anything overlapping must start after start minus
+    that; the bound keeps the (partner_id, start) index scan to a small range.
+    """
+    query = {
+        "partner_id": partner_id,
+        "start": {"$gt": start - APPOINTMENT_LONGEST_SPAN, "$lt": end},
+        "end": {"$gt": start},
+        "status": {"$in": APPOINTMENT_ACTIVE_STATUSES}
+    }
+    if exclude_id:
+        query["appointment_id"] = {"$ne": exclude_id}
+    return await db.appointments.find_one(
+        query,
+        {"_id": 0, "appointment_id": 1, "service_title": 1, "start": 1, "end": 1}
+    )
+
+def appointment_conflict_error(conflict: dict) -> HTTPException:
+    local_start = conflict["start"].replace(tzinfo=timezone.utc).astimezone(APPOINTMENT_TZ)
+    return HTTPException(
+        status_code=409,
+        detail=f"Overlaps with '{conflict.get('service_title')}' at {local_start.strftime('%Y-%m-%d %H:%M')}"
+    )
+
 @api_router.post("/appointments")
 async def create_appointment(data: AppointmentCreate, current_user: User = Depends(require_partner)):
     """Create a new appointment from a confirmed deal"""
     
+    window = parse_appointment_window(data.scheduled_date, data.scheduled_time, data.duration_minutes)
+    conflict = await find_appointment_conflict(current_user.user_id, window["start"], window["end"])
+    if conflict:
+        raise appointment_conflict_error(conflict)
+    
     appointment_id = f"apt_{uuid.uuid4().hex[:12]}"
     
     appointment_doc = {
@@ -1648,6 +3507,7 @@ async def create_appointment(data: AppointmentCreate, current_user: User = Depen
         "customer_name": data.customer_name,
         "scheduled_date": data.scheduled_date,
         "scheduled_time": data.scheduled_time,
+        **window,
         "location": data.location,
         "price": data.price,
         "notes": data.notes,
@@ -1658,6 +3518,14 @@ async def create_appointment(data: AppointmentCreate, current_user: User = Depen
     
     await db.appointments.insert_one(appointment_doc)
     
+    # Two concurrent creates can both pass the check above; re-check now that ours is
+    # visible and back out if anything overlaps, so the partner is never double-booked
+    conflict = await find_appointment_conflict(current_user.user_id, window["start"], window["end"], exclude_id=appointment_id)
+    if conflict:
+        await db.appointments.delete_one({"appointment_id": appointment_id})
+        raise appointment_conflict_error(conflict)
+    invalidate_partner_availability(current_user.user_id, window["start"], window["end"])
+    
     logger.info(f"📅 Appointment created: {appointment_id} for {current_user.user_id}")
     
     return {
@@ -1668,6 +3536,8 @@ async def create_appointment(data: AppointmentCreate, current_user: User = Depen
             "service_title": data.service_title,
             "scheduled_date": data.scheduled_date,
             "scheduled_time": data.scheduled_time,
+            "start": window["start"],
+            "end": window["end"],
             "location": data.location,
             "price": data.price,
         }
@@ -1681,37 +3551,87 @@ async def get_appointments(status: Optional[str] = None, current_user: User = De
     if status:
         query["status"] = status
     
-    appointments = await db.appointments.find(query, {"_id": 0}).sort("created_at", -1).to_list(100)
-    
-    # Convert datetime objects
-    for apt in appointments:
-        for key in ["created_at", "updated_at"]:
-            if key in apt and apt[key]:
-                apt[key] = apt[key].isoformat() if hasattr(apt[key], 'isoformat') else str(apt[key])
+    appointments = await db.appointments.find(query, APPOINTMENT_LIST_PROJECTION).sort("created_at", -1).to_list(100)
+    return ORJSONResponse({"appointments": appointments, "count": len(appointments)})
+
+
+@api_router.get("/appointments/calendar")
+async def get_appointment_calendar(
+    start: datetime,
+    end: datetime,
+    include_cancelled: bool = False,
+    current_user: User = Depends(require_partner)
+):
+    """Appointments overlapping [start, end), ordered by start time (for day/week views).
     
-    return {"appointments": appointments, "count": len(appointments)}
+    start/end without a UTC offset are read as APPOINTMENT_TZ wall-clock times.
+    """
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=APPOINTMENT_TZ)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=APPOINTMENT_TZ)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    if end - start > timedelta(days=APPOINTMENT_CALENDAR_MAX_DAYS):
+        raise HTTPException(status_code=400, detail=f"Range cannot exceed {APPOINTMENT_CALENDAR_MAX_DAYS} days")
+    
+    # All-day entries span a full day, so widen the lower bound to catch them too
+    query = {
+        "partner_id": current_user.user_id,
+        "start": {"$gt": start - APPOINTMENT_LONGEST_SPAN, "$lt": end},
+        "end": {"$gt": start}
+    }
+    if not include_cancelled:
+        query["status"] = {"$ne": "cancelled"}
+    
+    appointments = await db.appointments.find(query, APPOINTMENT_LIST_PROJECTION).sort("start", 1).to_list(1000)
+    return ORJSONResponse({
+        "appointments": appointments,
+        "count": len(appointments),
+        "timezone": str(APPOINTMENT_TZ)
+    })
 
 
 @api_router.put("/appointments/{appointment_id}")
 async def update_appointment(appointment_id: str, data: AppointmentCreate, current_user: User = Depends(require_partner)):
     """Update an appointment"""
     
-    result = await db.appointments.update_one(
+    window = parse_appointment_window(data.scheduled_date, data.scheduled_time, data.duration_minutes)
+    conflict = await find_appointment_conflict(current_user.user_id, window["start"], window["end"], exclude_id=appointment_id)
+    if conflict:
+        raise appointment_conflict_error(conflict)
+    
+    previous = await db.appointments.find_one_and_update(
         {"appointment_id": appointment_id, "partner_id": current_user.user_id},
         {
             "$set": {
                 "scheduled_date": data.scheduled_date,
                 "scheduled_time": data.scheduled_time,
+                **window,
                 "location": data.location,
                 "notes": data.notes,
                 "updated_at": datetime.now(timezone.utc)
             }
-        }
+        },
+        projection={"_id": 0, "scheduled_date": 1, "scheduled_time": 1, "start": 1, "end": 1, "duration_minutes": 1, "all_day": 1},
+        return_document=ReturnDocument.BEFORE
     )
     
-    if result.matched_count == 0:
+    if previous is None:
         raise HTTPException(status_code=404, detail="Appointment not found")
     
+    # Same race as in create: if a concurrent write overlaps, put the old slot back
+    conflict = await find_appointment_conflict(current_user.user_id, window["start"], window["end"], exclude_id=appointment_id)
+    if conflict:
+        revert = {"$set": previous}
+        added = [key for key in window if key not in previous]
+        if added:
+            revert["$unset"] = {key: "" for key in added}
+        await db.appointments.update_one({"appointment_id": appointment_id}, revert)
+        raise appointment_conflict_error(conflict)
+    invalidate_partner_availability(current_user.user_id, previous.get("start"), previous.get("end"))
+    invalidate_partner_availability(current_user.user_id, window["start"], window["end"])
+    
     logger.info(f"📅 Appointment updated: {appointment_id}")
     
     return {"message": "Appointment updated", "appointment_id": appointment_id}
@@ -1721,64 +3641,261 @@ async def update_appointment(appointment_id: str, data: AppointmentCreate, curre
 async def cancel_appointment(appointment_id: str, current_user: User = Depends(require_partner)):
     """Cancel an appointment"""
     
-    result = await db.appointments.update_one(
+    appointment = await db.appointments.find_one_and_update(
         {"appointment_id": appointment_id, "partner_id": current_user.user_id},
-        {"$set": {"status": "cancelled", "updated_at": datetime.now(timezone.utc)}}
+        {"$set": {"status": "cancelled", "updated_at": datetime.now(timezone.utc)}},
+        projection={"_id": 0, "start": 1, "end": 1}
     )
     
-    if result.matched_count == 0:
+    if appointment is None:
         raise HTTPException(status_code=404, detail="Appointment not found")
+    invalidate_partner_availability(current_user.user_id, appointment.get("start"), appointment.get("end"))
     
     logger.info(f"❌ Appointment cancelled: {appointment_id}")
     
     return {"message": "Appointment cancelled", "appointment_id": appointment_id}
 
 
+# ===================== PARTNER AVAILABILITY =====================
+
+AVAILABILITY_DAY_START_HOUR = int(os.environ.get("AVAILABILITY_DAY_START_HOUR", "9"))
+AVAILABILITY_DAY_END_HOUR = int(os.environ.get("AVAILABILITY_DAY_END_HOUR", "21"))
+AVAILABILITY_MAX_DAYS = 14
+AVAILABILITY_MAX_PARTNERS = 200
+
+# (partner_id, local date) -> merged busy intervals [(start, end), ...] in UTC
+partner_busy_cache = LocalCache(maxsize=50000, ttl=300)
+
+class AvailabilityQuery(BaseModel):
+    partner_ids: List[str]
+    date_from: Optional[str] = None  # YYYY-MM-DD in APPOINTMENT_TZ, defaults to today
+    days: int = 7
+    min_minutes: int = 60
+
+def local_day_bounds(day) -> tuple:
+    """UTC start/end of a calendar day in APPOINTMENT_TZ"""
+    start = datetime.combine(day, datetime.min.time(), APPOINTMENT_TZ)
+    return start.astimezone(timezone.utc), (start + timedelta(days=1)).astimezone(timezone.utc)
+
+def merge_intervals(intervals: List[tuple]) -> List[tuple]:
+    """Merge (start, end) intervals that are sorted by start"""
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def invalidate_partner_availability(partner_id: str, start: Optional[datetime], end: Optional[datetime]):
+    """Drop cached busy intervals for every local day an appointment touches"""
+    if not start or not end:
+        return
+    if start.tzinfo is None:
+        start, end = start.replace(tzinfo=timezone.utc), end.replace(tzinfo=timezone.utc)
+    day = start.astimezone(APPOINTMENT_TZ).date()
+    last_day = (end - timedelta(microseconds=1)).astimezone(APPOINTMENT_TZ).date()
+    while day <= last_day:
+        partner_busy_cache.invalidate((partner_id, day))
+        day += timedelta(days=1)
+
+async def get_busy_intervals(partner_ids: List[str], days: List) -> Dict[tuple, List[tuple]]:
+    """Merged busy intervals per (partner_id, day), loading every cache miss with one query"""
+    busy = {}
+    missing = []
+    for partner_id in partner_ids:
+        for day in days:
+            cached = partner_busy_cache.get((partner_id, day))
+            if cached is None:
+                missing.append((partner_id, day))
+            else:
+                busy[(partner_id, day)] = cached
+    if not missing:
+        return busy
+    
+    missing_partners = list({partner_id for partner_id, _ in missing})
+    range_start = local_day_bounds(min(day for _, day in missing))[0]
+    range_end = local_day_bounds(max(day for _, day in missing))[1]
+    appointments = await db.appointments.find(
+        {
+            "partner_id": {"$in": missing_partners},
+            "start": {"$gt": range_start - APPOINTMENT_LONGEST_SPAN, "$lt": range_end},
+            "end": {"$gt": range_start},
+            "status": {"$in": APPOINTMENT_ACTIVE_STATUSES}
+        },
+        {"_id": 0, "partner_id": 1, "start": 1, "end": 1}
+    ).sort([("partner_id", 1), ("start", 1)]).to_list(None)
+    
+    by_partner: Dict[str, List[tuple]] = {}
+    for apt in appointments:
+        by_partner.setdefault(apt["partner_id"], []).append(
+            (apt["start"].replace(tzinfo=timezone.utc), apt["end"].replace(tzinfo=timezone.utc))
+        )
+    
+    for partner_id, day in missing:
+        day_start, day_end = local_day_bounds(day)
+        intervals = merge_intervals([
+            (max(start, day_start), min(end, day_end))
+            for start, end in by_partner.get(partner_id, [])
+            if start < day_end and end > day_start
+        ])
+        partner_busy_cache.set((partner_id, day), intervals)
+        busy[(partner_id, day)] = intervals
+    return busy
+
+def free_slots_for_day(busy: List[tuple], day, min_minutes: int, now: datetime) -> List[dict]:
+    """Gaps of at least min_minutes between busy intervals within working hours"""
+    local_midnight = datetime.combine(day, datetime.min.time(), APPOINTMENT_TZ)
+    cursor = (local_midnight + timedelta(hours=AVAILABILITY_DAY_START_HOUR)).astimezone(timezone.utc)
+    work_end = (local_midnight + timedelta(hours=AVAILABILITY_DAY_END_HOUR)).astimezone(timezone.utc)
+    cursor = max(cursor, now)
+    min_gap = timedelta(minutes=min_minutes)
+    
+    slots = []
+    for start, end in busy:
+        if start >= work_end:
+            break
+        if start - cursor >= min_gap:
+            slots.append({"start": cursor, "end": start})
+        cursor = max(cursor, end)
+    if work_end - cursor >= min_gap:
+        slots.append({"start": cursor, "end": work_end})
+    return slots
+
+async def compute_availability(partner_ids: List[str], date_from: Optional[str], days: int, min_minutes: int) -> Dict[str, List[dict]]:
+    if not 1 <= days <= AVAILABILITY_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {AVAILABILITY_MAX_DAYS}")
+    if not 1 <= min_minutes <= 24 * 60:
+        raise HTTPException(status_code=400, detail="min_minutes must be between 1 and 1440")
+    if len(partner_ids) > AVAILABILITY_MAX_PARTNERS:
+        raise HTTPException(status_code=400, detail=f"At most {AVAILABILITY_MAX_PARTNERS} partners per request")
+    
+    now = datetime.now(timezone.utc)
+    if date_from:
+        try:
+            first_day = datetime.strptime(date_from, "%Y-%m-%d").date()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="date_from must be YYYY-MM-DD")
+    else:
+        first_day = now.astimezone(APPOINTMENT_TZ).date()
+    day_list = [first_day + timedelta(days=i) for i in range(days)]
+    
+    partner_ids = list(dict.fromkeys(partner_ids))
+    busy = await get_busy_intervals(partner_ids, day_list)
+    return {
+        partner_id: [
+            {
+                "date": day.isoformat(),
+                "slots": free_slots_for_day(busy[(partner_id, day)], day, min_minutes, now)
+            }
+            for day in day_list
+        ]
+        for partner_id in partner_ids
+    }
+
+@api_router.get("/partners/{partner_id}/availability")
+async def get_partner_availability(
+    partner_id: str,
+    date_from: Optional[str] = None,
+    days: int = 7,
+    min_minutes: int = 60,
+    current_user: User = Depends(require_auth)
+):
+    """Free slots of at least min_minutes within working hours for each day in the range"""
+    availability = await compute_availability([partner_id], date_from, days, min_minutes)
+    return {"partner_id": partner_id, "days": availability[partner_id], "timezone": str(APPOINTMENT_TZ)}
+
+@api_router.post("/availability/batch")
+async def get_batch_availability(data: AvailabilityQuery, current_user: User = Depends(require_auth)):
+    """Free slots for many partners at once (e.g. ranking skilled genies for a wish)"""
+    availability = await compute_availability(data.partner_ids, data.date_from, data.days, data.min_minutes)
+    return {"availability": availability, "timezone": str(APPOINTMENT_TZ)}
+
+
 # ===================== CHAT ENDPOINTS (SHARED) =====================
 
+CHAT_ROOM_PROJECTION = {
+    "_id": 0,
+    "room_id": 1,
+    "wish_id": 1,
+    "wisher_id": 1,
+    "partner_id": 1,
+    "deal_id": 1,
+    "wish_title": 1,
+    "status": 1,
+    "created_at": 1,
+}
+
+CHAT_MESSAGE_PROJECTION = {
+    "_id": 0,
+    "message_id": 1,
+    "room_id": 1,
+    "sender_id": 1,
+    "sender_type": 1,
+    "content": 1,
+    "created_at": 1,
+}
+
+async def get_last_messages(room_ids: List[str]) -> Dict[str, dict]:
+    """Latest message per room, for many rooms in one aggregate"""
+    if not room_ids:
+        return {}
+    pipeline = [
+        {"$match": {"room_id": {"$in": room_ids}}},
+        {"$sort": {"room_id": 1, "created_at": -1}},
+        {"$group": {"_id": "$room_id", "message": {"$first": "$$ROOT"}}},
+    ]
+    latest = await db.messages.aggregate(pipeline).to_list(len(room_ids))
+    return {
+        entry["_id"]: {key: entry["message"].get(key) for key in CHAT_MESSAGE_PROJECTION if key != "_id"}
+        for entry in latest
+    }
+
 @api_router.get("/partner/chat/rooms")
 async def get_partner_chat_rooms(current_user: User = Depends(require_partner)):
     """Get chat rooms for partner"""
     rooms = await db.chat_rooms.find(
         {"partner_id": current_user.user_id},
-        {"_id": 0}
+        CHAT_ROOM_PROJECTION
     ).sort("created_at", -1).to_list(100)
     
+    wish_ids = [room["wish_id"] for room in rooms]
+    wish_docs, profiles, last_messages = await asyncio.gather(
+        db.wishes.find({"wish_id": {"$in": wish_ids}}, {"_id": 0}).to_list(len(wish_ids)),
+        get_user_profiles([room["wisher_id"] for room in rooms]),
+        get_last_messages([room["room_id"] for room in rooms]),
+    )
+    wishes = {wish["wish_id"]: wish for wish in wish_docs}
+    
     enriched_rooms = []
     for room in rooms:
-        wish = await db.wishes.find_one({"wish_id": room["wish_id"]}, {"_id": 0})
-        wisher = await db.users.find_one({"user_id": room["wisher_id"]}, {"_id": 0, "name": 1, "picture": 1})
-        
-        last_messages = await db.messages.find(
-            {"room_id": room["room_id"]},
-            {"_id": 0}
-        ).sort("created_at", -1).limit(1).to_list(1)
-        
+        wisher = profiles.get(room["wisher_id"])
         enriched_rooms.append({
             **room,
-            "wish": wish,
-            "wisher": wisher,
-            "last_message": last_messages[0] if last_messages else None
+            "wish": wishes.get(room["wish_id"]),
+            "wisher": {"name": wisher.get("name"), "picture": wisher.get("picture")} if wisher else None,
+            "last_message": last_messages.get(room["room_id"])
         })
     
-    return enriched_rooms
+    return ORJSONResponse(enriched_rooms)
 
 @api_router.get("/partner/chat/rooms/{room_id}/messages")
 async def get_partner_chat_messages(room_id: str, current_user: User = Depends(require_partner)):
     """Get messages in a chat room"""
     room = await db.chat_rooms.find_one(
         {"room_id": room_id, "partner_id": current_user.user_id},
-        {"_id": 0}
+        {"_id": 0, "room_id": 1}
     )
     if not room:
         raise HTTPException(status_code=404, detail="Chat room not found")
     
     messages = await db.messages.find(
         {"room_id": room_id},
-        {"_id": 0}
+        CHAT_MESSAGE_PROJECTION
     ).sort("created_at", 1).to_list(500)
     
-    return messages
+    return ORJSONResponse(messages)
 
 @api_router.post("/partner/chat/rooms/{room_id}/messages")
 async def send_partner_message(room_id: str, msg: MessageCreate, current_user: User = Depends(require_partner)):
@@ -2232,6 +4349,8 @@ async def seed_chat_rooms(current_user: User = Depends(get_current_user)):
     ]
     
     created_rooms = []
+    room_writes = []
+    message_writes = []
     
     for i, (wisher, wish) in enumerate(zip(mock_wishers, mock_wishes)):
         room_id = f"room_{user_id}_{i+1}"
@@ -2251,11 +4370,7 @@ async def seed_chat_rooms(current_user: User = Depends(get_current_user)):
             "updated_at": datetime.now(timezone.utc)
         }
         
-        await db.chat_rooms.update_one(
-            {"room_id": room_id},
-            {"$set": chat_room},
-            upsert=True
-        )
+        room_writes.append(UpdateOne({"room_id": room_id}, {"$set": chat_room}, upsert=True))
         
         # Create sample messages
         sample_messages = [
@@ -2309,12 +4424,10 @@ async def seed_chat_rooms(current_user: User = Depends(get_current_user)):
             }
         ]
         
-        for msg in sample_messages:
-            await db.chat_messages.update_one(
-                {"message_id": msg["message_id"]},
-                {"$set": msg},
-                upsert=True
-            )
+        message_writes.extend(
+            UpdateOne({"message_id": msg["message_id"]}, {"$set": msg}, upsert=True)
+            for msg in sample_messages
+        )
         
         created_rooms.append({
             "room_id": room_id,
@@ -2323,91 +4436,228 @@ async def seed_chat_rooms(current_user: User = Depends(get_current_user)):
             "messages_count": len(sample_messages)
         })
     
+    await asyncio.gather(db.chat_rooms.bulk_write(room_writes), db.messages.bulk_write(message_writes))
+    
     return {
         "message": f"Created {len(created_rooms)} chat rooms with messages",
         "rooms": created_rooms
     }
 
 
+# These routes are unauthenticated, so they stay small; bulk data comes from
+# datagen.py and the benchmark scripts
+SEED_MAX_DOCUMENTS = 10
+
 @api_router.post("/seed/orders")
-async def seed_sample_orders():
-    """Seed sample orders for testing"""
-    vendors = [
-        {"vendor_id": "vendor_1", "name": "Fresh Mart Grocery", "address": "Shop 12, Central Market"},
-        {"vendor_id": "vendor_2", "name": "Biryani House", "address": "15, Food Street"},
-        {"vendor_id": "vendor_3", "name": "Sweet Treats Bakery", "address": "Sweet Corner, Main Road"},
-    ]
-    
-    orders = []
-    for i, vendor in enumerate(vendors):
-        order = {
-            "order_id": f"order_test_{uuid.uuid4().hex[:8]}",
-            "user_id": "test_customer",
-            "vendor_id": vendor["vendor_id"],
-            "vendor_name": vendor["name"],
-            "vendor_address": vendor["address"],
-            "items": [{"name": "Sample Item", "quantity": 2, "price": 150}],
-            "total_amount": 300,
-            "delivery_address": {
-                "address": f"Customer Address {i+1}, Block A, Sector 5",
-                "lat": 12.9716 + (i * 0.01),
-                "lng": 77.5946 + (i * 0.01)
-            },
-            "delivery_type": "agent_delivery",
-            "delivery_fee": 30 + (i * 10),
-            "assigned_agent_id": None,
-            "status": ["confirmed", "preparing", "ready"][i],
-            "status_history": [{"status": "confirmed", "timestamp": datetime.now(timezone.utc).isoformat()}],
-            "payment_status": "paid",
-            "created_at": datetime.now(timezone.utc)
-        }
-        orders.append(order)
-        await db.shop_orders.update_one(
-            {"order_id": order["order_id"]},
-            {"$set": order},
-            upsert=True
-        )
+async def seed_sample_orders(count: int = 3, seed: Optional[int] = None):
+    """Seed unassigned agent-delivery orders for testing (see datagen.py for bulk data)"""
+    count = max(1, min(count, SEED_MAX_DOCUMENTS))
+    generator = datagen.DataGenerator(seed=seed if seed is not None else random.randrange(2**32),
+                                      prefix=f"seed_{uuid.uuid4().hex[:8]}")
+    statuses = ["confirmed", "preparing", "ready"]
+    orders = [generator.order(i, status=statuses[i % 3], customer_id="test_customer") for i in range(count)]
+    await db.shop_orders.insert_many(orders)
     
     return {"message": f"Created {len(orders)} sample orders"}
 
 @api_router.post("/seed/wishes")
-async def seed_sample_wishes():
-    """Seed sample wishes for testing"""
-    wish_types = [
-        {"type": "delivery", "title": "Pick up groceries from local market", "remuneration": 100},
-        {"type": "medicine_delivery", "title": "Urgent medicine from pharmacy", "remuneration": 80},
-        {"type": "errands", "title": "Pay electricity bill at office", "remuneration": 50},
-        {"type": "ride_request", "title": "Need ride to airport", "remuneration": 500},
-    ]
+async def seed_sample_wishes(count: int = 4, seed: Optional[int] = None):
+    """Seed pending wishes for testing (see datagen.py for bulk data)"""
+    count = max(1, min(count, SEED_MAX_DOCUMENTS))
+    generator = datagen.DataGenerator(seed=seed if seed is not None else random.randrange(2**32),
+                                      prefix=f"seed_{uuid.uuid4().hex[:8]}")
+    wishes = [generator.wish(i, status="pending", user_id="test_wisher") for i in range(count)]
+    await db.wishes.insert_many(wishes)
     
-    wishes = []
-    for i, w in enumerate(wish_types):
-        wish = {
-            "wish_id": f"wish_test_{uuid.uuid4().hex[:8]}",
-            "user_id": "test_wisher",
-            "wish_type": w["type"],
-            "title": w["title"],
-            "description": f"Description for {w['title']}",
-            "location": {
-                "address": f"Location {i+1}, Sector {i+3}",
-                "lat": 12.9716 + (i * 0.005),
-                "lng": 77.5946 + (i * 0.005)
-            },
-            "radius_km": 5.0,
-            "remuneration": w["remuneration"],
-            "is_immediate": True,
-            "status": "pending",
-            "accepted_by": None,
-            "created_at": datetime.now(timezone.utc)
-        }
-        wishes.append(wish)
-        await db.wishes.update_one(
-            {"wish_id": wish["wish_id"]},
-            {"$set": wish},
-            upsert=True
+    return {"message": f"Created {len(wishes)} sample wishes"}
+
+# ===================== MEDIA STORE =====================
+
+# Images are stored once in GridFS, keyed by the SHA-256 of their bytes.
+# Documents keep only the media URL, never the image data itself.
+MEDIA_URL_PREFIX = "/api/media/"
+MEDIA_MAX_BYTES = 5 * 1024 * 1024
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+media_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="media")
+
+def is_media_ref(value: Optional[str]) -> bool:
+    return isinstance(value, str) and value.startswith(MEDIA_URL_PREFIX)
+
+async def store_media(data: bytes, content_type: str, digest: str) -> str:
+    """Store bytes in the media bucket (once per content hash) and return the hash"""
+    existing = await db["media.files"].find_one({"filename": digest}, {"_id": 1})
+    if not existing:
+        await media_bucket.upload_from_stream(digest, data, metadata={"content_type": content_type})
+    return digest
+
+async def offload_image(value: Optional[str]) -> Optional[str]:
+    """Replace an inline base64 image with a media reference.
+    
+    Existing media references and external URLs are returned unchanged.
+    """
+    if not value or is_media_ref(value) or value.startswith(("http://", "https://")):
+        return value
+    # Decoding and verifying the image is CPU-bound, keep it off the event loop
+    upload = await run_in_image_pool(imaging.decode_upload, value, MEDIA_MAX_BYTES)
+    if "error" in upload:
+        status_code, detail = upload["error"]
+        raise HTTPException(status_code=status_code, detail=detail)
+    digest = await store_media(upload["data"], upload["content_type"], upload["digest"])
+    return f"{MEDIA_URL_PREFIX}{digest}"
+
+async def offload_images(values: List[str]) -> List[str]:
+    return list(await asyncio.gather(*(offload_image(v) for v in values)))
+
+# ===================== IMAGE PROCESSING =====================
+
+# Resized variants are generated on first request at these fixed box sizes
+MEDIA_VARIANT_SIZES = (128, 256, 512, 1024)
+MEDIA_CACHE_DIR = Path(os.environ.get("MEDIA_CACHE_DIR", ROOT_DIR / "media_cache"))
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get("MEDIA_CACHE_MAX_MB", "512")) * 1024 * 1024
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+
+image_pool: Optional[ProcessPoolExecutor] = None
+
+def get_image_pool() -> ProcessPoolExecutor:
+    global image_pool
+    if image_pool is None:
+        # spawn keeps workers independent of the parent's Mongo client and threads
+        image_pool = ProcessPoolExecutor(
+            max_workers=IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
         )
+    return image_pool
+
+async def run_in_image_pool(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(get_image_pool(), fn, *args)
+
+class MediaVariantCache:
+    """LRU cache of resized images on local disk, bounded by total size"""
+    
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # filename -> size in bytes, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        # get/put run in worker threads (asyncio.to_thread); file IO stays outside the lock
+        self._lock = threading.Lock()
+        for path in sorted(self.directory.glob("*.*"), key=lambda p: p.stat().st_mtime):
+            if path.suffix == ".tmp":
+                path.unlink(missing_ok=True)
+                continue
+            size = path.stat().st_size
+            self._entries[path.name] = size
+            self._total += size
+    
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+        try:
+            data = (self.directory / key).read_bytes()
+        except FileNotFoundError:
+            with self._lock:
+                self._total -= self._entries.pop(key, 0)
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return data
+    
+    def put(self, key: str, data: bytes):
+        tmp_path = self.directory / f"{key}.{uuid.uuid4().hex[:8]}.tmp"
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, self.directory / key)
+        evicted = []
+        with self._lock:
+            self._total += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self._total -= size
+                evicted.append(old_key)
+        for old_key in evicted:
+            (self.directory / old_key).unlink(missing_ok=True)
+
+media_variant_cache: Optional[MediaVariantCache] = None
+# Variants being rendered right now, so concurrent requests share one render
+media_variant_tasks: Dict[str, asyncio.Task] = {}
+
+def get_media_variant_cache() -> MediaVariantCache:
+    global media_variant_cache
+    if media_variant_cache is None:
+        media_variant_cache = MediaVariantCache(MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES)
+    return media_variant_cache
+
+async def render_media_variant(digest: str, size: int, image_format: str, key: str) -> bytes:
+    cache = get_media_variant_cache()
+    data = await asyncio.to_thread(cache.get, key)
+    if data is not None:
+        return data
+    grid_out = await media_bucket.open_download_stream_by_name(digest)
+    original = await grid_out.read()
+    variant = await run_in_image_pool(imaging.render_variant, original, size, image_format)
+    if "error" in variant:
+        status_code, detail = variant["error"]
+        raise HTTPException(status_code=status_code, detail=detail)
+    await asyncio.to_thread(cache.put, key, variant["data"])
+    return variant["data"]
+
+async def get_media_variant(digest: str, size: int, image_format: str) -> bytes:
+    key = f"{digest}-{size}.{image_format}"
+    task = media_variant_tasks.get(key)
+    if task is None:
+        task = asyncio.create_task(render_media_variant(digest, size, image_format, key))
+        media_variant_tasks[key] = task
+        task.add_done_callback(lambda _: media_variant_tasks.pop(key, None))
+    return await asyncio.shield(task)
+
+@api_router.get("/media/{digest}")
+async def get_media(digest: str, request: Request, size: Optional[int] = None):
+    """Stream a stored image, or a resized variant when `size` is given.
+    
+    Content is immutable, so it can be cached forever.
+    """
+    if not re.fullmatch(r"[0-9a-f]{64}", digest):
+        raise HTTPException(status_code=404, detail="Media not found")
+    
+    if size is not None:
+        if size not in MEDIA_VARIANT_SIZES:
+            raise HTTPException(status_code=400, detail=f"size must be one of {list(MEDIA_VARIANT_SIZES)}")
+        image_format = "webp" if "image/webp" in request.headers.get("accept", "") else "jpeg"
+        etag = f'"{digest}-{size}-{image_format}"'
+        headers = {"ETag": etag, "Cache-Control": MEDIA_CACHE_CONTROL, "Vary": "Accept"}
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+        try:
+            data = await get_media_variant(digest, size, image_format)
+        except NoFile:
+            raise HTTPException(status_code=404, detail="Media not found")
+        return Response(content=data, media_type=f"image/{image_format}", headers=headers)
     
-    return {"message": f"Created {len(wishes)} sample wishes"}
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": MEDIA_CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        grid_out = await media_bucket.open_download_stream_by_name(digest)
+    except NoFile:
+        raise HTTPException(status_code=404, detail="Media not found")
+    
+    async def chunks():
+        while True:
+            chunk = await grid_out.readchunk()
+            if not chunk:
+                break
+            yield chunk
+    
+    headers["Content-Length"] = str(grid_out.length)
+    content_type = (grid_out.metadata or {}).get("content_type", "application/octet-stream")
+    return StreamingResponse(chunks(), media_type=content_type, headers=headers)
 
 # ===================== HEALTH CHECK =====================
 
@@ -2417,12 +4667,16 @@ async def health_check():
 
 # ===================== WEBSOCKET CONNECTION MANAGER =====================
 
+WEBSOCKET_SEND_TIMEOUT = 5  # seconds before a stuck client is skipped
+
 class ConnectionManager:
     """Manages WebSocket connections for real-time chat"""
     
     def __init__(self):
         # room_id -> {user_id: websocket}
         self.active_connections: Dict[str, Dict[str, WebSocket]] = {}
+        # Background broadcasts, referenced until they finish
+        self.sending: set = set()
     
     async def connect(self, websocket: WebSocket, room_id: str, user_id: str):
         await websocket.accept()
@@ -2444,20 +4698,106 @@ class ConnectionManager:
             await self.active_connections[room_id][user_id].send_json(message)
     
     async def broadcast_to_room(self, message: dict, room_id: str, exclude_user: str = None):
-        if room_id in self.active_connections:
-            for user_id, websocket in self.active_connections[room_id].items():
-                if exclude_user and user_id == exclude_user:
-                    continue
-                try:
-                    await websocket.send_json(message)
-                except Exception as e:
-                    logger.error(f"Error sending to {user_id}: {e}")
+        # Snapshot: users can connect or leave while the sends are awaited
+        targets = [
+            (user_id, websocket)
+            for user_id, websocket in list(self.active_connections.get(room_id, {}).items())
+            if not (exclude_user and user_id == exclude_user)
+        ]
+        results = await asyncio.gather(
+            *(asyncio.wait_for(websocket.send_json(message), WEBSOCKET_SEND_TIMEOUT) for _, websocket in targets),
+            return_exceptions=True
+        )
+        for (user_id, _), result in zip(targets, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Error sending to {user_id}: {result!r}")
+    
+    def publish(self, message: dict, room_id: str):
+        """Broadcast in the background, so a request never waits on (or fails with) a socket"""
+        if room_id not in self.active_connections:
+            return
+        task = asyncio.create_task(self.broadcast_to_room(message, room_id))
+        self.sending.add(task)
+        task.add_done_callback(self.sending.discard)
 
     def is_user_online(self, room_id: str, user_id: str) -> bool:
         return room_id in self.active_connections and user_id in self.active_connections[room_id]
 
 manager = ConnectionManager()
 
+# ===================== ORDER TRACKING CHANNELS =====================
+
+# order_id -> {user_id: websocket} of whoever is watching the order
+order_channels = ConnectionManager()
+# agent_id -> order_ids with someone connected, so a location ping knows where to go
+order_watchers: Dict[str, set] = {}
+
+def watch_order(order_id: str, agent_id: Optional[str]):
+    if agent_id and order_id in order_channels.active_connections:
+        order_watchers.setdefault(agent_id, set()).add(order_id)
+
+def unwatch_order(order_id: str, agent_id: Optional[str]):
+    watched = order_watchers.get(agent_id)
+    if watched is None:
+        return
+    watched.discard(order_id)
+    if not watched:
+        del order_watchers[agent_id]
+
+def agent_location_message(order_id: str, location: dict) -> dict:
+    updated_at = location.get("updated_at")
+    return {
+        "type": "agent_location",
+        "order_id": order_id,
+        "lat": location["latitude"],
+        "lng": location["longitude"],
+        "heading": location.get("heading"),
+        "speed": location.get("speed"),
+        "timestamp": updated_at.isoformat() if updated_at else None
+    }
+
+def broadcast_agent_location(agent_id: str, location: dict):
+    """Push a location fix to everyone watching an order the agent is delivering"""
+    for order_id in list(order_watchers.get(agent_id, ())):
+        order_channels.publish(agent_location_message(order_id, location), order_id)
+
+@app.websocket("/ws/orders/{order_id}")
+async def websocket_order(websocket: WebSocket, order_id: str, token: Optional[str] = None):
+    """Live agent location and status changes for one order.
+    
+    Authenticated with the session token as a query parameter, since browsers
+    cannot set headers on a websocket. Channels are per process, like chat.
+    """
+    user = await user_from_session_token(token) if token else None
+    # Connects are rare; read the order fresh so the watcher goes to the current agent
+    order_parties_cache.invalidate(order_id)
+    parties = await get_order_parties(order_id, user.user_id) if user else None
+    if not parties or not is_order_party(parties, user.user_id):
+        await websocket.close(code=4403)
+        return
+    
+    await order_channels.connect(websocket, order_id, user.user_id)
+    if parties.get("status") not in ORDER_TERMINAL_STATUSES:
+        watch_order(order_id, parties.get("assigned_agent_id"))
+    await websocket.send_json({
+        "type": "connected",
+        "order_id": order_id,
+        "status": parties.get("status"),
+        "location": await latest_agent_location(order_id, parties),
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+    
+    try:
+        while True:
+            # Nothing is expected from the client; this just waits for it to go away
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        order_channels.disconnect(order_id, user.user_id)
+        if order_id not in order_channels.active_connections:
+            # The assigned agent may have changed since connect
+            for agent_id in [a for a, orders in order_watchers.items() if order_id in orders]:
+                unwatch_order(order_id, agent_id)
+
 # ===================== WEBSOCKET CHAT ENDPOINT =====================
 
 @app.websocket("/ws/chat/{room_id}/{user_id}")
@@ -2560,8 +4900,9 @@ async def get_chat_room(room_id: str, user: dict = Depends(get_current_user)):
         raise HTTPException(status_code=404, detail="Room not found")
     
     # Get participant info
-    wisher = await db.users.find_one({"user_id": room["wisher_id"]})
-    partner = await db.users.find_one({"user_id": room["partner_id"]})
+    profiles = await get_user_profiles([room["wisher_id"], room["partner_id"]])
+    wisher = profiles.get(room["wisher_id"])
+    partner = profiles.get(room["partner_id"])
     
     room["_id"] = str(room["_id"])
     room["wisher"] = {"name": wisher.get("name"), "phone": wisher.get("phone")} if wisher else None
@@ -2581,46 +4922,38 @@ async def get_chat_messages(
     if before:
         query["created_at"] = {"$lt": datetime.fromisoformat(before)}
     
-    cursor = db.messages.find(query).sort("created_at", -1).limit(limit)
+    cursor = db.messages.find(query, CHAT_MESSAGE_PROJECTION).sort("created_at", -1).limit(limit)
     messages = await cursor.to_list(length=limit)
     
-    for msg in messages:
-        msg["_id"] = str(msg["_id"])
-        msg["created_at"] = msg["created_at"].isoformat()
-    
-    return list(reversed(messages))
+    return ORJSONResponse(list(reversed(messages)))
 
 @api_router.get("/chat/my-rooms")
-async def get_my_chat_rooms(user: dict = Depends(get_current_user)):
+async def get_my_chat_rooms(user: User = Depends(require_auth)):
     """Get all chat rooms for the current user"""
-    user_id = user["user_id"]
+    user_id = user.user_id
     
     cursor = db.chat_rooms.find({
         "$or": [{"wisher_id": user_id}, {"partner_id": user_id}],
         "status": "active"
-    }).sort("created_at", -1)
+    }, CHAT_ROOM_PROJECTION).sort("created_at", -1)
     
     rooms = await cursor.to_list(length=50)
     
+    def other_id(room):
+        return room["partner_id"] if room["wisher_id"] == user_id else room["wisher_id"]
+    
+    last_messages, profiles = await asyncio.gather(
+        get_last_messages([room["room_id"] for room in rooms]),
+        get_user_profiles([other_id(room) for room in rooms]),
+    )
+    
     result = []
     for room in rooms:
-        room["_id"] = str(room["_id"])
-        
-        # Get last message
-        last_msg = await db.messages.find_one(
-            {"room_id": room["room_id"]},
-            sort=[("created_at", -1)]
-        )
+        last_msg = last_messages.get(room["room_id"])
         if last_msg:
-            room["last_message"] = {
-                "content": last_msg["content"],
-                "sender_id": last_msg["sender_id"],
-                "created_at": last_msg["created_at"].isoformat()
-            }
+            room["last_message"] = {key: last_msg.get(key) for key in ("content", "sender_id", "created_at")}
         
-        # Get other participant info
-        other_id = room["partner_id"] if room["wisher_id"] == user_id else room["wisher_id"]
-        other_user = await db.users.find_one({"user_id": other_id})
+        other_user = profiles.get(other_id(room))
         if other_user:
             room["other_user"] = {
                 "user_id": other_user["user_id"],
@@ -2630,7 +4963,7 @@ async def get_my_chat_rooms(user: dict = Depends(get_current_user)):
         
         result.append(room)
     
-    return result
+    return ORJSONResponse(result)
 
 # ===================== PUSH NOTIFICATION ENDPOINTS =====================
 
@@ -2709,15 +5042,15 @@ class WishCreate(BaseModel):
     is_urgent: bool = False
 
 @api_router.post("/wishes/create")
-async def create_wish(wish_data: WishCreate, user: dict = Depends(get_current_user)):
-    """Create a new wish and find matching Genie"""
+async def create_wish(wish_data: WishCreate, user: User = Depends(require_auth)):
+    """Create a new wish and match it to the nearest available Genie"""
     wish_id = f"wish_{uuid.uuid4().hex[:12]}"
     
     # Create wish document
     wish_doc = {
         "wish_id": wish_id,
-        "wisher_id": user["user_id"],
-        "wisher_name": user.get("name", "Unknown"),
+        "wisher_id": user.user_id,
+        "wisher_name": user.name or "Unknown",
         "category": wish_data.category,
         "title": wish_data.title,
         "description": wish_data.description,
@@ -2734,17 +5067,10 @@ async def create_wish(wish_data: WishCreate, user: dict = Depends(get_current_us
     
     await db.wishes.insert_one(wish_doc)
     
-    # Find nearby available Genies (mobile genies only for wishes)
-    available_genies = await db.users.find({
-        "partner_type": "agent",
-        "agent_type": "mobile",
-        "partner_status": "available"
-    }).to_list(length=10)
+    # Mobile genies only for wishes
+    genie = await find_genie_for_wish(wish_doc)
     
-    if available_genies:
-        # For now, assign to first available genie (later: proximity-based)
-        genie = available_genies[0]
-        
+    if genie:
         # Update wish with assigned genie
         await db.wishes.update_one(
             {"wish_id": wish_id},
@@ -2760,7 +5086,7 @@ async def create_wish(wish_data: WishCreate, user: dict = Depends(get_current_us
             await send_push_notification(
                 genie["push_token"],
                 "✨ New Wish Request!",
-                f"{user.get('name', 'Someone')} needs help: {wish_data.title}",
+                f"{user.name or 'Someone'} needs help: {wish_data.title}",
                 {"type": "wish_request", "wish_id": wish_id}
             )
         
@@ -2772,13 +5098,13 @@ async def create_wish(wish_data: WishCreate, user: dict = Depends(get_current_us
     return wish_doc
 
 @api_router.post("/wishes/{wish_id}/accept")
-async def accept_wish(wish_id: str, user: dict = Depends(get_current_user)):
+async def accept_wish(wish_id: str, user: User = Depends(require_auth)):
     """Genie accepts a wish - creates chat room and starts connection"""
     wish = await db.wishes.find_one({"wish_id": wish_id})
     if not wish:
         raise HTTPException(status_code=404, detail="Wish not found")
     
-    if wish.get("assigned_genie_id") != user["user_id"]:
+    if wish.get("assigned_genie_id") != user.user_id:
         raise HTTPException(status_code=403, detail="This wish is not assigned to you")
     
     # Create chat room
@@ -2787,7 +5113,7 @@ async def accept_wish(wish_id: str, user: dict = Depends(get_current_user)):
         "room_id": room_id,
         "wish_id": wish_id,
         "wisher_id": wish["wisher_id"],
-        "partner_id": user["user_id"],
+        "partner_id": user.user_id,
         "wish_title": wish.get("title"),
         "status": "active",
         "created_at": datetime.now(timezone.utc)
@@ -2806,9 +5132,10 @@ async def accept_wish(wish_id: str, user: dict = Depends(get_current_user)):
     
     # Update genie status to busy
     await db.users.update_one(
-        {"user_id": user["user_id"]},
+        {"user_id": user.user_id},
         {"$set": {"partner_status": "busy"}}
     )
+    index_partner_status(user.user_id, "busy")
     
     # Notify wisher
     wisher = await db.users.find_one({"user_id": wish["wisher_id"]})
@@ -2816,7 +5143,7 @@ async def accept_wish(wish_id: str, user: dict = Depends(get_current_user)):
         await send_push_notification(
             wisher["push_token"],
             "🎉 Genie Connected!",
-            f"{user.get('name', 'A Genie')} has accepted your wish!",
+            f"{user.name or 'A Genie'} has accepted your wish!",
             {"type": "wish_accepted", "wish_id": wish_id, "room_id": room_id}
         )
     
@@ -2831,22 +5158,16 @@ async def accept_wish(wish_id: str, user: dict = Depends(get_current_user)):
     }
 
 @api_router.post("/wishes/{wish_id}/decline")
-async def decline_wish(wish_id: str, user: dict = Depends(get_current_user)):
-    """Genie declines a wish - reassign to another genie"""
+async def decline_wish(wish_id: str, user: User = Depends(require_auth)):
+    """Genie declines a wish - reassign to the next nearest genie"""
     wish = await db.wishes.find_one({"wish_id": wish_id})
     if not wish:
         raise HTTPException(status_code=404, detail="Wish not found")
     
-    # Find another available genie
-    available_genies = await db.users.find({
-        "partner_type": "agent",
-        "agent_type": "mobile",
-        "partner_status": "available",
-        "user_id": {"$ne": user["user_id"]}  # Exclude current genie
-    }).to_list(length=10)
+    # Find another available genie, excluding the current one
+    new_genie = await find_genie_for_wish(wish, exclude=user.user_id)
     
-    if available_genies:
-        new_genie = available_genies[0]
+    if new_genie:
         await db.wishes.update_one(
             {"wish_id": wish_id},
             {"$set": {
@@ -2873,17 +5194,17 @@ async def decline_wish(wish_id: str, user: dict = Depends(get_current_user)):
     return {"status": "success", "message": "Wish reassigned"}
 
 @api_router.get("/wishes/incoming")
-async def get_incoming_wish(user: dict = Depends(get_current_user)):
+async def get_incoming_wish(user: User = Depends(require_auth)):
     """Get incoming wish request for a Genie"""
     wish = await db.wishes.find_one({
-        "assigned_genie_id": user["user_id"],
+        "assigned_genie_id": user.user_id,
         "status": "matched"
     })
     
     if wish:
         wish["_id"] = str(wish["_id"])
         # Get wisher info
-        wisher = await db.users.find_one({"user_id": wish["wisher_id"]})
+        wisher = await get_user_profile(wish.get("wisher_id"))
         if wisher:
             wish["wisher"] = {
                 "name": wisher.get("name"),
@@ -2894,17 +5215,17 @@ async def get_incoming_wish(user: dict = Depends(get_current_user)):
     return wish
 
 @api_router.get("/wishes/active")
-async def get_active_wish(user: dict = Depends(get_current_user)):
+async def get_active_wish(user: User = Depends(require_auth)):
     """Get currently active wish for a Genie"""
     wish = await db.wishes.find_one({
-        "assigned_genie_id": user["user_id"],
+        "assigned_genie_id": user.user_id,
         "status": {"$in": ["accepted", "in_progress"]}
     })
     
     if wish:
         wish["_id"] = str(wish["_id"])
         # Get wisher info
-        wisher = await db.users.find_one({"user_id": wish["wisher_id"]})
+        wisher = await get_user_profile(wish.get("wisher_id"))
         if wisher:
             wish["wisher"] = {
                 "name": wisher.get("name"),
@@ -2947,16 +5268,10 @@ async def track_wish_genie(wish_id: str, user: dict = Depends(get_current_user))
             "wish_status": wish.get("status")
         }
     
-    # Get Genie's info
-    genie = await db.users.find_one(
-        {"user_id": genie_id},
-        {"_id": 0, "user_id": 1, "name": 1, "phone": 1, "picture": 1, "partner_rating": 1}
-    )
-    
-    # Get Genie's current location
-    genie_location = await db.partner_locations.find_one(
-        {"user_id": genie_id},
-        {"_id": 0}
+    # Get Genie's info and current location
+    genie, genie_location = await asyncio.gather(
+        get_user_profile(genie_id),
+        db.partner_locations.find_one({"user_id": genie_id}, {"_id": 0})
     )
     
     # Calculate ETA (mock calculation based on distance)
@@ -2964,21 +5279,12 @@ async def track_wish_genie(wish_id: str, user: dict = Depends(get_current_user))
     distance_km = None
     
     if genie_location and wish.get("location"):
-        # Simple distance calculation (Haversine formula approximation)
-        import math
-        
         lat1 = genie_location.get("latitude", 0)
         lon1 = genie_location.get("longitude", 0)
         lat2 = wish["location"].get("lat", wish["location"].get("latitude", 0))
         lon2 = wish["location"].get("lng", wish["location"].get("longitude", 0))
         
-        # Haversine formula
-        R = 6371  # Earth's radius in km
-        dlat = math.radians(lat2 - lat1)
-        dlon = math.radians(lon2 - lon1)
-        a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-        distance_km = round(R * c, 2)
+        distance_km = round(haversine_km(lat1, lon1, lat2, lon2), 2)
         
         # Estimate ETA (assuming average speed of 25 km/h in urban areas)
         avg_speed_kmh = 25
@@ -3042,6 +5348,79 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Added last so it wraps everything else and times the full request
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Per-route latency, response size and Mongo command metrics in Prometheus text format"""
+    return PlainTextResponse(metrics.render_metrics(), media_type="text/plain; version=0.0.4")
+
+async def ensure_indexes():
+    """Create the indexes the hot query paths rely on (no-op when they already exist)"""
+    specs = [
+        (db.products, [("vendor_id", 1), ("created_at", -1)], {}),
+        (db.shop_orders, [("vendor_id", 1), ("updated_at", 1), ("order_id", 1)], {}),
+        (db.promoter_events, [("geo", "2dsphere"), ("date", 1)], {}),
+        (db.users, [("user_id", 1)], {}),
+        (db.partner_locations, [("updated_at", 1)], {}),
+        (db.location_trails, [("partner_id", 1), ("bucket", 1)], {"unique": True}),
+        (db.location_trails, [("expire_at", 1)], {"expireAfterSeconds": 0}),
+        (db.wishes, [("status", 1), ("wish_type", 1), ("created_at", -1)], {
+            "partialFilterExpression": {"accepted_by": None},
+        }),
+        (db.messages, [("room_id", 1), ("created_at", -1)], {}),
+        (db.otp_codes, [("phone", 1)], {"unique": True}),
+        (db.otp_codes, [("expire_at", 1)], {"expireAfterSeconds": 0}),
+        (db.rate_limits, [("key", 1)], {"unique": True}),
+        (db.rate_limits, [("expire_at", 1)], {"expireAfterSeconds": 0}),
+        (db.deals, [("partner_id", 1), ("created_at", -1)], {}),
+        (db.appointments, [("partner_id", 1), ("start", 1)], {}),
+        (db.deal_offers, [("deal_id", 1), ("timestamp", 1), ("offer_id", 1)], {}),
+        (db.event_bookings, [("promoter_id", 1), ("created_at", -1)], {}),
+        (db.event_bookings, [("event_id", 1)], {}),
+        (db.event_slot_shards, [("event_id", 1), ("shard", 1)], {"unique": True}),
+        (db.event_holds, [("hold_id", 1)], {"unique": True}),
+        (db.event_holds, [("status", 1), ("expires_at", 1)], {}),
+        (db.event_holds, [("purge_at", 1)], {"expireAfterSeconds": 0}),
+        (db.products, [("name", "text"), ("category", "text"), ("description", "text")], {
+            "name": "products_text",
+            "weights": {"name": 10, "category": 5, "description": 1},
+        }),
+    ]
+    for collection, keys, options in specs:
+        try:
+            await collection.create_index(keys, **options)
+        except Exception as e:
+            logger.error(f"Index creation failed on {collection.name} {keys}: {e}")
+
+background_tasks: List[asyncio.Task] = []
+
+async def run_periodically(job, interval: float):
+    """Run a maintenance coroutine forever, logging (not propagating) failures"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await job()
+        except Exception as e:
+            logger.error(f"Background job {job.__name__} failed: {e}")
+
+@app.on_event("startup")
+async def startup_tasks():
+    await ensure_indexes()
+    try:
+        await reconcile_partner_index()
+    except Exception as e:
+        logger.error(f"Initial partner index build failed: {e}")
+    background_tasks.append(asyncio.create_task(run_periodically(reconcile_partner_index, PARTNER_INDEX_RECONCILE_INTERVAL)))
+    background_tasks.append(asyncio.create_task(run_periodically(flush_stale_trails, TRAIL_FLUSH_SECONDS / 2)))
+    background_tasks.append(asyncio.create_task(run_periodically(sweep_event_slots, EVENT_HOLD_SWEEP_INTERVAL)))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    await flush_stale_trails(max_age=0)
     client.close()
+    if image_pool is not None:
+        image_pool.shutdown(wait=False, cancel_futures=True)
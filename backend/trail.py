@@ -0,0 +1,102 @@
+"""
+Compact encoding for partner location trails.
+
+Pings are buffered per partner (see server.py) and, on flush, simplified with
+Douglas-Peucker and packed into one chunk. Timestamps (ms) and coordinates
+(fixed point, ~1.1m) are stored as integers, each delta-encoded against the
+previous point and written as zigzag varints. A point in a moving trail costs
+a handful of bytes instead of a ~150 byte document.
+
+Like imaging.py, nothing here touches the database.
+"""
+
+import math
+from typing import List, Sequence, Tuple
+
+COORD_SCALE = 100000  # 1e-5 degrees, ~1.1m
+METERS_PER_DEG = 111320.0
+
+# (unix seconds, lat, lng)
+Point = Tuple[float, float, float]
+
+
+def douglas_peucker(points: Sequence[Point], epsilon_m: float) -> List[Point]:
+    """Drop points closer than epsilon_m to the line between the points kept around them"""
+    if len(points) < 3 or epsilon_m <= 0:
+        return list(points)
+    # Equirectangular projection around the first point is plenty at trail scale
+    cos_lat = math.cos(math.radians(points[0][1]))
+    xy = [(p[2] * METERS_PER_DEG * cos_lat, p[1] * METERS_PER_DEG) for p in points]
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = xy[first], xy[last]
+        dx, dy = x2 - x1, y2 - y1
+        length_sq = dx * dx + dy * dy
+        farthest, farthest_sq = None, epsilon_m * epsilon_m
+        for i in range(first + 1, last):
+            px, py = xy[i]
+            if length_sq == 0:
+                distance_sq = (px - x1) ** 2 + (py - y1) ** 2
+            else:
+                t = max(0.0, min(1.0, ((px - x1) * dx + (py - y1) * dy) / length_sq))
+                distance_sq = (px - x1 - t * dx) ** 2 + (py - y1 - t * dy) ** 2
+            if distance_sq > farthest_sq:
+                farthest, farthest_sq = i, distance_sq
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def write_varint(out: bytearray, value: int):
+    # Zigzag first so small negative deltas stay small
+    value = (value << 1) ^ (value >> 63)
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    shift = result = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (result >> 1) ^ -(result & 1), offset
+
+
+def pack(points: Sequence[Point]) -> bytes:
+    """Delta-encode points (in time order) into a chunk"""
+    out = bytearray()
+    write_varint(out, len(points))
+    previous = (0, 0, 0)
+    for t, lat, lng in points:
+        current = (round(t * 1000), round(lat * COORD_SCALE), round(lng * COORD_SCALE))
+        for value, before in zip(current, previous):
+            write_varint(out, value - before)
+        previous = current
+    return bytes(out)
+
+
+def unpack(data: bytes) -> List[Point]:
+    count, offset = read_varint(data, 0)
+    points = []
+    t = lat = lng = 0
+    for _ in range(count):
+        delta, offset = read_varint(data, offset)
+        t += delta
+        delta, offset = read_varint(data, offset)
+        lat += delta
+        delta, offset = read_varint(data, offset)
+        lng += delta
+        points.append((t / 1000, lat / COORD_SCALE, lng / COORD_SCALE))
+    return points
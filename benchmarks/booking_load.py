@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Overbooking load test for promoter event slot booking.
+
+Fires many concurrent customers at a small event through the real booking
+endpoints (in-process over ASGI, against a real local MongoDB) and checks
+capacity is never exceeded and no slot leaks. It runs once with the single
+conditional counter and once with the sharded counter. Customers book
+immediately, hold and confirm, hold and release, or hold and walk away so the
+hold expires and is swept. In the sharded run some holds are taken before the
+counter is sharded and released after.
+
+    MONGO_URL=mongodb://localhost:27017 python benchmarks/booking_load.py --attempts 2000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "booking_load_test")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+CUSTOMERS = 50
+
+
+async def create_users():
+    now = datetime.now(timezone.utc)
+    users = [{"user_id": "promoter_load", "name": "Load promoter", "partner_type": "promoter", "created_at": now}]
+    users += [{"user_id": f"customer_load_{i}", "name": f"Customer {i}", "created_at": now} for i in range(CUSTOMERS)]
+    await server.db.users.insert_many(users)
+    await server.db.user_sessions.insert_many([
+        {"user_id": user["user_id"], "session_token": f"token_{user['user_id']}",
+         "expires_at": now + timedelta(days=1), "created_at": now}
+        for user in users
+    ])
+
+
+def auth(user_id):
+    return {"Authorization": f"Bearer token_{user_id}"}
+
+
+async def create_event(total_slots):
+    event = {
+        "event_id": f"event_load_{uuid.uuid4().hex[:8]}",
+        "promoter_id": "promoter_load",
+        "event_type": "trip",
+        "title": "Load test trip",
+        "description": "Overbooking load test",
+        "price": 100.0,
+        "total_slots": total_slots,
+        "booked_slots": 0,
+        "images": [],
+        "status": "active",
+        "created_at": datetime.now(timezone.utc),
+    }
+    await server.db.promoter_events.insert_one(event)
+    return event["event_id"]
+
+
+async def hold(http, event_id, customer, slots):
+    response = await http.post(f"/api/events/{event_id}/holds", json={"slots": slots}, headers=auth(customer))
+    return response.json()["hold_id"] if response.status_code == 200 else None
+
+
+async def attempt(http, event_id, rng, outcome):
+    """One customer: book now, or hold and then confirm, release or abandon"""
+    customer = f"customer_load_{rng.randrange(CUSTOMERS)}"
+    slots = rng.choice([1, 1, 1, 2])
+    mode = rng.random()
+    if mode < 0.35:
+        response = await http.post(f"/api/events/{event_id}/book", json={"slots": slots}, headers=auth(customer))
+        outcome["confirmed" if response.status_code == 200 else "rejected"] += 1
+        return
+    hold_id = await hold(http, event_id, customer, slots)
+    if not hold_id:
+        outcome["rejected"] += 1
+        return
+    await asyncio.sleep(rng.random() / 100)
+    if mode < 0.65:
+        response = await http.post(f"/api/events/holds/{hold_id}/confirm", headers=auth(customer))
+        outcome["confirmed" if response.status_code == 200 else "rejected"] += 1
+    elif mode < 0.8:
+        await http.delete(f"/api/events/holds/{hold_id}", headers=auth(customer))
+        outcome["released"] += 1
+    else:
+        # Abandoned checkout: backdate the hold so it has expired and is released by the next reservation or sweep
+        await server.db.event_holds.update_one(
+            {"hold_id": hold_id},
+            {"$set": {"expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}}
+        )
+        outcome["expired"] += 1
+
+
+async def run_scenario(http, name, total_slots, attempts, shards, seed):
+    event_id = await create_event(total_slots)
+    early_holds = []
+    if shards:
+        # Holds taken on the single counter, released once the event is sharded
+        early_holds = [await hold(http, event_id, f"customer_load_{i}", 2) for i in range(5)]
+        response = await http.post(
+            f"/api/promoter/events/{event_id}/shard-counter", json={"shards": shards}, headers=auth("promoter_load")
+        )
+        assert response.status_code == 200, response.text
+
+    rng = random.Random(seed)
+    outcome = {"confirmed": 0, "released": 0, "expired": 0, "rejected": 0}
+    start = time.perf_counter()
+    await asyncio.gather(*(attempt(http, event_id, rng, outcome) for _ in range(attempts)))
+    elapsed = time.perf_counter() - start
+    for i, hold_id in enumerate(early_holds):
+        await http.delete(f"/api/events/holds/{hold_id}", headers=auth(f"customer_load_{i}"))
+    await server.expire_event_holds(event_id)
+
+    bookings = await server.db.event_bookings.find({"event_id": event_id}, {"slots": 1}).to_list(None)
+    confirmed_slots = sum(b["slots"] for b in bookings)
+    event = await server.db.promoter_events.find_one({"event_id": event_id})
+    if shards:
+        shard_docs = await server.db.event_slot_shards.find({"event_id": event_id}).to_list(None)
+        booked = event.get("base_booked_slots", 0) + sum(d["booked"] for d in shard_docs)
+        capacity = event.get("base_booked_slots", 0) + sum(d["capacity"] for d in shard_docs)
+        overfull = [d for d in shard_docs if d["booked"] > d["capacity"]]
+    else:
+        booked, capacity = event["booked_slots"], event["total_slots"]
+        overfull = []
+
+    ok = booked == confirmed_slots and capacity == total_slots and booked <= total_slots and not overfull
+    print(f"{name}: {attempts} attempts in {elapsed:.2f}s ({attempts / elapsed:.0f}/s)  "
+          f"confirmed={outcome['confirmed']} released={outcome['released']} expired={outcome['expired']} "
+          f"rejected={outcome['rejected']} stored={booked}/{total_slots} bookings={confirmed_slots}  "
+          f"{'✅ PASS' if ok else '❌ FAIL'}")
+    return ok
+
+
+async def main(args):
+    await create_users()
+    transport = httpx.ASGITransport(app=server.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://booking-load") as http:
+            results = [
+                await run_scenario(http, "single counter", args.slots, args.attempts, 0, args.seed),
+                await run_scenario(http, f"sharded x{args.shards}", args.slots, args.attempts, args.shards, args.seed),
+            ]
+    finally:
+        await server.client.drop_database(os.environ["DB_NAME"])
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--attempts", type=int, default=2000)
+    parser.add_argument("--slots", type=int, default=150)
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=7)
+    sys.exit(asyncio.run(main(parser.parse_args())))
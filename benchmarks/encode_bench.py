@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Response encoding benchmark.
+
+Builds payloads shaped like the list endpoints' responses and times the old
+path (jsonable_encoder + stdlib JSONResponse, after the manual isoformat loops)
+against returning an ORJSONResponse directly. No server or database needed.
+
+    python benchmarks/encode_bench.py --rounds 200
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+NOW = datetime(2026, 1, 15, 10, 30, 0, 123000)
+
+
+def deal(i):
+    return {
+        "deal_id": f"deal_{i:012x}",
+        "wish_id": f"wish_{i:012x}",
+        "partner_id": "user_partner01",
+        "partner_name": "Ravi Kumar",
+        "wisher_id": f"user_{i % 40:08x}",
+        "initial_price": 500.0 + i,
+        "current_price": 450.0 + i,
+        "scheduled_date": "2026-01-20",
+        "scheduled_time": "10:00",
+        "status": random.choice(["pending", "negotiating", "accepted", "completed"]),
+        "room_id": f"room_{i:012x}",
+        "last_offer": {"offer_id": f"offer_{i:012x}", "from": "partner", "price": 450.0 + i, "type": "counter", "timestamp": NOW},
+        "offer_count": 3,
+        "created_at": NOW - timedelta(hours=i),
+        "updated_at": NOW,
+        "accepted_at": NOW if i % 2 else None,
+    }
+
+
+def appointment(i):
+    start = NOW + timedelta(hours=i)
+    return {
+        "appointment_id": f"apt_{i:012x}",
+        "deal_id": f"deal_{i:012x}",
+        "wish_id": None,
+        "service_title": "Home deep cleaning",
+        "customer_name": "Priya",
+        "scheduled_date": start.strftime("%Y-%m-%d"),
+        "scheduled_time": start.strftime("%H:%M"),
+        "start": start,
+        "end": start + timedelta(minutes=90),
+        "duration_minutes": 90,
+        "all_day": False,
+        "location": "HSR Layout, Bengaluru",
+        "price": 1200.0,
+        "notes": "Bring own supplies",
+        "status": "upcoming",
+        "created_at": NOW,
+        "updated_at": NOW,
+    }
+
+
+def message(i):
+    return {
+        "message_id": f"msg_{i:012x}",
+        "room_id": "room_000000000001",
+        "sender_id": "user_partner01" if i % 2 else "user_wisher01",
+        "sender_type": "partner" if i % 2 else "wisher",
+        "content": "Sure, I can be there by 10. " * (1 + i % 4),
+        "created_at": NOW + timedelta(seconds=i * 30),
+    }
+
+
+def room(i):
+    return {
+        "room_id": f"room_{i:012x}",
+        "wish_id": f"wish_{i:012x}",
+        "wisher_id": "user_wisher01",
+        "partner_id": f"user_{i:08x}",
+        "deal_id": f"deal_{i:012x}",
+        "wish_title": "Need a plumber",
+        "status": "active",
+        "created_at": NOW,
+        "last_message": {"content": "On my way", "sender_id": f"user_{i:08x}", "created_at": NOW},
+        "other_user": {"user_id": f"user_{i:08x}", "name": "Genie", "phone": "+919800000000"},
+    }
+
+
+ENDPOINTS = {
+    "GET /deals/my-deals": lambda: {"deals": [deal(i) for i in range(100)], "count": 100},
+    "GET /appointments": lambda: {"appointments": [appointment(i) for i in range(100)], "count": 100},
+    "GET /partner/chat/rooms/{id}/messages": lambda: [message(i) for i in range(500)],
+    "GET /chat/my-rooms": lambda: [room(i) for i in range(50)],
+}
+
+
+def stringify_datetimes(value):
+    """What the endpoints did by hand before returning"""
+    if isinstance(value, dict):
+        return {k: stringify_datetimes(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [stringify_datetimes(v) for v in value]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def old_path(payload):
+    return JSONResponse(jsonable_encoder(stringify_datetimes(payload))).body
+
+
+def new_path(payload):
+    return ORJSONResponse(payload).body
+
+
+def time_us(fn, payload, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn(payload)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(7)
+    print(f"{'endpoint':40} {'bytes':>8} {'old µs':>10} {'orjson µs':>10} {'speedup':>8}")
+    for name, build in ENDPOINTS.items():
+        payload = build()
+        assert len(old_path(payload)) > 0 and len(new_path(payload)) > 0
+        old = time_us(old_path, payload, args.rounds)
+        new = time_us(new_path, payload, args.rounds)
+        print(f"{name:40} {len(new_path(payload)):>8} {old:>10.0f} {new:>10.0f} {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
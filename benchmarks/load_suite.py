@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Load-test suite for the hot API paths.
+
+Seeds a local MongoDB at a chosen scale, boots the app under uvicorn against
+it, and drives each workload for a fixed duration:
+
+    location_pings   PUT /api/partner/location from many agents
+    tracking_polls   GET /api/wishes/{wish_id}/track from wishers
+    chat_ws          send over /ws/chat/{room}/{user} and time the broadcast echo
+    accept_storm     many agents racing POST /api/agent/orders/{id}/accept on
+                     the same orders (checks exactly one winner per order)
+
+p50/p95/p99 latency and throughput are printed next to the stored baseline for
+the scale, from benchmarks/baselines.json. The run exits non-zero when p95 or
+RPS regress by more than --tolerance, or when a workload has no baseline for
+the scale. Record a baseline with --update-baseline (or --record) on the
+reference machine, and commit it, after an intended change.
+
+    python benchmarks/load_suite.py --scale small
+    python benchmarks/load_suite.py --scale full --duration 60 --update-baseline
+
+The full scale (10k agents, 100k orders, 1M messages) takes a few minutes to
+seed. Re-runs reuse the data unless --reseed is given. chat_ws needs the
+`websockets` package on both the client and the server side.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+from pymongo import MongoClient
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+BASELINES_PATH = Path(__file__).resolve().parent / "baselines.json"
+
+sys.path.insert(0, str(BACKEND_DIR))
+import datagen  # noqa: E402
+
+STORM_ORDERS = 2000
+
+WORKLOADS = ("location_pings", "tracking_polls", "chat_ws", "accept_storm")
+
+TRACKABLE_STATUSES = {"accepted", "in_progress"}
+
+
+# ===================== SEEDING =====================
+
+def generator_for(scale, seed_value):
+    # Ids, owners and statuses depend only on the seed, so Targets built later
+    # match data seeded on an earlier run; only timestamps move with base_time
+    return datagen.DataGenerator(seed=seed_value, counts=datagen.SCALES[scale], prefix="bench")
+
+
+def storm_orders(generator):
+    """Ready, unassigned orders that accept_storm races agents on"""
+    for n in range(STORM_ORDERS):
+        order = generator.order(generator.counts["orders"] + n, status="ready")
+        yield {**order, "order_id": f"bench_storm_{n}", "status_history": []}
+
+
+def seed(db, scale, seed_value):
+    generator = generator_for(scale, seed_value)
+    started = time.perf_counter()
+    datagen.write_sync(db, generator.collections())
+    datagen.write_sync(db, {"shop_orders": storm_orders(generator)})
+    db.bench_meta.replace_one({"_id": "seed"}, {"_id": "seed", "scale": scale, "seed": seed_value}, upsert=True)
+    print(f"Seeding took {time.perf_counter() - started:.0f}s")
+
+
+def ensure_seeded(mongo_url, db_name, scale, seed_value, reseed):
+    db = MongoClient(mongo_url)[db_name]
+    meta = db.bench_meta.find_one({"_id": "seed"})
+    if reseed or not meta or meta.get("scale") != scale or meta.get("seed") != seed_value:
+        print(f"Seeding {db_name} at scale '{scale}'...")
+        db.client.drop_database(db_name)
+        seed(db, scale, seed_value)
+    else:
+        # Storm orders are consumed by each run; put them back
+        db.shop_orders.update_many(
+            {"order_id": {"$regex": "^bench_storm_"}},
+            {"$set": {"assigned_agent_id": None, "status": "ready", "status_history": []}}
+        )
+        # Sessions from an older seeding may have expired
+        db.user_sessions.update_many({}, {"$set": {"expires_at": datetime.now(timezone.utc) + timedelta(days=30)}})
+    # Indexes the benchmark relies on that the app does not create itself
+    db.user_sessions.create_index("session_token")
+    db.users.create_index("user_id")
+    db.shop_orders.create_index("order_id")
+    db.wishes.create_index("wish_id")
+    db.partner_locations.create_index("user_id")
+    db.messages.create_index([("room_id", 1), ("created_at", -1)])
+
+
+class Targets:
+    """Ids and tokens the workloads address, derived from the generator instead of the database"""
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.agents = generator.counts["agents"]
+        self.trackable = [
+            (wish["wish_id"], wish["user_id"])
+            for wish in generator.wishes() if wish["status"] in TRACKABLE_STATUSES
+        ]
+        self.rooms = [(room["room_id"], room["wisher_id"]) for room in generator.chat_rooms()]
+
+    def agent_headers(self, i):
+        return {"Authorization": f"Bearer {datagen.session_token(self.generator.agent_id(i))}"}
+
+    def point(self, rng):
+        location = self.generator.point(rng)
+        return location["lat"], location["lng"]
+
+
+# ===================== SERVER =====================
+
+def start_server(mongo_url, db_name, port, workers, log_path):
+    env = {**os.environ, "MONGO_URL": mongo_url, "DB_NAME": db_name, "SLOW_REQUEST_MS": "100000"}
+    log = open(log_path, "w") if log_path else subprocess.DEVNULL
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"Server exited during startup (code {process.returncode}); see --server-log")
+        try:
+            if httpx.get(f"{base_url}/api/health", timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    sys.exit("Server did not become healthy within 60s")
+
+
+# ===================== WORKLOADS =====================
+
+class Recorder:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def timed(self, start, ok):
+        self.latencies.append((time.perf_counter() - start) * 1000)
+        if not ok:
+            self.errors += 1
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        if not self.latencies:
+            return {"requests": 0, "errors": self.errors, "p50_ms": 0, "p95_ms": 0, "p99_ms": 0, "rps": 0}
+        return {
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "p50_ms": round(statistics.median(self.latencies), 2),
+            "p95_ms": round(percentile(self.latencies, 95), 2),
+            "p99_ms": round(percentile(self.latencies, 99), 2),
+            "rps": round(len(self.latencies) / elapsed, 1),
+        }
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_for(duration, concurrency, worker):
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+
+    async def loop(worker_id):
+        rng = random.Random(worker_id)
+        while time.monotonic() < deadline:
+            await worker(rng, recorder)
+
+    await asyncio.gather(*(loop(i) for i in range(concurrency)))
+    recorder.finished = time.perf_counter()
+    return recorder
+
+
+async def location_pings(http, targets, duration, concurrency):
+    async def ping(rng, recorder):
+        lat, lng = targets.point(rng)
+        start = time.perf_counter()
+        response = await http.put(
+            "/api/partner/location",
+            json={"latitude": lat, "longitude": lng, "timestamp": time.time(), "is_online": True},
+            headers=targets.agent_headers(rng.randrange(targets.agents)),
+        )
+        recorder.timed(start, response.status_code == 200)
+
+    return await run_for(duration, concurrency, ping)
+
+
+async def tracking_polls(http, targets, duration, concurrency):
+    async def poll(rng, recorder):
+        wish_id, user_id = rng.choice(targets.trackable)
+        start = time.perf_counter()
+        response = await http.get(
+            f"/api/wishes/{wish_id}/track",
+            headers={"Authorization": f"Bearer {datagen.session_token(user_id)}"},
+        )
+        recorder.timed(start, response.status_code == 200)
+
+    return await run_for(duration, concurrency, poll)
+
+
+async def chat_ws(http, targets, duration, concurrency):
+    try:
+        import websockets
+    except ImportError:
+        print("  skipped: pip install websockets")
+        return None
+    ws_base = str(http.base_url).replace("http://", "ws://").rstrip("/")
+
+    async def session(worker_id, recorder, deadline):
+        room_id, user_id = targets.rooms[worker_id % len(targets.rooms)]
+        try:
+            async with websockets.connect(f"{ws_base}/ws/chat/{room_id}/{user_id}") as ws:
+                await ws.recv()  # connection confirmation
+                while time.monotonic() < deadline:
+                    content = uuid.uuid4().hex
+                    start = time.perf_counter()
+                    await ws.send(json.dumps({"type": "message", "sender_type": "wisher", "content": content}))
+                    while True:
+                        event = json.loads(await asyncio.wait_for(ws.recv(), timeout=10))
+                        if event.get("type") == "new_message" and event["message"]["content"] == content:
+                            break
+                    recorder.timed(start, True)
+        except Exception:
+            recorder.errors += 1
+
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+    await asyncio.gather(*(session(i, recorder, deadline) for i in range(concurrency)))
+    recorder.finished = time.perf_counter()
+    return recorder
+
+
+async def accept_storm(http, targets, duration, concurrency):
+    """Each round, `concurrency` agents race to accept the same order"""
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+    double_assigned = 0
+    rng = random.Random(0)
+
+    for order in range(STORM_ORDERS):
+        if time.monotonic() >= deadline:
+            break
+        agents = rng.sample(range(targets.agents), min(concurrency, targets.agents))
+
+        async def accept(agent):
+            start = time.perf_counter()
+            response = await http.post(
+                f"/api/agent/orders/bench_storm_{order}/accept",
+                headers=targets.agent_headers(agent),
+            )
+            # Losing the race is the expected outcome for all but one agent
+            recorder.timed(start, response.status_code in (200, 400, 409))
+            return response.status_code == 200
+
+        winners = sum(await asyncio.gather(*(accept(agent) for agent in agents)))
+        if winners != 1:
+            double_assigned += 1
+
+    recorder.finished = time.perf_counter()
+    if double_assigned:
+        print(f"  ❌ {double_assigned} orders did not have exactly one winner")
+        recorder.errors += double_assigned
+    return recorder
+
+
+WORKLOAD_FUNCTIONS = {
+    "location_pings": location_pings,
+    "tracking_polls": tracking_polls,
+    "chat_ws": chat_ws,
+    "accept_storm": accept_storm,
+}
+
+
+# ===================== REPORTING =====================
+
+def compare(results, baseline, tolerance):
+    """Print results next to the baseline; returns the regressions (a missing baseline is one)"""
+    regressions = []
+    print(f"\n{'workload':16} {'reqs':>8} {'errors':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>9}   baseline p95 / rps")
+    for name, summary in results.items():
+        base = baseline.get(name)
+        note = "no baseline"
+        if not base:
+            regressions.append(f"{name}: no baseline recorded for this scale (run with --update-baseline)")
+        else:
+            note = f"{base['p95_ms']:>8.1f} / {base['rps']:<8.1f}"
+            if summary["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{name}: p95 {summary['p95_ms']}ms vs baseline {base['p95_ms']}ms")
+            if summary["rps"] < base["rps"] / (1 + tolerance):
+                regressions.append(f"{name}: {summary['rps']} rps vs baseline {base['rps']} rps")
+        print(
+            f"{name:16} {summary['requests']:>8} {summary['errors']:>7} {summary['p50_ms']:>8.1f} "
+            f"{summary['p95_ms']:>8.1f} {summary['p99_ms']:>8.1f} {summary['rps']:>9.1f}   {note}"
+        )
+    return regressions
+
+
+async def run_workloads(base_url, scale, seed_value, workloads, duration, concurrency):
+    targets = Targets(generator_for(scale, seed_value))
+    results = {}
+    limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as http:
+        for name in workloads:
+            print(f"Running {name} for {duration}s with concurrency {concurrency}...")
+            recorder = await WORKLOAD_FUNCTIONS[name](http, targets, duration, concurrency)
+            if recorder is not None:
+                results[name] = recorder.summary()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="quickwish_bench")
+    parser.add_argument("--scale", choices=sorted(datagen.SCALES), default="small")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for generated data")
+    parser.add_argument("--reseed", action="store_true", help="Drop and regenerate the benchmark database")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS))
+    parser.add_argument("--duration", type=float, default=20, help="Seconds per workload")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--port", type=int, default=8055)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--base-url", help="Use an already running server instead of booting one")
+    parser.add_argument("--server-log", help="Write the booted server's output here")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression vs baseline (0.2 = 20%%)")
+    parser.add_argument("--update-baseline", "--record", action="store_true",
+                        help="Store this run as the baseline for the scale instead of gating on it")
+    args = parser.parse_args()
+
+    workloads = [w.strip() for w in args.workloads.split(",") if w.strip()]
+    unknown = [w for w in workloads if w not in WORKLOAD_FUNCTIONS]
+    if unknown:
+        sys.exit(f"Unknown workload(s): {', '.join(unknown)}")
+
+    ensure_seeded(args.mongo_url, args.db_name, args.scale, args.seed, args.reseed)
+
+    process = None
+    base_url = args.base_url
+    if not base_url:
+        process, base_url = start_server(args.mongo_url, args.db_name, args.port, args.workers, args.server_log)
+    try:
+        results = asyncio.run(run_workloads(base_url, args.scale, args.seed, workloads, args.duration, args.concurrency))
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+
+    baselines = json.loads(BASELINES_PATH.read_text()) if BASELINES_PATH.exists() else {}
+    regressions = compare(results, baselines.get(args.scale, {}), args.tolerance)
+
+    if args.update_baseline:
+        baselines.setdefault(args.scale, {}).update(results)
+        BASELINES_PATH.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        print(f"\nBaseline for '{args.scale}' written to {BASELINES_PATH}")
+        return 0
+    if any(summary["errors"] for summary in results.values()):
+        print("\n❌ FAIL: errors during the run")
+        return 1
+    if regressions:
+        print("\n❌ FAIL: regressions against baseline")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print("\n✅ PASS")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
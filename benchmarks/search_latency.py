@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Product search latency benchmark.
+
+Replays a fixed set of search queries against GET /api/products/search and
+checks the p95 latency against a budget. Exits non-zero when over budget so
+it can gate a deploy.
+
+    python benchmarks/search_latency.py --token <session_token> \
+        --base-url http://localhost:8001/api --budget-ms 150
+"""
+
+import argparse
+import statistics
+import sys
+import time
+
+import requests
+
+QUERIES = [
+    {"q": "milk"},
+    {"q": "fresh vegetables"},
+    {"q": "rice", "category": "grocery"},
+    {"q": "paracetamol"},
+    {"q": "biryani", "max_price": 300},
+    {"q": "bread eggs"},
+    {"category": "grocery"},
+    {"q": "organic", "min_price": 50, "max_price": 500},
+]
+
+# Bengaluru city centre, matching the seed data
+DEFAULT_LAT = 12.9716
+DEFAULT_LNG = 77.5946
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run(base_url, token, rounds, budget_ms, geo):
+    session = requests.Session()
+    session.headers["Authorization"] = f"Bearer {token}"
+    latencies = []
+    errors = 0
+
+    # Warm up connections and server-side caches
+    for params in QUERIES:
+        session.get(f"{base_url}/products/search", params=params, timeout=10)
+
+    for _ in range(rounds):
+        for params in QUERIES:
+            if geo:
+                params = {**params, "lat": DEFAULT_LAT, "lng": DEFAULT_LNG, "radius_km": 5}
+            start = time.perf_counter()
+            response = session.get(f"{base_url}/products/search", params=params, timeout=10)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                errors += 1
+
+    p50 = statistics.median(latencies)
+    p95 = percentile(latencies, 95)
+    p99 = percentile(latencies, 99)
+    print(f"requests: {len(latencies)}  errors: {errors}")
+    print(f"p50: {p50:.1f} ms  p95: {p95:.1f} ms  p99: {p99:.1f} ms  (budget p95 {budget_ms} ms)")
+
+    if errors:
+        print("❌ FAIL: search returned errors")
+        return 1
+    if p95 > budget_ms:
+        print("❌ FAIL: p95 latency over budget")
+        return 1
+    print("✅ PASS")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8001/api")
+    parser.add_argument("--token", required=True, help="Session token of any authenticated user")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--budget-ms", type=float, default=150.0)
+    parser.add_argument("--no-geo", action="store_true", help="Search all vendors instead of a 5 km radius")
+    args = parser.parse_args()
+    sys.exit(run(args.base_url.rstrip("/"), args.token, args.rounds, args.budget_ms, not args.no_geo))
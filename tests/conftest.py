@@ -0,0 +1,129 @@
+"""
+Shared fixtures for backend tests.
+
+Tests run the FastAPI app in-process against mongomock-motor, an in-memory
+stand-in for MongoDB, wrapped in CountingDatabase so each test can assert how
+many database calls a request made (see test_query_budgets.py).
+"""
+
+import asyncio
+import os
+import sys
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+# server.py reads these at import time; nothing connects until a query runs
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+# Collection methods that each cost (at least) one round trip to MongoDB
+COUNTED_METHODS = {
+    "find", "find_one", "find_one_and_update", "find_one_and_delete", "find_one_and_replace",
+    "insert_one", "insert_many", "update_one", "update_many", "replace_one",
+    "delete_one", "delete_many", "aggregate", "count_documents", "estimated_document_count",
+    "distinct", "bulk_write", "create_index",
+}
+
+
+class CountingCollection:
+    def __init__(self, collection, calls: Counter):
+        self._collection = collection
+        self._calls = calls
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in COUNTED_METHODS:
+            return attr
+
+        def counted(*args, **kwargs):
+            self._calls[f"{self._collection.name}.{name}"] += 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+class CountingDatabase:
+    """Wraps a Motor-style database and tallies calls per collection.method"""
+
+    def __init__(self, database):
+        self._database = database
+        self.calls = Counter()
+
+    def __getattr__(self, name):
+        return CountingCollection(getattr(self._database, name), self.calls)
+
+    def __getitem__(self, name):
+        return CountingCollection(self._database[name], self.calls)
+
+    @property
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+    @contextmanager
+    def counting(self):
+        """Yield a Counter of the calls made inside the block"""
+        before = Counter(self.calls)
+        window = Counter()
+        try:
+            yield window
+        finally:
+            window.update(self.calls - before)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = CountingDatabase(AsyncMongoMockClient()["test_database"])
+    monkeypatch.setattr(server, "db", database)
+    # In-process caches and indexes would otherwise leak results between tests
+    for value in vars(server).values():
+        if isinstance(value, server.LocalCache):
+            value.clear()
+    monkeypatch.setattr(server, "partner_index", server.geoindex.PartnerIndex())
+    monkeypatch.setattr(server, "trail_buffers", {})
+    monkeypatch.setattr(server, "order_watchers", {})
+    monkeypatch.setattr(server, "order_channels", server.ConnectionManager())
+    monkeypatch.setattr(server, "otp_store", server.otp.MongoOTPStore(database))
+    return database
+
+
+@pytest.fixture
+def client(db):
+    # Not used as a context manager, so startup hooks (index builds, sweepers) do not run
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def make_user(db):
+    """Insert a user with a live session and return its Authorization header"""
+
+    def make(user_id: str, partner_type=None, **fields):
+        token = f"token_{user_id}"
+        run(db.users.insert_one({
+            "user_id": user_id,
+            "name": f"User {user_id}",
+            "picture": None,
+            "phone": "+910000000000",
+            "partner_type": partner_type,
+            "created_at": datetime.now(timezone.utc),
+            **fields,
+        }))
+        run(db.user_sessions.insert_one({
+            "user_id": user_id,
+            "session_token": token,
+            "expires_at": datetime.now(timezone.utc) + timedelta(days=1),
+        }))
+        return {"Authorization": f"Bearer {token}"}
+
+    return make
@@ -0,0 +1,43 @@
+"""
+All-day appointments block the partner's whole day.
+"""
+
+from datetime import date, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def partner(make_user):
+    return make_user("partner", "agent")
+
+
+def book(client, headers, day, time=None):
+    return client.post("/api/appointments", headers=headers, json={
+        "service_title": "Cleaning",
+        "customer_name": "Asha",
+        "scheduled_date": day,
+        "scheduled_time": time,
+        "duration_minutes": 60,
+        "location": "Indiranagar",
+        "price": 500,
+    })
+
+
+def availability_slots(body):
+    return [entry["slots"] for entry in body["days"]]
+
+
+def test_all_day_block_conflicts_and_leaves_no_free_slots(client, partner):
+    day = (date.today() + timedelta(days=3)).isoformat()
+    assert book(client, partner, day).status_code == 200
+
+    assert book(client, partner, day, "10:00").status_code == 409
+    availability = client.get(f"/api/partners/partner/availability?date_from={day}&days=1", headers=partner).json()
+    assert all(not slots for slots in availability_slots(availability))
+
+
+def test_all_day_block_conflicts_with_timed_appointment(client, partner):
+    day = (date.today() + timedelta(days=3)).isoformat()
+    assert book(client, partner, day, "10:00").status_code == 200
+    assert book(client, partner, day).status_code == 409
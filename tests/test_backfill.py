@@ -0,0 +1,25 @@
+"""
+Backfills bring old documents in line with what current queries expect.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import backfill
+
+from tests.conftest import run
+
+
+def test_order_updated_at_defaults_to_created_at(db, monkeypatch):
+    monkeypatch.setattr(backfill, "db", db)
+    created = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    synced = created + timedelta(days=1)
+    run(db.shop_orders.insert_many([
+        {"order_id": "old", "vendor_id": "v", "created_at": created},
+        {"order_id": "synced", "vendor_id": "v", "created_at": created, "updated_at": synced},
+    ]))
+
+    run(backfill.backfill_order_updated_at())
+
+    orders = {o["order_id"]: o for o in run(db.shop_orders.find({}).to_list(None))}
+    assert orders["old"]["updated_at"].replace(tzinfo=timezone.utc) == created
+    assert orders["synced"]["updated_at"].replace(tzinfo=timezone.utc) == synced
@@ -0,0 +1,40 @@
+"""
+Bulk product import: uploads that fail part way report what was written.
+"""
+
+import json
+
+import server
+
+from tests.conftest import run
+
+
+def rows(count, start=0):
+    return [{"name": f"Product {i}", "price": 10, "category": "misc"} for i in range(start, start + count)]
+
+
+def upload(client, headers, body):
+    return client.post("/api/vendor/products/bulk", content=body, headers={**headers, "Content-Type": "application/json"})
+
+
+def test_limit_after_written_batches_reports_rows(client, db, make_user, monkeypatch):
+    vendor = make_user("vendor", "vendor")
+    monkeypatch.setattr(server, "BULK_WRITE_BATCH_SIZE", 2)
+    monkeypatch.setattr(server, "BULK_IMPORT_MAX_ROWS", 5)
+    server.catalog_cache.set("vendor", {"products": [], "total": 0, "version": "stale"})
+
+    response = upload(client, vendor, json.dumps(rows(7)))
+
+    body = response.json()
+    assert response.status_code == 413
+    assert (body["created"], body["skipped"]) == (4, 1)
+    assert run(db.products.count_documents({"vendor_id": "vendor"})) == 4
+    assert server.catalog_cache.get("vendor") is None
+
+
+def test_error_before_any_write_fails_cleanly(client, db, make_user):
+    vendor = make_user("vendor", "vendor")
+    response = upload(client, vendor, json.dumps(rows(3))[:-5])
+
+    assert response.status_code == 400 and "results" not in response.json()
+    assert run(db.products.count_documents({})) == 0
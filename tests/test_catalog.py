@@ -0,0 +1,34 @@
+"""
+Vendor catalogs are served from a per-worker cache; catalogs larger than the
+cache still page through every product and report their real size.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import server
+
+from tests.conftest import run
+
+
+def test_catalog_past_the_cache_cap(client, db, make_user, monkeypatch):
+    monkeypatch.setattr(server, "CATALOG_MAX_PRODUCTS", 3)
+    vendor = make_user("vendor", "vendor")
+    now = datetime.now(timezone.utc)
+    run(db.products.insert_many([
+        {"product_id": f"p{i}", "vendor_id": "vendor", "name": f"Item {i}", "price": 10.0,
+         "category": "food", "in_stock": True, "created_at": now - timedelta(minutes=i)}
+        for i in range(5)
+    ]))
+
+    seen = []
+    for page in (1, 2, 3):
+        response = client.get("/api/vendor/products", params={"page": page, "limit": 2}, headers=vendor)
+        assert response.status_code == 200
+        assert response.headers["X-Total-Count"] == "5"
+        seen += [p["product_id"] for p in response.json()]
+    assert seen == [f"p{i}" for i in range(5)]
+
+    # Pages read past the cache still answer If-None-Match
+    etag = response.headers["ETag"]
+    repeat = client.get("/api/vendor/products", params={"page": 3, "limit": 2}, headers={**vendor, "If-None-Match": etag})
+    assert repeat.status_code == 304
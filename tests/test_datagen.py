@@ -0,0 +1,55 @@
+"""
+The synthetic data generator: same seed, same data; references that resolve.
+"""
+
+from datetime import datetime, timezone
+
+import datagen
+import server
+
+from tests.conftest import run
+
+BASE_TIME = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def generate(seed=7, **kwargs):
+    generator = datagen.DataGenerator(seed=seed, base_time=BASE_TIME, cities=["bengaluru", "mumbai"], **kwargs)
+    return {name: list(docs) for name, docs in generator.collections().items()}
+
+
+def test_same_seed_same_documents():
+    assert generate(seed=7) == generate(seed=7)
+    assert generate(seed=7)["shop_orders"] != generate(seed=8)["shop_orders"]
+
+
+def test_references_resolve():
+    data = generate(counts={"customers": 30, "agents": 12, "orders": 80, "wishes": 40, "rooms": 15, "messages": 90})
+    users = {user["user_id"]: user for user in data["users"]}
+    agents = {user_id for user_id, user in users.items() if user["partner_type"] == "agent"}
+
+    assert {session["user_id"] for session in data["user_sessions"]} == set(users)
+    for order in data["shop_orders"]:
+        assert order["user_id"] in users and order["vendor_id"] in users
+        assert all(step["status"] in server.ORDER_TRANSITIONS for step in order["status_history"])
+        assert (order["assigned_agent_id"] in agents) == (order["status"] in datagen.ORDER_ASSIGNED)
+    for earning in data["earnings"]:
+        assert earning["partner_id"] in agents
+
+    rooms = {room["room_id"]: room for room in data["chat_rooms"]}
+    wishes = {wish["wish_id"]: wish for wish in data["wishes"]}
+    assert len(rooms) == 15
+    for room in rooms.values():
+        assert wishes[room["wish_id"]]["accepted_by"] == room["partner_id"]
+    assert len(data["messages"]) == 90
+    for message in data["messages"]:
+        room = rooms[message["room_id"]]
+        assert message["sender_id"] in (room["wisher_id"], room["partner_id"])
+
+
+def test_async_write_batches(db):
+    generator = datagen.DataGenerator(seed=1, base_time=BASE_TIME)
+    with db.counting() as calls:
+        written = run(datagen.write(db, {"wishes": generator.wishes()}, batch_size=8))
+
+    assert written == {"wishes": generator.counts["wishes"]}
+    assert calls == {"wishes.insert_many": -(-generator.counts["wishes"] // 8)}
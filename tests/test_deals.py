@@ -0,0 +1,35 @@
+"""
+Deal buttons answer as soon as the status change is written; room pushes go
+out in the background.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timezone
+
+import server
+
+from tests.conftest import run
+
+
+def test_accept_does_not_wait_on_chat_sockets(client, db, make_user, monkeypatch):
+    partner = make_user("partner", "agent")
+    run(db.deals.insert_one({
+        "deal_id": "deal_1", "partner_id": "partner", "status": "negotiating", "room_id": "room_1",
+        "current_price": 100, "offer_count": 1, "created_at": datetime.now(timezone.utc),
+    }))
+
+    class Stalled:
+        async def send_json(self, message):
+            await asyncio.sleep(3600)
+
+    manager = server.ConnectionManager()
+    manager.active_connections["room_1"] = {"customer": Stalled()}
+    monkeypatch.setattr(server, "manager", manager)
+    monkeypatch.setattr(server, "WEBSOCKET_SEND_TIMEOUT", 2)
+
+    start = time.perf_counter()
+    response = client.post("/api/deals/deal_1/accept", headers=partner)
+    assert response.status_code == 200
+    assert time.perf_counter() - start < 1
+    assert run(db.deals.find_one({"deal_id": "deal_1"}))["status"] == "accepted"
@@ -0,0 +1,96 @@
+"""
+Sharded slot counters: bookings may span shards, resizes keep every shard
+consistent, and holds from before sharding give their slots back.
+"""
+
+from datetime import datetime, timezone
+
+import pytest
+
+from tests.conftest import run
+
+
+@pytest.fixture
+def promoter(make_user):
+    return make_user("promoter", "promoter")
+
+
+@pytest.fixture
+def event(db):
+    run(db.promoter_events.insert_one({
+        "event_id": "e1",
+        "promoter_id": "promoter",
+        "event_type": "trip",
+        "title": "Trip",
+        "description": "",
+        "price": 10.0,
+        "total_slots": 6,
+        "booked_slots": 0,
+        "images": [],
+        "status": "active",
+        "created_at": datetime.now(timezone.utc),
+    }))
+    return "e1"
+
+
+def shard(client, event, promoter, shards=3):
+    assert client.post(f"/api/promoter/events/{event}/shard-counter", json={"shards": shards}, headers=promoter).status_code == 200
+
+
+def availability(client, event, headers):
+    return client.get(f"/api/events/{event}/availability", headers=headers).json()
+
+
+def edit(client, event, promoter, total_slots):
+    body = {"event_type": "trip", "title": "Trip", "description": "", "price": 10.0, "total_slots": total_slots}
+    return client.put(f"/api/promoter/events/{event}", json=body, headers=promoter)
+
+
+def test_booking_spans_shards(client, make_user, promoter, event):
+    customer = make_user("customer")
+    shard(client, event, promoter)  # 2 slots per shard
+
+    assert client.post(f"/api/events/{event}/book", json={"slots": 5}, headers=customer).status_code == 200
+    assert availability(client, event, customer)["available_slots"] == 1
+    assert client.post(f"/api/events/{event}/book", json={"slots": 2}, headers=customer).status_code == 409
+    assert availability(client, event, customer)["available_slots"] == 1
+
+
+def test_resize_spreads_over_shards(client, db, make_user, promoter, event):
+    customer = make_user("customer")
+    shard(client, event, promoter)
+    client.post(f"/api/events/{event}/book", json={"slots": 3}, headers=customer)
+
+    assert edit(client, event, promoter, 2).status_code == 409
+    assert edit(client, event, promoter, 4).status_code == 200
+    shards = run(db.event_slot_shards.find({"event_id": event}).to_list(None))
+    assert sum(s["capacity"] for s in shards) == 4 and all(s["booked"] <= s["capacity"] for s in shards)
+    assert edit(client, event, promoter, 9).status_code == 200
+    assert availability(client, event, customer)["available_slots"] == 6
+
+
+def test_hold_from_before_sharding_is_returned(client, make_user, promoter, event):
+    customer = make_user("customer")
+    hold_id = client.post(f"/api/events/{event}/holds", json={"slots": 3}, headers=customer).json()["hold_id"]
+    shard(client, event, promoter)
+    assert availability(client, event, customer)["available_slots"] == 3
+
+    assert client.delete(f"/api/events/holds/{hold_id}", headers=customer).status_code == 200
+    counts = availability(client, event, customer)
+    assert (counts["booked_slots"], counts["available_slots"]) == (0, 6)
+
+
+def test_confirming_a_hold_on_a_gone_event_releases_it(client, db, make_user, promoter, event):
+    customer = make_user("customer")
+    cancelled = client.post(f"/api/events/{event}/holds", json={"slots": 2}, headers=customer).json()["hold_id"]
+    deleted = client.post(f"/api/events/{event}/holds", json={"slots": 1}, headers=customer).json()["hold_id"]
+
+    assert client.delete(f"/api/promoter/events/{event}", headers=promoter).status_code == 200
+    assert client.post(f"/api/events/holds/{cancelled}/confirm", headers=customer).status_code == 410
+    assert run(db.promoter_events.find_one({"event_id": event}))["booked_slots"] == 1
+
+    run(db.promoter_events.delete_one({"event_id": event}))
+    assert client.post(f"/api/events/holds/{deleted}/confirm", headers=customer).status_code == 404
+    holds = run(db.event_holds.find({}, {"_id": 0, "status": 1}).to_list(None))
+    assert [h["status"] for h in holds] == ["released", "released"]
+    assert run(db.event_bookings.count_documents({})) == 0
@@ -0,0 +1,59 @@
+"""
+PartnerIndex queries agree with a brute-force scan over the same points.
+"""
+
+import random
+
+import geoindex
+
+
+def build(count=3000, seed=1):
+    rng = random.Random(seed)
+    index = geoindex.PartnerIndex()
+    points = {}
+    for i in range(count):
+        lat, lng = rng.gauss(12.97, 0.1), rng.gauss(77.59, 0.1)
+        status = rng.choice(["available", "busy"])
+        index.upsert(f"p{i}", lat, lng, status=status)
+        points[f"p{i}"] = (lat, lng, status)
+    # Exercise slot reuse and moves between cells
+    for i in range(0, count, 7):
+        index.remove(f"p{i}")
+        del points[f"p{i}"]
+    for i in range(1, count, 11):
+        if f"p{i}" in points:
+            lat, lng = rng.gauss(12.97, 0.1), rng.gauss(77.59, 0.1)
+            index.upsert(f"p{i}", lat, lng)
+            points[f"p{i}"] = (lat, lng, points[f"p{i}"][2])
+    return index, points
+
+
+def available(attrs):
+    return attrs["status"] == "available"
+
+
+def test_queries_match_brute_force():
+    index, points = build()
+    rng = random.Random(2)
+    assert len(index) == len(points)
+    for _ in range(50):
+        lat, lng = rng.gauss(12.97, 0.2), rng.gauss(77.59, 0.2)
+        expected = sorted(
+            (geoindex.haversine_km(lat, lng, p_lat, p_lng), partner_id)
+            for partner_id, (p_lat, p_lng, status) in points.items() if status == "available"
+        )
+        radius = rng.uniform(0.5, 20)
+        assert index.nearest(lat, lng, k=5, where=available) == expected[:5]
+        assert index.nearest(lat, lng, k=3, max_km=2, where=available) == [hit for hit in expected if hit[0] <= 2][:3]
+        assert index.radius(lat, lng, radius, where=available) == [hit for hit in expected if hit[0] <= radius]
+
+
+def test_rebuild_keeps_newer_entries():
+    index = geoindex.PartnerIndex()
+    index.upsert("stale", 12.9, 77.5, seen=1)
+    index.upsert("fresh", 12.9, 77.6, seen=5)
+
+    index.rebuild([("stored", 13.0, 77.5, {"seen": 2})], keep=lambda attrs: attrs["seen"] >= 3)
+
+    assert set(index.slots) == {"stored", "fresh"}
+    assert index.position("fresh") == (12.9, 77.6)
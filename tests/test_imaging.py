@@ -0,0 +1,60 @@
+"""
+Uploads are verified and resized in worker processes; failures come back as
+(status, detail) pairs rather than exceptions.
+"""
+
+import base64
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+
+import imaging
+import server
+
+
+def png(width=4, height=4) -> bytes:
+    output = BytesIO()
+    Image.new("RGB", (width, height), (200, 30, 30)).save(output, "PNG")
+    return output.getvalue()
+
+
+def claiming(data: bytes, width: int, height: int) -> bytes:
+    """The same PNG with an IHDR that claims other dimensions"""
+    header = b"IHDR" + struct.pack(">II", width, height) + data[24:29]
+    return data[:12] + header + struct.pack(">I", zlib.crc32(header)) + data[33:]
+
+
+def test_decode_upload_accepts_a_png():
+    upload = imaging.decode_upload("data:image/png;base64," + base64.b64encode(png()).decode(), 1024 * 1024)
+    assert upload["content_type"] == "image/png"
+
+
+def test_decompression_bomb_is_rejected():
+    bomb = claiming(png(), 20000, 20000)
+    assert len(bomb) < 200
+    assert imaging.decode_upload(base64.b64encode(bomb).decode(), 1024 * 1024) == {"error": (413, "Image dimensions too large")}
+    assert imaging.render_variant(bomb, 128, "jpeg") == {"error": (413, "Image dimensions too large")}
+
+
+def test_render_variant_fits_the_box():
+    variant = imaging.render_variant(png(400, 200), 128, "webp")
+    with Image.open(BytesIO(variant["data"])) as image:
+        assert (image.format, image.size) == ("WEBP", (128, 64))
+
+
+def test_variant_cache_stays_consistent_across_threads(tmp_path):
+    cache = server.MediaVariantCache(tmp_path, max_bytes=50_000)
+
+    def work(worker):
+        for i in range(200):
+            key = f"{(worker * 7 + i) % 40}.jpeg"
+            if cache.get(key) is None:
+                cache.put(key, bytes(1000 + worker))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(work, range(8)))
+
+    assert cache._total == sum(cache._entries.values()) <= 50_000
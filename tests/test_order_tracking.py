@@ -0,0 +1,108 @@
+"""
+Delivery location pings go to the live location store and out on the order's
+channel, without writing the order document.
+"""
+
+from datetime import datetime, timezone
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+import server
+
+from tests.conftest import run
+
+
+@pytest.fixture
+def order(db):
+    run(db.shop_orders.insert_one({
+        "order_id": "o1",
+        "user_id": "cust",
+        "vendor_id": "vend",
+        "assigned_agent_id": None,
+        "delivery_type": "agent_delivery",
+        "status": "ready",
+        "status_history": [],
+        "created_at": datetime.now(timezone.utc),
+    }))
+
+
+def test_customer_receives_location_and_status(client, db, make_user, order):
+    agent = make_user("agent", "agent", agent_type="mobile", partner_status="available")
+    customer = make_user("cust")
+
+    with client.websocket_connect("/ws/orders/o1?token=token_cust") as ws:
+        assert ws.receive_json()["location"] is None
+        assert client.post("/api/agent/orders/o1/accept", headers=agent).status_code == 200
+        assert ws.receive_json()["status"] == "picked_up"
+
+        client.put("/api/agent/orders/o1/location", json={"lat": 12.9, "lng": 77.6}, headers=agent)
+        with db.counting() as calls:
+            response = client.put("/api/agent/orders/o1/location", json={"lat": 12.91, "lng": 77.6}, headers=agent)
+        assert response.status_code == 200
+        assert not any(call.startswith("shop_orders.") for call in calls)
+        assert ws.receive_json()["lat"] == 12.9
+        pushed = ws.receive_json()
+        assert (pushed["type"], pushed["order_id"], pushed["lat"], pushed["lng"]) == ("agent_location", "o1", 12.91, 77.6)
+        assert client.get("/api/orders/o1/location", headers=customer).json()["location"]["lat"] == 12.91
+
+        assert client.put("/api/agent/orders/o1/status", json={"status": "on_the_way"}, headers=agent).status_code == 200
+        assert client.put("/api/agent/orders/o1/status", json={"status": "delivered"}, headers=agent).status_code == 200
+        assert ws.receive_json()["status"] == "on_the_way"
+        assert ws.receive_json()["status"] == "delivered"
+        assert server.order_watchers == {}
+
+    assert "agent_location" not in run(db.shop_orders.find_one({"order_id": "o1"}))
+
+
+def test_only_parties_can_follow(client, make_user, order):
+    make_user("stranger")
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/ws/orders/o1?token=token_stranger") as ws:
+            ws.receive_json()
+    assert client.get("/api/orders/o1/location", headers=make_user("other")).status_code == 403
+    response = client.put("/api/agent/orders/o1/location", json={"lat": 1, "lng": 1}, headers=make_user("agent", "agent"))
+    assert response.status_code == 404
+
+
+def test_agent_is_not_refused_on_stale_parties(client, db, make_user, order):
+    agent = make_user("agent", "agent")
+    server.order_parties_cache.set("o1", {"user_id": "cust", "vendor_id": "vend", "assigned_agent_id": None})
+    # Accepted through another worker: this worker's cache never heard about it
+    run(db.shop_orders.update_one({"order_id": "o1"}, {"$set": {"assigned_agent_id": "agent", "status": "picked_up"}}))
+
+    response = client.put("/api/agent/orders/o1/location", json={"lat": 12.9, "lng": 77.6}, headers=agent)
+    assert response.status_code == 200
+
+
+def test_broadcast_skips_sockets_that_fail():
+    class Closed:
+        async def send_json(self, message):
+            raise RuntimeError("closed")
+
+    class Open:
+        def __init__(self):
+            self.received = []
+
+        async def send_json(self, message):
+            self.received.append(message)
+
+    channels = server.ConnectionManager()
+    listener = Open()
+    channels.active_connections["o1"] = {"gone": Closed(), "here": listener}
+    run(channels.broadcast_to_room({"type": "ping"}, "o1"))
+    assert listener.received == [{"type": "ping"}]
+
+
+def test_agents_only_accept_confirmed_agent_deliveries(client, db, make_user, order):
+    agent = make_user("agent", "agent", agent_type="mobile", partner_status="available")
+
+    run(db.shop_orders.update_one({"order_id": "o1"}, {"$set": {"status": "pending"}}))
+    assert client.post("/api/agent/orders/o1/accept", headers=agent).status_code == 400
+
+    run(db.shop_orders.update_one({"order_id": "o1"}, {"$set": {"status": "ready", "delivery_type": "vendor_delivery"}}))
+    assert client.post("/api/agent/orders/o1/accept", headers=agent).status_code == 400
+    assert run(db.shop_orders.find_one({"order_id": "o1"}))["assigned_agent_id"] is None
+
+    run(db.shop_orders.update_one({"order_id": "o1"}, {"$set": {"delivery_type": "agent_delivery"}}))
+    assert client.post("/api/agent/orders/o1/accept", headers=agent).status_code == 200
@@ -0,0 +1,92 @@
+"""
+OTP codes are single use, limited in guesses and rate limited, in every store.
+"""
+
+import pytest
+
+import otp
+import server
+
+from tests.conftest import run
+
+
+@pytest.fixture(params=["mongo", "memory"])
+def store(request, db, monkeypatch):
+    store = otp.MongoOTPStore(db) if request.param == "mongo" else otp.MemoryOTPStore()
+    monkeypatch.setattr(server, "otp_store", store)
+    return store
+
+
+@pytest.fixture
+def behind_proxy(monkeypatch):
+    # TestClient connects as "testclient"; treat it as the ingress
+    monkeypatch.setattr(server, "is_trusted_proxy", lambda host: host == "testclient")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    current = [1_700_000_000.0]
+    monkeypatch.setattr(otp, "now", lambda: current[0])
+    return current
+
+
+def send(client, phone="+919900000001", ip="10.0.0.1"):
+    return client.post("/api/auth/send-otp", json={"phone": phone}, headers={"X-Forwarded-For": ip})
+
+
+def verify(client, code, phone="+919900000001"):
+    return client.post("/api/auth/verify-otp", json={"phone": phone, "otp": code})
+
+
+def test_code_is_hashed_and_single_use(client, db, store):
+    assert send(client).json()["debug_otp"] == "123456"
+    if isinstance(store, otp.MongoOTPStore):
+        stored = run(db.otp_codes.find_one({}))
+        assert "123456" not in stored.values()
+
+    assert verify(client, "000000").status_code == 400
+    assert verify(client, "123456").status_code == 200
+    assert verify(client, "123456").status_code == 400
+
+
+def test_guesses_are_limited(client, store):
+    send(client)
+    for _ in range(server.OTP_MAX_ATTEMPTS):
+        assert verify(client, "000000").status_code == 400
+    assert verify(client, "123456").status_code == 429
+
+
+def test_send_is_rate_limited_per_phone_in_any_format(client, store):
+    burst = server.OTP_SEND_PHONE_LIMIT[0]
+    formats = ["+919900000001", "9900000001", "+91 99000 00001", "099000-00001"]
+    for i in range(burst):
+        assert send(client, phone=formats[i % len(formats)]).status_code == 200
+    response = send(client, phone=formats[-1])
+    assert response.status_code == 429 and int(response.headers["Retry-After"]) > 0
+
+
+def test_send_is_rate_limited_per_ip_behind_proxy(client, store, behind_proxy):
+    for i in range(server.OTP_SEND_IP_LIMIT[0]):
+        assert send(client, phone=f"+9199000001{i:02}").status_code == 200
+    assert send(client, phone="+919900000099").status_code == 429
+    assert send(client, phone="+919900000099", ip="10.0.0.2").status_code == 200
+
+
+def test_forwarded_for_is_ignored_from_untrusted_peers(client, store):
+    for i in range(server.OTP_SEND_IP_LIMIT[0]):
+        assert send(client, phone=f"+9199000001{i:02}", ip=f"10.1.0.{i}").status_code == 200
+    assert send(client, phone="+919900000099", ip="10.2.0.1").status_code == 429
+
+
+def test_bucket_refills(store, clock):
+    capacity, per_second = 2, 1 / 60
+    assert run(store.take("k", capacity, per_second))[0]
+    assert run(store.take("k", capacity, per_second))[0]
+    allowed, wait = run(store.take("k", capacity, per_second))
+    assert not allowed and wait == 60
+
+    clock[0] += 30
+    assert not run(store.take("k", capacity, per_second))[0]
+    clock[0] += 31
+    assert run(store.take("k", capacity, per_second)) == (True, 0)
+    assert not run(store.take("k", capacity, per_second))[0]
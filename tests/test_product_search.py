@@ -0,0 +1,21 @@
+"""
+Search facets: price buckets carry both bounds and a string label, whatever range they cover.
+"""
+
+from tests.conftest import run
+
+
+def test_price_ranges_have_one_shape(client, db, make_user):
+    customer = make_user("cust")
+    run(db.products.insert_many([
+        {"product_id": f"p{i}", "vendor_id": "v", "name": f"Item {i}", "price": price, "category": "food", "in_stock": True}
+        for i, price in enumerate([20, 75, 80, 7500])
+    ]))
+
+    response = client.get("/api/products/search", headers=customer)
+    assert response.status_code == 200
+    assert response.json()["facets"]["price_ranges"] == [
+        {"label": "0-50", "min": 0, "max": 50, "count": 1},
+        {"label": "50-100", "min": 50, "max": 100, "count": 2},
+        {"label": "5000+", "min": 5000, "max": None, "count": 1},
+    ]
@@ -0,0 +1,180 @@
+"""
+Per-route database call budgets.
+
+Each case seeds enough rows (ITEMS) that a per-item lookup would blow well past
+the budget, then asserts the number of collection calls one request makes.
+Budgets include the two lookups every authenticated request pays for
+(user_sessions + users).
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from tests.conftest import run
+
+ITEMS = 12
+AUTH_CALLS = 2
+
+
+def seed_wishes(db, make_user):
+    headers = make_user("agent_1", "agent", agent_services=["delivery"])
+    for i in range(ITEMS):
+        make_user(f"wisher_{i}")
+        run(db.wishes.insert_one({
+            "wish_id": f"wish_{i}",
+            "user_id": f"wisher_{i}",
+            "wish_type": "delivery",
+            "title": f"Wish {i}",
+            "location": {"lat": 12.97, "lng": 77.59},
+            "radius_km": 5,
+            "remuneration": 100,
+            "is_immediate": True,
+            "status": "pending",
+            "accepted_by": None,
+            "linked_order_id": None,
+            "created_at": datetime.now(timezone.utc) - timedelta(minutes=i),
+        }))
+    return headers
+
+
+def seed_accepted_wishes(db, make_user):
+    headers = seed_wishes(db, make_user)
+    run(db.wishes.update_many({}, {"$set": {"status": "accepted", "accepted_by": "agent_1"}}))
+    return headers
+
+
+def seed_chat_rooms(db, make_user):
+    headers = make_user("partner_1", "agent")
+    for i in range(ITEMS):
+        make_user(f"wisher_{i}")
+        run(db.chat_rooms.insert_one({
+            "room_id": f"room_{i}",
+            "wish_id": f"wish_{i}",
+            "wisher_id": f"wisher_{i}",
+            "partner_id": "partner_1",
+            "status": "active",
+            "created_at": datetime.now(timezone.utc) - timedelta(minutes=i),
+        }))
+        run(db.wishes.insert_one({"wish_id": f"wish_{i}", "user_id": f"wisher_{i}", "title": f"Wish {i}"}))
+        run(db.messages.insert_one({
+            "message_id": f"msg_{i}",
+            "room_id": f"room_{i}",
+            "sender_id": f"wisher_{i}",
+            "sender_type": "wisher",
+            "content": "hello",
+            "created_at": datetime.now(timezone.utc),
+        }))
+    return headers
+
+
+def seed_bookings(db, make_user):
+    headers = make_user("promoter_1", "promoter")
+    for i in range(ITEMS):
+        run(db.promoter_events.insert_one({"event_id": f"event_{i}", "promoter_id": "promoter_1", "title": f"Event {i}"}))
+        # Older bookings carry no event_title and need enriching
+        run(db.event_bookings.insert_one({
+            "booking_id": f"booking_{i}",
+            "event_id": f"event_{i}",
+            "promoter_id": "promoter_1",
+            "user_id": "customer_1",
+            "slots": 1,
+            "amount": 100,
+            "created_at": datetime.now(timezone.utc) - timedelta(minutes=i),
+        }))
+    return headers
+
+
+def seed_products(db, make_user):
+    headers = make_user("vendor_1", "vendor")
+    make_user("customer_1")
+    for i in range(ITEMS):
+        run(db.products.insert_one({
+            "product_id": f"prod_{i}",
+            "vendor_id": "vendor_1",
+            "name": f"Product {i}",
+            "price": 10 + i,
+            "in_stock": True,
+            "created_at": datetime.now(timezone.utc) - timedelta(minutes=i),
+        }))
+    return headers
+
+
+def seed_deals(db, make_user):
+    headers = make_user("partner_1", "agent")
+    for i in range(ITEMS):
+        run(db.deals.insert_one({
+            "deal_id": f"deal_{i}",
+            "partner_id": "partner_1",
+            "status": "negotiating",
+            "room_id": f"room_{i}",
+            "offer_count": 2,
+            "created_at": datetime.now(timezone.utc) - timedelta(minutes=i),
+        }))
+    return headers
+
+
+def seed_appointments(db, make_user):
+    headers = make_user("partner_1", "agent")
+    start = datetime.now(timezone.utc) + timedelta(days=1)
+    for i in range(ITEMS):
+        run(db.appointments.insert_one({
+            "appointment_id": f"apt_{i}",
+            "partner_id": "partner_1",
+            "service_title": "Cleaning",
+            "start": start + timedelta(hours=i),
+            "end": start + timedelta(hours=i, minutes=45),
+            "status": "upcoming",
+            "created_at": datetime.now(timezone.utc),
+        }))
+    return headers
+
+
+CASES = [
+    pytest.param("/api/agent/available-wishes", seed_wishes, AUTH_CALLS + 2, id="available-wishes"),
+    pytest.param("/api/agent/wishes", seed_accepted_wishes, AUTH_CALLS + 2, id="agent-wishes"),
+    pytest.param("/api/partner/chat/rooms", seed_chat_rooms, AUTH_CALLS + 4, id="partner-chat-rooms"),
+    pytest.param("/api/chat/my-rooms", seed_chat_rooms, AUTH_CALLS + 3, id="my-chat-rooms"),
+    pytest.param("/api/promoter/bookings", seed_bookings, AUTH_CALLS + 3, id="promoter-bookings"),
+    pytest.param("/api/promoter/bookings/summary", seed_bookings, AUTH_CALLS + 2, id="promoter-bookings-summary"),
+    pytest.param("/api/vendor/products", seed_products, AUTH_CALLS + 1, id="vendor-products"),
+    pytest.param("/api/deals/my-deals", seed_deals, AUTH_CALLS + 1, id="my-deals"),
+    pytest.param("/api/appointments", seed_appointments, AUTH_CALLS + 1, id="appointments"),
+]
+
+
+@pytest.mark.parametrize("path, seed, budget", CASES)
+def test_route_query_budget(client, db, make_user, path, seed, budget):
+    headers = seed(db, make_user)
+
+    with db.counting() as calls:
+        response = client.get(path, headers=headers)
+
+    assert response.status_code == 200, response.text
+    assert sum(calls.values()) <= budget, f"{path} made {sum(calls.values())} calls (budget {budget}): {dict(calls)}"
+
+
+def test_counting_database_tallies_calls(db):
+    with db.counting() as calls:
+        run(db.users.find_one({"user_id": "nobody"}))
+        run(db.users.find({}).to_list(10))
+        run(db.wishes.count_documents({}))
+
+    assert calls == {"users.find_one": 1, "users.find": 1, "wishes.count_documents": 1}
+
+
+def test_available_wishes_shared_per_service_and_cell(client, db, make_user):
+    seed_wishes(db, make_user)
+    # Outside its own 5km radius of the agents below (~11km north)
+    run(db.wishes.update_one({"wish_id": "wish_0"}, {"$set": {"location": {"lat": 13.07, "lng": 77.59}}}))
+    near = {"current_location": {"lat": 12.9701, "lng": 77.5901}}
+    first = make_user("agent_a", "agent", agent_services=["delivery"], **near)
+    second = make_user("agent_b", "agent", agent_services=["delivery"], **near)
+
+    response = client.get("/api/agent/available-wishes", headers=first)
+    assert [wish["wish_id"] for wish in response.json()] == [f"wish_{i}" for i in range(1, ITEMS)]
+
+    with db.counting() as calls:
+        response = client.get("/api/agent/available-wishes", headers=second)
+    assert response.status_code == 200
+    assert "wishes.find" not in calls
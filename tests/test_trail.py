@@ -0,0 +1,118 @@
+"""
+Trail chunks round-trip exactly and Douglas-Peucker keeps the shape; pings
+are flushed into hourly buckets and read back with the unflushed ones.
+"""
+
+import math
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+import server
+import trail
+
+from tests.conftest import run
+
+
+def walk(count=600):
+    points = []
+    t, lat, lng = 1_700_000_000.0, 12.97, 77.59
+    for i in range(count):
+        t += 1
+        lat += 0.00005
+        lng += 0.00002 * math.sin(i / 50)
+        points.append((t, round(lat, 5), round(lng, 5)))
+    return points
+
+
+def test_pack_round_trips():
+    points = walk()
+    assert trail.unpack(trail.pack(points)) == points
+    assert trail.unpack(trail.pack([])) == []
+    # Deltas of a steady walk take a few bytes per point
+    assert len(trail.pack(points)) < 6 * len(points)
+
+
+def test_douglas_peucker_keeps_endpoints_and_corners():
+    points = walk()
+    kept = trail.douglas_peucker(points, 8)
+    assert kept[0] == points[0] and kept[-1] == points[-1]
+    assert len(kept) < len(points) / 10
+
+    corner = [(0, 12.97, 77.59), (1, 12.97, 77.591), (2, 12.97, 77.592), (3, 12.971, 77.592), (4, 12.972, 77.592)]
+    assert trail.douglas_peucker(corner, 5) == [corner[0], corner[2], corner[4]]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Pin server.datetime.now() to a settable time (a few minutes before the next hour)"""
+    hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    state = {"now": hour - timedelta(minutes=2)}
+
+    class Clock(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return state["now"]
+
+        @classmethod
+        def fromtimestamp(cls, *args, **kwargs):
+            return datetime.fromtimestamp(*args, **kwargs)
+
+    monkeypatch.setattr(server, "datetime", Clock)
+    return state
+
+
+def ping(client, headers, clock, at, lat, lng):
+    clock["now"] = at
+    response = client.put("/api/partner/location", headers=headers, json={
+        "latitude": lat, "longitude": lng, "timestamp": at.timestamp(), "is_online": True,
+    })
+    assert response.status_code == 200
+
+
+def test_trail_crosses_an_hour(client, db, make_user, clock, monkeypatch):
+    monkeypatch.setattr(server, "TRAIL_FLUSH_POINTS", 4)
+    partner = make_user("rider", "agent")
+    hour = clock["now"] + timedelta(minutes=2)
+    # A zigzag, so simplification keeps every point
+    times = [hour + timedelta(seconds=s) for s in (-120, -90, -60, -30, -15, 15, 45, 75, 90, 120)]
+    fixes = [(at, round(12.97 + i * 0.001, 5), round(77.59 + (i % 2) * 0.001, 5)) for i, at in enumerate(times)]
+    for at, lat, lng in fixes:
+        ping(client, partner, clock, at, lat, lng)
+
+    buckets = {b["bucket"].replace(tzinfo=timezone.utc): b for b in run(db.location_trails.find({"partner_id": "rider"}).to_list(None))}
+    before, after = buckets[hour - timedelta(hours=1)], buckets[hour]
+    assert (len(before["chunks"]), before["points"], before["raw_points"]) == (2, 5, 5)
+    assert (before["start"].replace(tzinfo=timezone.utc), before["end"].replace(tzinfo=timezone.utc)) == (times[0], times[4])
+    assert (len(after["chunks"]), after["points"]) == (1, 3)
+    assert (after["start"].replace(tzinfo=timezone.utc), after["end"].replace(tzinfo=timezone.utc)) == (times[5], times[7])
+    assert len(server.trail_buffers["rider"][1]) == 2
+
+    response = client.get("/api/partners/rider/trail", headers=partner,
+                          params={"start": times[2].isoformat(), "end": times[8].isoformat()})
+    assert response.status_code == 200
+    points = [(p["lat"], p["lng"]) for p in response.json()["points"]]
+    # Flushed points on both sides of the hour plus the buffered one, clipped to the range
+    assert points == [(lat, lng) for _, lat, lng in fixes[2:9]]
+
+
+def test_failed_flush_keeps_points(client, db, make_user, clock, monkeypatch):
+    partner = make_user("rider", "agent")
+    start = clock["now"]
+    for i in range(3):
+        ping(client, partner, clock, start + timedelta(seconds=i), 12.97 + i * 0.001, 77.59 + (i % 2) * 0.001)
+
+    async def unreachable(*args, **kwargs):
+        raise AutoReconnect("connection refused")
+
+    monkeypatch.setattr(server, "db", SimpleNamespace(location_trails=SimpleNamespace(bulk_write=unreachable)))
+    run(server.flush_trail("rider"))
+    assert len(server.trail_buffers["rider"][1]) == 3
+
+    monkeypatch.setattr(server, "db", db)
+    run(server.flush_trail("rider"))
+    assert "rider" not in server.trail_buffers
+    stored = run(db.location_trails.find_one({"partner_id": "rider"}))
+    assert stored["raw_points"] == 3